@@ -1,48 +1,272 @@
-from fastapi import FastAPI, Depends, status, Request, Form, HTTPException, Cookie
+from fastapi import FastAPI, Depends, status, Request, Form, HTTPException, Cookie, Query
 from fastapi.security import OAuth2PasswordBearer
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse, Response
 from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
+from fastapi.exceptions import RequestValidationError
+from starlette.exceptions import HTTPException as StarletteHTTPException
 from sqlalchemy.orm import Session
 from jwt import PyJWTError, ExpiredSignatureError
+from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlencode
+import asyncio
 import os
+import re
+import json
+import math
 import secrets
+import jwt
 import uvicorn
 import models
+import search
+import catalog
+import facets
+import pagination
+import sampling
+import products
+import orders
+import jobs
+import recommendations
+import snapshot
+import startup
+from db_executor import DBExecutor
+from cart_store import CartStore, new_cart_id, valid_cart_id
+from passwords import PasswordHasher, HashingBusy
+from auth_cache import TokenCache, UserCache
+from cache import LRUCache, MISSING
+from page_cache import PageCache
+from product_rows import RowJSONResponse
+from rate_limit import TokenBucketLimiter
+from assets import AssetManifest, AssetStaticFiles
+from instrumentation import InstrumentationMiddleware, TimedTemplate, instrument_engine, metrics
 from database import SessionLocal, engine
-from sqlalchemy import create_engine, text
-from typing import Optional
-from datetime import datetime, timedelta
-import bcrypt
-import jwt
-import json
-from pydantic import BaseModel
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from fastapi.exceptions import RequestValidationError
-from starlette.exceptions import HTTPException as StarletteHTTPException
-import re
-from datetime import datetime, timedelta, timezone
-from fastapi.responses import JSONResponse
+from db_config import CATALOG_DB, build_engine, optimize
 
 # ===== Database setup =====
 
-sephora_engine = create_engine('sqlite:///sephora_products.db')
-skincare_engine = create_engine('sqlite:///skincare_sample.db')
-models.Base.metadata.create_all(bind=engine)
+skincare_engine = build_engine(CATALOG_DB)
+skincare_write_engine = build_engine(CATALOG_DB.writer())
+instrument_engine(engine, "user")
+instrument_engine(skincare_engine, "catalog")
+
+catalog_metadata = catalog.CatalogMetadata(skincare_engine)
+# Product rows for every worker come from one memory-mapped columnar file
+# (snapshot.py) instead of SQL plus a private cache per worker.
+catalog_snapshots = snapshot.SnapshotStore(
+    os.getenv("CATALOG_SNAPSHOT_PATH", ".snapshots/catalog.snap")
+) if os.getenv("CATALOG_SNAPSHOT", "1") == "1" else None
+featured_sampler = sampling.ProductSampler(skincare_engine, where="image_url IS NOT NULL",
+                                           snapshots=catalog_snapshots)
+shop_sampler = sampling.ProductSampler(
+    skincare_engine,
+    columns="product_id, product_name, brand_name, price_usd, sale_price_usd, image_url",
+    snapshots=catalog_snapshots
+)
+catalog_metadata.on_invalidate(featured_sampler.invalidate)
+catalog_metadata.on_invalidate(shop_sampler.invalidate)
+facet_index = facets.FacetIndex(skincare_engine, snapshots=catalog_snapshots)
+catalog_metadata.on_invalidate(facet_index.invalidate)
+related_products = recommendations.RelatedProducts(
+    os.getenv("RECOMMENDATIONS_DIR", ".recommendations"),
+    k=int(os.getenv("RECOMMENDATIONS_K", 12))
+)
+# Header typeahead: per-query results, answered from shorter cached prefixes
+# where possible, and a per-client token bucket.
+autocomplete = search.Autocomplete(
+    skincare_engine,
+    max_entries=int(os.getenv("AUTOCOMPLETE_CACHE_ENTRIES", 4096)),
+    max_bytes=int(os.getenv("AUTOCOMPLETE_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    ttl=float(os.getenv("AUTOCOMPLETE_CACHE_TTL", 300)),
+    candidates=int(os.getenv("AUTOCOMPLETE_CANDIDATES", 64))
+)
+catalog_metadata.on_invalidate(autocomplete.invalidate)
+autocomplete_limiter = TokenBucketLimiter(
+    rate=float(os.getenv("AUTOCOMPLETE_RATE", 10)),
+    burst=float(os.getenv("AUTOCOMPLETE_BURST", 20))
+)
+product_lookup = products.ProductLookup(skincare_engine, LRUCache(
+    max_bytes=int(os.getenv("PRODUCT_CACHE_MAX_BYTES", 16 * 1024 * 1024)),
+    ttl=float(os.getenv("PRODUCT_CACHE_TTL", 300))
+), snapshots=catalog_snapshots, missing_cache=LRUCache(
+    max_bytes=int(os.getenv("PRODUCT_MISSING_CACHE_MAX_BYTES", 1024 * 1024)),
+    max_entries=int(os.getenv("PRODUCT_MISSING_CACHE_MAX_ENTRIES", 10000)),
+    negative_ttl=float(os.getenv("PRODUCT_CACHE_NEGATIVE_TTL", 60))
+))
+catalog_metadata.on_invalidate(product_lookup.invalidate)
+db_executor = DBExecutor(max_workers=int(os.getenv("DB_POOL_WORKERS", 4)))
+password_hasher = PasswordHasher(
+    rounds=int(os.getenv("BCRYPT_ROUNDS", 12)),
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", 2)),
+    max_per_ip=int(os.getenv("PASSWORD_HASH_MAX_PER_IP", 2))
+)
 
 # ===== JWT Configuration =====
 SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_urlsafe(32))
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-app = FastAPI(title="LUNOR")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+token_cache = TokenCache(max_entries=int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", 10000)))
+user_cache = UserCache(
+    max_entries=int(os.getenv("USER_CACHE_MAX_ENTRIES", 10000)),
+    ttl=float(os.getenv("USER_CACHE_TTL", 300)),
+    eager_addresses=os.getenv("USER_CACHE_EAGER_ADDRESSES", "1") == "1"
+)
+
+order_writer = orders.OrderWriter(
+    engine,
+    max_batch=int(os.getenv("ORDER_BATCH_MAX", 64)),
+    max_wait=float(os.getenv("ORDER_BATCH_WAIT_MS", 2)) / 1000
+)
+cart_store = CartStore(engine, max_pending=int(os.getenv("CART_MAX_PENDING", 512)))
+CART_FLUSH_INTERVAL = float(os.getenv("CART_FLUSH_INTERVAL", 1.0))
+CART_SWEEP_INTERVAL = float(os.getenv("CART_SWEEP_INTERVAL", 3600))
+CART_ANONYMOUS_TTL = float(os.getenv("CART_ANONYMOUS_TTL_DAYS", 30)) * 86400
+CART_USER_TTL = float(os.getenv("CART_USER_TTL_DAYS", 180)) * 86400
+
+
+# ===== Background jobs =====
+CATALOG_POLL_INTERVAL = float(os.getenv("CATALOG_POLL_INTERVAL", 5))
+CACHE_SWEEP_INTERVAL = float(os.getenv("CACHE_SWEEP_INTERVAL", 300))
+SQLITE_OPTIMIZE_INTERVAL = float(os.getenv("SQLITE_OPTIMIZE_INTERVAL", 6 * 3600))
+WARM_PRODUCTS = int(os.getenv("WARM_PRODUCTS", 200))
+
+scheduler = jobs.JobScheduler(max_concurrent=int(os.getenv("JOB_CONCURRENCY", 2)))
+
+
+async def flush_carts():
+    return await db_executor.run(cart_store.flush)
+
+
+async def sweep_carts():
+    return await db_executor.run(cart_store.sweep, CART_ANONYMOUS_TTL, CART_USER_TTL)
+
+
+async def sweep_caches():
+    # Expired tokens, users and products otherwise sit in memory until an
+    # LRU eviction reaches them.
+    return {
+        "tokens": token_cache.cache.purge_expired(),
+        "users": user_cache.cache.purge_expired(),
+        "products": product_lookup.detail_cache.purge_expired(),
+        "missing_products": product_lookup.missing_cache.purge_expired(),
+        "autocomplete": autocomplete.cache.purge_expired(),
+    }
+
+
+async def watch_catalog():
+    # Bulk loads (catalog_io.py) run in another process and bump
+    # catalog_revision; drop this worker's catalog caches when it moves.
+    if catalog_snapshots is not None:
+        # Map (or build) the new snapshot first, so the caches invalidated
+        # below reload from it.
+        await asyncio.to_thread(catalog_snapshots.ensure_current, skincare_engine)
+    if not await db_executor.run(catalog_metadata.refresh_if_changed):
+        return False
+    print(f"Catalog changed, caches invalidated (revision {catalog_metadata.revision})")
+    scheduler.trigger("rebuild_catalog_indexes")
+    return True
+
+
+async def rebuild_catalog_indexes():
+    # Patch the facet index here rather than in the next /shop request.
+    await db_executor.run(facet_index.refresh)
+    # CPU-bound and possibly long; keep it off the DB pool.
+    await asyncio.to_thread(related_products.ensure_current, skincare_engine)
+    scheduler.trigger("analyze_catalog")
+    scheduler.trigger("warm_products")
+    return catalog_metadata.revision
+
+
+async def analyze_catalog():
+    # A bulk import changes row counts and value spreads wholesale.
+    await asyncio.to_thread(optimize, skincare_write_engine, True)
+
+
+async def optimize_databases():
+    await asyncio.to_thread(optimize, engine)
+    await asyncio.to_thread(optimize, skincare_write_engine)
+
+
+async def warm_products():
+    return await db_executor.run(product_lookup.warm, WARM_PRODUCTS)
+
+
+scheduler.add("flush_carts", flush_carts, interval=CART_FLUSH_INTERVAL, limited=False)
+scheduler.add("sweep_carts", sweep_carts, interval=CART_SWEEP_INTERVAL)
+scheduler.add("sweep_caches", sweep_caches, interval=CACHE_SWEEP_INTERVAL)
+scheduler.add("watch_catalog", watch_catalog, interval=CATALOG_POLL_INTERVAL, limited=False)
+scheduler.add("rebuild_catalog_indexes", rebuild_catalog_indexes)
+scheduler.add("analyze_catalog", analyze_catalog)
+scheduler.add("optimize_databases", optimize_databases, interval=SQLITE_OPTIMIZE_INTERVAL)
+scheduler.add("warm_products", warm_products)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    timings = startup.run_startup(
+        engine, skincare_write_engine, templates, catalog_metadata, [featured_sampler, shop_sampler],
+        facet_index=facet_index,
+        related_products=related_products,
+        build_recommendations=os.getenv("BUILD_RECOMMENDATIONS", "1") == "1",
+        catalog_snapshots=catalog_snapshots,
+        precompile=os.getenv("PRECOMPILE_TEMPLATES", "1") == "1",
+        warm=os.getenv("WARM_CACHES", "1") == "1",
+        asset_manifest=asset_manifest if os.getenv("BUILD_ASSETS", "1") == "1" else None
+    )
+    print(f"Startup finished: {timings}")
+    scheduler.start()
+    scheduler.trigger("sweep_carts")
+    scheduler.trigger("warm_products")
+    yield
+    await scheduler.stop()
+    try:
+        cart_store.flush()
+    except Exception as e:
+        print(f"Error flushing carts: {e}")
+    order_writer.shutdown()
+    db_executor.shutdown(wait=False)
+    password_hasher.shutdown()
+
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app = FastAPI(title="LUNOR", lifespan=lifespan)
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+# Per-route latency, SQL and template time on /metrics. With PROFILE_TOKEN set,
+# ?__profile=1 plus a matching X-Profile-Token header returns the request's
+# sampled stacks instead of its body.
+app.add_middleware(
+    InstrumentationMiddleware,
+    profile_token=os.getenv("PROFILE_TOKEN") or None,
+    profile_interval=float(os.getenv("PROFILE_INTERVAL_MS", 1)) / 1000
+)
+
+app.mount("/static", AssetStaticFiles(directory="static"), name="static")
+asset_manifest = AssetManifest("static", url_prefix="/static")
 templates = Jinja2Templates(directory="templates")
+templates.env.template_class = TimedTemplate
+templates.env.globals["asset_url"] = asset_manifest.url
+templates.env.globals["asset_urls"] = asset_manifest.urls
+templates.env.bytecode_cache = startup.template_bytecode_cache(os.getenv("TEMPLATE_CACHE_DIR", ".jinja_cache"))
+page_cache = PageCache(templates, max_bytes=int(os.getenv("PAGE_CACHE_MAX_BYTES", 8 * 1024 * 1024)))
+
+metrics.register_collector("product_cache", product_lookup.detail_cache.stats)
+metrics.register_collector("product_missing_cache", product_lookup.missing_cache.stats)
+metrics.register_collector("page_cache", page_cache.stats)
+metrics.register_collector("token_cache", token_cache.stats)
+metrics.register_collector("user_cache", user_cache.stats)
+metrics.register_collector("catalog", catalog_metadata.stats)
+metrics.register_collector("facets", facet_index.stats)
+metrics.register_collector("related_products", related_products.stats)
+if catalog_snapshots is not None:
+    metrics.register_collector("catalog_snapshot", catalog_snapshots.stats)
+metrics.register_collector("autocomplete", autocomplete.stats)
+metrics.register_collector("autocomplete_limiter", autocomplete_limiter.stats)
+metrics.register_collector("jobs", scheduler.stats)
+metrics.register_collector("cart_store", cart_store.stats)
+metrics.register_collector("order_writer", order_writer.stats)
+metrics.register_collector("db_executor", db_executor.stats)
+metrics.register_collector("password_hasher", password_hasher.stats)
 
 
 # ===== Cart functionality =====
@@ -52,6 +276,7 @@ class CartItem(BaseModel):
 
 
 def get_cart_from_cookie(request: Request, cart_cookie: Optional[str] = None) -> list:
+    # Legacy JSON-in-cookie carts; only read to move them into the cart store.
     if cart_cookie is None:
         cart_cookie = request.cookies.get("cart")
     if not cart_cookie:
@@ -62,16 +287,44 @@ def get_cart_from_cookie(request: Request, cart_cookie: Optional[str] = None) ->
         return []
 
 
-def set_cart_cookie(response: RedirectResponse, cart: list):
+def get_cart_id(request: Request) -> Optional[str]:
+    cart_id = request.cookies.get("cart_id")
+    return cart_id if valid_cart_id(cart_id) else None
+
+
+def set_cart_cookie(response, cart_id: str):
     response.set_cookie(
-        key="cart",
-        value=json.dumps(cart),
+        key="cart_id",
+        value=cart_id,
+        max_age=int(CART_USER_TTL),
         httponly=True,
         secure=False,
         samesite="lax"
     )
 
 
+def adopt_legacy_cart(request: Request, cart_id: Optional[str]) -> tuple:
+    # Moves a cart still held in the old "cart" cookie into the store once.
+    # Returns (cart_id, adopted); when adopted, the caller must store the id
+    # with set_cart_cookie() and drop the "cart" cookie.
+    legacy_items = get_cart_from_cookie(request)
+    if not legacy_items:
+        return cart_id, False
+    if cart_id is None:
+        cart_id = new_cart_id()
+    for item in legacy_items:
+        try:
+            cart_store.add(cart_id, str(item["product_id"]), int(item["quantity"]))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return cart_id, True
+
+
+def finish_legacy_cart(response, cart_id: str):
+    set_cart_cookie(response, cart_id)
+    response.delete_cookie("cart")
+
+
 def extract_name_from_email(email: str) -> str:
     name_part = email.split("@")[0]
     name_part = re.sub(r'[^A-Za-z_]', '', name_part)
@@ -97,64 +350,45 @@ def create_jwt(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     return encoded_jwt
 
 
-def verify_password(password: str, hashed: str) -> bool:
-    try:
-        return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
-    except (ValueError, TypeError):
-        return False
-
-
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
 
 
 def get_current_user_from_cookie(token: Optional[str] = Cookie(None)) -> Optional[str]:
     if not token:
         return None
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        if payload.get("type") != "access":
+    payload = token_cache.get(token)
+    if payload is MISSING:
+        return None
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except ExpiredSignatureError:
             return None
-        username: str = payload.get("sub")
-        if username is None:
+        except PyJWTError:
+            token_cache.set_invalid(token)
             return None
-        return username
-    except ExpiredSignatureError:
-        return None
-    except PyJWTError:
+        except Exception as e:
+            print(f"Unexpected error in token validation: {e}")
+            return None
+        token_cache.set(token, payload)
+    if payload.get("type") != "access":
         return None
-    except Exception as e:
-        print(f"Unexpected error in token validation: {e}")
+    username: str = payload.get("sub")
+    if username is None:
         return None
+    return username
 
 
 # ======== INDEX ========
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request, username: Optional[str] = Depends(get_current_user_from_cookie)):
-    try:
+    def sample_home_products():
         with skincare_engine.connect() as connection:
-            query1 = text("""
-                SELECT product_id, product_name, brand_name, rating, reviews, 
-                       price_usd, sale_price_usd, image_url 
-                FROM products
-                WHERE image_url IS NOT NULL
-                ORDER BY RANDOM()
-                LIMIT 12
-            """)
-            query2 = text("""
-                SELECT product_id, product_name, brand_name, rating, reviews, 
-                       price_usd, sale_price_usd, image_url 
-                FROM products
-                WHERE image_url IS NOT NULL
-                ORDER BY RANDOM()
-                LIMIT 8
-            """)
-
-            result1 = connection.execute(query1)
-            result2 = connection.execute(query2)
-
-            random_products1 = [dict(row._mapping) for row in result1]
-            random_products2 = [dict(row._mapping) for row in result2]
+            return featured_sampler.sample_groups(connection, 12, 8)
+
+    try:
+        random_products1, random_products2 = await db_executor.run(sample_home_products)
     except Exception as e:
         print(f"Error fetching products: {e}")
         random_products1, random_products2 = [], []
@@ -171,32 +405,26 @@ async def index(request: Request, username: Optional[str] = Depends(get_current_
 @app.get("/cart", response_class=HTMLResponse)
 async def cart(request: Request,
                username: Optional[str] = Depends(get_current_user_from_cookie)):
-    cart_items = get_cart_from_cookie(request)
-    items = []
+    cart_id, adopted = adopt_legacy_cart(request, get_cart_id(request))
+    items, cart_total = [], 0.0
 
-    if cart_items:
+    if cart_id:
         try:
-            with skincare_engine.connect() as connection:
-                for item in cart_items:
-                    query = text("""
-                        SELECT product_id, product_name, brand_name, price_usd, sale_price_usd, image_url
-                        FROM products 
-                        WHERE product_id = :pid
-                    """)
-                    result = connection.execute(query, {"pid": item['product_id']})
-                    product_row = result.mappings().first()
-                    if product_row:
-                        product_info = dict(product_row)
-                        product_info['quantity'] = item['quantity']
-                        items.append(product_info)
+            cart_items = await db_executor.run(cart_store.items, cart_id)
+            if cart_items:
+                items, cart_total = await db_executor.run(product_lookup.cart_lines, cart_items)
         except Exception as e:
             print(f"Error fetching cart items: {e}")
 
-    return templates.TemplateResponse("cart.html", {
+    response = templates.TemplateResponse("cart.html", {
         "request": request,
         "username": username,
-        "items": items
+        "items": items,
+        "cart_total": cart_total
     })
+    if adopted:
+        finish_legacy_cart(response, cart_id)
+    return response
 
 
 @app.get("/add_to_cart/{product_id}")
@@ -204,28 +432,80 @@ async def add_to_cart(
         request: Request,
         product_id: str
 ):
-    cart_cookie = request.cookies.get("cart")
-    cart_items = get_cart_from_cookie(request)
+    cart_id, adopted = adopt_legacy_cart(request, get_cart_id(request))
+    response = RedirectResponse(url="/cart", status_code=302)
+    if cart_id is None:
+        cart_id = new_cart_id()
+        set_cart_cookie(response, cart_id)
+    elif adopted:
+        finish_legacy_cart(response, cart_id)
+
+    cart_store.add(cart_id, product_id)
+    try:
+        await db_executor.run(cart_store.flush, cart_id)
+    except Exception as e:
+        print(f"Error flushing carts: {e}")
+    return response
 
-    found = False
-    for item in cart_items:
-        if item["product_id"] == product_id:
-            item["quantity"] += 1
-            found = True
-            break
 
-    if not found:
-        cart_items.append({"product_id": product_id, "quantity": 1})
+@app.post("/checkout")
+async def checkout(request: Request, db: Session = Depends(get_db),
+                   username: Optional[str] = Depends(get_current_user_from_cookie)):
+    cart_id, adopted = adopt_legacy_cart(request, get_cart_id(request))
+    if cart_id is None:
+        raise HTTPException(status_code=400, detail="Cart is empty")
+
+    def load_order():
+        # The order writer checks the stored cart against the priced lines,
+        # so this worker's pending clicks for it must be stored first.
+        cart_store.flush(cart_id)
+        cart_items = cart_store.items(cart_id)
+        with skincare_engine.connect() as connection:
+            order = orders.price_order(connection, cart_items)
+        user = user_cache.get(db, username) if username else None
+        return order, user["id"] if user else None
 
-    response = RedirectResponse(url="/cart", status_code=302)
-    set_cart_cookie(response, cart_items)
+    try:
+        order, user_id = await db_executor.run(load_order)
+        order_id = await order_writer.place(order, user_id=user_id, cart_id=cart_id)
+    except orders.EmptyCart:
+        raise HTTPException(status_code=400, detail="Cart is empty")
+    except orders.CartChanged:
+        raise HTTPException(status_code=409, detail="Cart changed during checkout, please review it")
+    except orders.OutOfStock as e:
+        response = JSONResponse(content={"detail": "Some items are out of stock", "product_ids": e.product_ids},
+                                status_code=409)
+        if adopted:
+            finish_legacy_cart(response, cart_id)
+        return response
+    except Exception as e:
+        print(f"Error placing order: {e}")
+        raise HTTPException(status_code=503, detail="Checkout is temporarily unavailable")
+
+    response = JSONResponse(content={
+        "message": "Checkout successful",
+        "order_id": order_id,
+        "items": order["item_count"],
+        "total": order["total"]
+    }, status_code=200)
+    if adopted:
+        finish_legacy_cart(response, cart_id)
     return response
 
 
-@app.post("/checkout")
-async def checkout(response: RedirectResponse = RedirectResponse(url="/")):
-    set_cart_cookie(response, [])
-    return JSONResponse(content={"message": "Checkout successful"}, status_code=200)
+async def attach_cart(request: Request, response, user_id: int):
+    # On sign-in the anonymous cart is merged into the user's own cart, and the
+    # cookie switches to that cart's id.
+    cart_id, adopted = adopt_legacy_cart(request, get_cart_id(request))
+    if adopted:
+        response.delete_cookie("cart")
+    try:
+        cart_id = await db_executor.run(cart_store.merge, cart_id, user_id)
+    except Exception as e:
+        print(f"Error merging carts: {e}")
+    if cart_id:
+        set_cart_cookie(response, cart_id)
+
 
 # ======== AUTH ========
 @app.get("/register", response_class=HTMLResponse)
@@ -234,29 +514,43 @@ def register(request: Request):
 
 
 @app.post("/register")
-def register(
+async def register(
+        request: Request,
         username: str = Form(..., min_length=3, max_length=50),
         password: str = Form(..., min_length=6),
         country: str = Form(..., min_length=2, max_length=50),
         db: Session = Depends(get_db)
 ):
-    existing_user = db.query(models.User).filter(models.User.username == username).first()
+    existing_user = await db_executor.run(
+        lambda: db.query(models.User).filter(models.User.username == username).first()
+    )
     if existing_user:
         raise HTTPException(status_code=400, detail="User already exists")
 
-    hashed_password = hash_password(password)
+    try:
+        async with password_hasher.limit(client_ip(request)):
+            hashed_password = await password_hasher.hash(password)
+    except HashingBusy:
+        raise HTTPException(status_code=429, detail="Too many attempts, try again shortly")
+
     new_user = models.User(
         username=username,
         hashed_password=hashed_password,
         country=country
     )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+
+    def save_user():
+        db.add(new_user)
+        db.commit()
+        db.refresh(new_user)
+
+    await db_executor.run(save_user)
+    user_cache.invalidate(new_user.username)
 
     token = create_jwt({"sub": new_user.username})
     response = RedirectResponse(url="/account", status_code=status.HTTP_302_FOUND)
     response.set_cookie(key="token", value=token, httponly=True, secure=False, samesite="lax")
+    await attach_cart(request, response, new_user.id)
     return response
 
 
@@ -266,18 +560,32 @@ def login(request: Request):
 
 
 @app.post("/login")
-def login(
+async def login(
+        request: Request,
         username: str = Form(...),
         password: str = Form(...),
         db: Session = Depends(get_db)
 ):
-    db_user = db.query(models.User).filter(models.User.username == username).first()
-    if not db_user or not verify_password(password, db_user.hashed_password):
-        raise HTTPException(status_code=401, detail="Incorrect username or password")
+    db_user = await db_executor.run(
+        lambda: db.query(models.User).filter(models.User.username == username).first()
+    )
+    try:
+        async with password_hasher.limit(client_ip(request)):
+            if not db_user or not await password_hasher.verify(password, db_user.hashed_password):
+                raise HTTPException(status_code=401, detail="Incorrect username or password")
+
+            # Upgrade hashes made with a different work factor while we have the
+            # plaintext, so changing BCRYPT_ROUNDS migrates users as they log in.
+            if password_hasher.needs_rehash(db_user.hashed_password):
+                db_user.hashed_password = await password_hasher.hash(password)
+                await db_executor.run(db.commit)
+    except HashingBusy:
+        raise HTTPException(status_code=429, detail="Too many attempts, try again shortly")
 
     token = create_jwt({"sub": db_user.username})
     response = RedirectResponse(url="/account", status_code=status.HTTP_302_FOUND)
     response.set_cookie(key="token", value=token, httponly=True, secure=False, samesite="lax")
+    await attach_cart(request, response, db_user.id)
     return response
 
 
@@ -288,18 +596,18 @@ def account(request: Request, db: Session = Depends(get_db),
     if not username:
         return RedirectResponse("/login?error=not_logged_in")
 
-    user = db.query(models.User).filter(models.User.username == username).first()
+    user = user_cache.get(db, username)
     if not user:
         return RedirectResponse("/login?error=not_found")
 
-    display_name = re.sub(r'[\d_]+', ' ', user.username.split("@")[0]).title()
+    display_name = re.sub(r'[\d_]+', ' ', user["username"].split("@")[0]).title()
 
     return templates.TemplateResponse("account.html", {
         "request": request,
         "username": display_name,
-        "email": user.username,
-        "country": user.country,
-        "addresses": user.addresses
+        "email": user["username"],
+        "country": user["country"],
+        "addresses": user["addresses"]
     })
 
 
@@ -307,56 +615,46 @@ def account(request: Request, db: Session = Depends(get_db),
 def logout():
     response = RedirectResponse(url="/")
     response.delete_cookie("token")
+    # The cart stays with the account; the next visitor on this browser starts empty.
+    response.delete_cookie("cart_id")
     return response
 
 
 # =====  Pages =====
+def static_page(request: Request, template_name: str, username: Optional[str]):
+    if username is None:
+        return page_cache.page(request, template_name, {"username": None})
+    return page_cache.render_page(request, template_name, {"username": username})
+
+
 @app.get("/privacy", response_class=HTMLResponse)
 def privacy(request: Request, username: Optional[str] = Depends(get_current_user_from_cookie)):
-    return templates.TemplateResponse("privacy.html", {
-        "request": request,
-        "username": username
-    })
+    return static_page(request, "privacy.html", username)
 
 
 @app.get("/accessibility", response_class=HTMLResponse)
 def accessibility(request: Request, username: Optional[str] = Depends(get_current_user_from_cookie)):
-    return templates.TemplateResponse("accessibility.html", {
-        "request": request,
-        "username": username
-    })
+    return static_page(request, "accessibility.html", username)
 
 
 @app.get("/faqs", response_class=HTMLResponse)
 def faqs(request: Request, username: Optional[str] = Depends(get_current_user_from_cookie)):
-    return templates.TemplateResponse("faqs.html", {
-        "request": request,
-        "username": username
-    })
+    return static_page(request, "faqs.html", username)
 
 
 @app.get("/returns", response_class=HTMLResponse)
 def returns(request: Request, username: Optional[str] = Depends(get_current_user_from_cookie)):
-    return templates.TemplateResponse("returns.html", {
-        "request": request,
-        "username": username
-    })
+    return static_page(request, "returns.html", username)
 
 
 @app.get("/termsofservice", response_class=HTMLResponse)
 def privacy(request: Request, username: Optional[str] = Depends(get_current_user_from_cookie)):
-    return templates.TemplateResponse("termsofservice.html", {
-        "request": request,
-        "username": username
-    })
+    return static_page(request, "termsofservice.html", username)
 
 
 @app.get("/about", response_class=HTMLResponse)
 async def about(request: Request, username: Optional[str] = Depends(get_current_user_from_cookie)):
-    return templates.TemplateResponse("about.html", {
-        "request": request,
-        "username": username
-    })
+    return static_page(request, "about.html", username)
 
 
 # ===== product =====
@@ -367,21 +665,12 @@ async def product_detail(
         username: Optional[str] = Depends(get_current_user_from_cookie)
 ):
     try:
-        with skincare_engine.connect() as connection:
-            query = text("""
-                SELECT * FROM products 
-                WHERE product_id = :product_id
-            """)
-            result = connection.execute(query, {"product_id": product_id})
-            product_row = result.mappings().first()
-
-            if not product_row:
-                raise HTTPException(status_code=404, detail="Product not found")
-
-            product = dict(product_row)
-
+        product = await db_executor.run(product_lookup.get, product_id)
     except Exception as e:
         print(f"Error fetching product: {e}")
+        product = None
+
+    if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
     return templates.TemplateResponse("product.html", {
@@ -391,177 +680,195 @@ async def product_detail(
     })
 
 
+@app.get("/related_products")
+async def related_products_endpoint(current_product: str, category: Optional[str] = None, limit: int = 8):
+    # Served from the memory-mapped index only. `category` is what
+    # product.html sends; neighbours already come from the product's own
+    # primary category. The cards are stored as JSON, so they are spliced
+    # into the response without being decoded.
+    return Response(related_products.related_json(current_product, max(1, min(limit, related_products.k))),
+                    media_type="application/json")
+
+
 # =================================
 @app.get("/shop", response_class=HTMLResponse)
 async def shop(
         request: Request,
         page: int = 1,
-        category: Optional[str] = None,
-        brand: Optional[str] = None,
+        category: List[str] = Query([]),
+        brand: List[str] = Query([]),
         max_price: Optional[float] = None,
         min_rating: Optional[float] = None,
         in_stock: bool = False,
+        new: bool = False,
+        limited_edition: bool = False,
+        sephora_exclusive: bool = False,
+        online_only: bool = False,
         sort: str = "rating_desc",
+        cursor: Optional[str] = None,
         username: Optional[str] = Depends(get_current_user_from_cookie)
 ):
-    try:
+    # category and brand may repeat (?category=Skincare&category=Hair): OR
+    # within a facet, AND across facets and flags.
+    sort = pagination.resolve_sort(sort)
+    per_page = 12
+    flag_values = {"in_stock": in_stock, "new": new, "limited_edition": limited_edition,
+                   "sephora_exclusive": sephora_exclusive, "online_only": online_only}
+    flags = [flag for flag, selected in flag_values.items() if selected]
+
+    def load_shop_page() -> dict:
+        # ?cursor= continues after the last row of the previous page instead of
+        # skipping `offset` rows, so page 500 costs the same as page 1.
+        cursor_values = pagination.decode_cursor(cursor, sort) if cursor else None
+        result = facet_index.search(
+            categories=category, brands=brand, flags=flags, max_price=max_price, min_rating=min_rating,
+            sort=sort,
+            offset=0 if cursor_values is not None else (page - 1) * per_page,
+            limit=per_page,
+            after=cursor_values
+        )
+        page_products = product_lookup.get_many(result["ids"], pagination.LISTING_COLUMNS)
         with skincare_engine.connect() as connection:
-            query = text("""
-                SELECT product_id, product_name, brand_name, rating, reviews, 
-                       price_usd, sale_price_usd, image_url, primary_category,
-                       out_of_stock, new
-                FROM products 
-                WHERE 1=1
-            """)
-
-            conditions = []
-            params = {}
-
-            if category:
-                conditions.append("primary_category = :category")
-                params["category"] = category
-
-            if brand:
-                conditions.append("brand_name = :brand")
-                params["brand"] = brand
-
-            if max_price:
-                conditions.append("COALESCE(NULLIF(sale_price_usd, 0), price_usd) <= :max_price")
-                params["max_price"] = max_price
-
-            if min_rating:
-                conditions.append("rating >= :min_rating")
-                params["min_rating"] = min_rating
-
-            if in_stock:
-                conditions.append("out_of_stock = 0")
-
-            if conditions:
-                query = text(str(query) + " AND " + " AND ".join(conditions))
-
-            sort_mapping = {
-                "rating_desc": "rating DESC, reviews DESC",
-                "price_asc": "COALESCE(NULLIF(sale_price_usd, 0), price_usd) ASC",
-                "price_desc": "COALESCE(NULLIF(sale_price_usd, 0), price_usd) DESC",
-                "name_asc": "product_name ASC",
-                "name_desc": "product_name DESC",
-                "new": "new DESC, rating DESC"
-            }
-            order_by = sort_mapping.get(sort, "rating DESC, reviews DESC")
-
-            per_page = 12
-            offset = (page - 1) * per_page
-
-            paginated_query = text(f"""
-                WITH filtered_products AS (
-                    {str(query)}
-                )
-                SELECT * FROM filtered_products
-                ORDER BY {order_by}
-                LIMIT :limit OFFSET :offset
-            """)
-
-            params["limit"] = per_page
-            params["offset"] = offset
-
-            result = connection.execute(paginated_query, params)
-            products = [dict(row._mapping) for row in result]
-
-            count_query = text(f"""
-                SELECT COUNT(*) as total_count
-                FROM products
-                WHERE 1=1 {'AND ' + ' AND '.join(conditions) if conditions else ''}
-            """)
-            count_result = connection.execute(count_query,
-                                              {k: v for k, v in params.items() if k not in ['limit', 'offset']})
-            total_products = count_result.scalar() or 0
-            total_pages = (total_products + per_page - 1) // per_page
-
-            categories_result = connection.execute(text("""
-                SELECT DISTINCT primary_category FROM products 
-                WHERE primary_category IS NOT NULL 
-                ORDER BY primary_category
-            """))
-            categories = [row[0] for row in categories_result if row[0]]
-
-            brands_result = connection.execute(text("""
-                SELECT DISTINCT brand_name FROM products 
-                WHERE brand_name IS NOT NULL 
-                ORDER BY brand_name
-            """))
-            brands = [row[0] for row in brands_result if row[0]]
-
-            max_price_result = connection.execute(text("""
-                SELECT MAX(COALESCE(NULLIF(sale_price_usd, 0), price_usd)) 
-                FROM products 
-                WHERE price_usd IS NOT NULL
-            """))
-            max_price_value = max_price_result.scalar() or 100
-
-            random_query = text("""
-                SELECT product_id, product_name, brand_name, price_usd, sale_price_usd, image_url
-                FROM products
-                ORDER BY RANDOM()
-                LIMIT 20
-            """)
-            random_result = connection.execute(random_query)
-            random_products = [dict(row._mapping) for row in random_result]
+            random_products = shop_sampler.sample(connection, 20)
+
+        # Next always continues by cursor, on numbered pages too, so following
+        # it never walks OFFSET pages. Both links keep the current filters.
+        filter_query = {k: v for k, v in {
+            "category": category, "brand": brand, "max_price": max_price, "min_rating": min_rating,
+            **{flag: "true" for flag in flags}, "sort": sort
+        }.items() if v is not None}
+        first_url = "/shop?" + urlencode(filter_query, doseq=True)
+        next_url = None
+        if result["has_more"] and page_products:
+            next_query = {**filter_query, "cursor": pagination.encode_cursor(sort, page_products[-1])}
+            next_url = "/shop?" + urlencode(next_query, doseq=True)
+
+        total_products = result["total"]
+        return {
+            "products": page_products,
+            "random_products": random_products,
+            "categories": catalog_metadata.categories(),
+            "brands": catalog_metadata.brands(),
+            "facet_counts": result["counts"],
+            "total_products": total_products,
+            "total_pages": (total_products + per_page - 1) // per_page,
+            "first_url": first_url,
+            "next_url": next_url,
+            "max_price": catalog_metadata.max_price(),
+        }
 
+    try:
+        shop_page = await db_executor.run(load_shop_page)
     except Exception as e:
         print(f"Error fetching products: {e}")
-        products = []
-        random_products = []
-        categories = []
-        brands = []
-        total_products = 0
-        total_pages = 1
-        max_price_value = 100
+        shop_page = {
+            "products": [],
+            "random_products": [],
+            "categories": [],
+            "brands": [],
+            "facet_counts": {"categories": {}, "brands": {}, "flags": {}},
+            "total_products": 0,
+            "total_pages": 1,
+            "first_url": "/shop",
+            "next_url": None,
+            "max_price": 100,
+        }
 
     return templates.TemplateResponse("shop.html", {
         "request": request,
         "username": username,
-        "products": products,
-        "random_products": random_products,
-        "categories": categories,
-        "brands": brands,
-        "total_products": total_products,
-        "total_pages": total_pages,
+        "products": shop_page["products"],
+        "random_products": shop_page["random_products"],
+        "categories": shop_page["categories"],
+        "brands": shop_page["brands"],
+        "category_counts": shop_page["facet_counts"]["categories"],
+        "brand_counts": shop_page["facet_counts"]["brands"],
+        "flag_counts": shop_page["facet_counts"]["flags"],
+        "total_products": shop_page["total_products"],
+        "total_pages": shop_page["total_pages"],
         "page": page,
-        "max_price": max_price_value,
+        "cursor": cursor,
+        "first_url": shop_page["first_url"],
+        "next_url": shop_page["next_url"],
+        "max_price": shop_page["max_price"],
         "current_filters": {
             "category": category,
             "brand": brand,
             "max_price": max_price,
             "min_rating": min_rating,
-            "in_stock": in_stock,
+            **flag_values,
             "sort": sort
         }
     })
 
 
 # ======================================
+AUTOCOMPLETE_LIMIT = 5
+AUTOCOMPLETE_MAX_QUERY = 100
+AUTOCOMPLETE_BATCH_MAX = int(os.getenv("AUTOCOMPLETE_BATCH_MAX", 8))
+AUTOCOMPLETE_CACHE_CONTROL = f"public, max-age={int(os.getenv('AUTOCOMPLETE_MAX_AGE', 60))}"
+
+
+def autocomplete_keys(queries: list) -> list:
+    return [search.normalize_query(q[:AUTOCOMPLETE_MAX_QUERY]) if q and len(q) >= 2 else "" for q in queries]
+
+
+async def autocomplete_lookup(key: str) -> list:
+    # Cache (or a cached shorter prefix) first; the database only on a miss.
+    if not key:
+        return []
+    hits = autocomplete.cached(key, AUTOCOMPLETE_LIMIT)
+    if hits is None:
+        hits = await db_executor.run(autocomplete.search, key, AUTOCOMPLETE_LIMIT)
+    return hits
+
+
+def autocomplete_throttled(request: Request, cost: int):
+    wait = autocomplete_limiter.acquire(client_ip(request), cost)
+    if not wait:
+        return None
+    return JSONResponse(content={"detail": "Too many requests"}, status_code=429,
+                        headers={"Retry-After": str(max(1, math.ceil(wait)))})
+
+
 @app.get("/search_products")
 async def search_products(request: Request, q: str = ""):
     if not q or len(q) < 2:
         return []
+    throttled = autocomplete_throttled(request, 1)
+    if throttled is not None:
+        return throttled
 
     try:
-        with skincare_engine.connect() as connection:
-            query = text("""
-                SELECT product_id, product_name, brand_name, image_url
-                FROM products 
-                WHERE product_name LIKE :query OR brand_name LIKE :query
-                ORDER BY rating DESC, reviews DESC
-                LIMIT 5
-            """)
-            result = connection.execute(query, {"query": f"%{q}%"})
-            products = [dict(row._mapping) for row in result]
-            return products
+        # Returned as a response so the rows go straight to orjson.
+        hits = await autocomplete_lookup(autocomplete_keys([q])[0])
+        return RowJSONResponse(hits, headers={"Cache-Control": AUTOCOMPLETE_CACHE_CONTROL})
     except Exception as e:
         print(f"Error searching products: {e}")
         return []
 
 
+@app.get("/search_products/batch")
+async def search_products_batch(request: Request, q: List[str] = Query([])):
+    # Several queries in one round trip (?q=ce&q=cer&q=cera), e.g. from a
+    # client that buffered keystrokes: {query: hits}.
+    queries = list(dict.fromkeys(q))[:AUTOCOMPLETE_BATCH_MAX]
+    if not queries:
+        return {}
+    throttled = autocomplete_throttled(request, len(queries))
+    if throttled is not None:
+        return throttled
+
+    results = {}
+    try:
+        for query, key in zip(queries, autocomplete_keys(queries)):
+            results[query] = await autocomplete_lookup(key)
+    except Exception as e:
+        print(f"Error searching products: {e}")
+        return RowJSONResponse(results)
+    return RowJSONResponse(results, headers={"Cache-Control": AUTOCOMPLETE_CACHE_CONTROL})
+
+
 # ===========Error================
 @app.exception_handler(StarletteHTTPException)
 async def http_exception_handler(request: Request, exc: StarletteHTTPException):
@@ -581,6 +888,38 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     )
 
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4",
+                             headers={"Cache-Control": "no-store"})
+
+
+# Both need JOBS_TOKEN set and a matching X-Jobs-Token header: job status
+# carries raw error text (SQL, file paths). Without a token both answer 403;
+# run counts and durations are still on /metrics.
+JOBS_TOKEN = os.getenv("JOBS_TOKEN") or None
+
+
+def jobs_authorized(request: Request) -> bool:
+    return JOBS_TOKEN is not None and secrets.compare_digest(request.headers.get("x-jobs-token", ""), JOBS_TOKEN)
+
+
+@app.get("/jobs")
+async def jobs_status(request: Request):
+    if not jobs_authorized(request):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return JSONResponse(content=scheduler.status(), headers={"Cache-Control": "no-store"})
+
+
+@app.post("/jobs/{name}/run")
+async def run_job(name: str, request: Request):
+    if not jobs_authorized(request):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if not scheduler.trigger(name):
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return JSONResponse(content={"job": name, "triggered": True}, status_code=202)
+
+
 @app.get("/error")
 async def error():
     raise RuntimeError("Test server error")
@@ -0,0 +1,212 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from mimetypes import guess_type
+from stat import S_ISREG
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# ===== Static asset pipeline =====
+# `python assets.py build` (also run at start-up when the manifest is
+# missing or older than a source file)
+# minifies CSS, concatenates bundles, writes every CSS/JS file to
+# static/dist/ under a content-hashed name with .gz (and .br when the brotli
+# package is installed) siblings, and records logical -> hashed names in
+# static/dist/manifest.json. Templates link through asset_url(), so a changed
+# file gets a new URL and the old one can be cached forever.
+
+STATIC_DIR = "static"
+DIST_DIR = "dist"
+MANIFEST = "manifest.json"
+ASSET_EXTENSIONS = (".css", ".js")
+
+# Shared page chrome: header.html links this instead of two separate files.
+BUNDLES = {
+    "css/chrome.css": ["css/header.css", "css/footer.css"],
+}
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def accepted_encodings(header: str) -> set:
+    # Content codings from an Accept-Encoding header, minus any refused with
+    # q=0 ("gzip;q=0", or "*;q=0" for everything not listed).
+    accepted, refused = set(), set()
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        (accepted if quality > 0 else refused).add(coding)
+    if "*" in accepted:
+        accepted.update(coding for coding in ("br", "gzip") if coding not in refused)
+    return accepted - refused
+
+
+def minify_css(source: str) -> str:
+    source = re.sub(r"/\*.*?\*/", "", source, flags=re.S)
+    source = re.sub(r"\s+", " ", source)
+    source = re.sub(r"\s*([{};,>])\s*", r"\1", source)
+    source = re.sub(r":\s+", ":", source)
+    source = source.replace(";}", "}")
+    return source.strip()
+
+
+def minify(path: str, source: str) -> str:
+    # JS is only fingerprinted and compressed: without a real parser,
+    # stripping comments or whitespace risks changing template literals.
+    if path.endswith(".css"):
+        return minify_css(source)
+    return source
+
+
+def _write_atomic(path: str, data: bytes):
+    # Several workers may build at once; readers must never see half a file.
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _sources(static_dir: str) -> dict:
+    sources = {}
+    for folder, dirs, files in os.walk(static_dir):
+        dirs[:] = [d for d in dirs if os.path.join(folder, d) != os.path.join(static_dir, DIST_DIR)]
+        for name in files:
+            if name.endswith(ASSET_EXTENSIONS):
+                full_path = os.path.join(folder, name)
+                logical = os.path.relpath(full_path, static_dir).replace(os.sep, "/")
+                with open(full_path, encoding="utf-8") as f:
+                    sources[logical] = f.read()
+    for bundle, parts in BUNDLES.items():
+        sources[bundle] = "\n".join(sources[part] for part in parts)
+    return sources
+
+
+def build_assets(static_dir: str = STATIC_DIR) -> dict:
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    manifest = {}
+    for logical, source in sorted(_sources(static_dir).items()):
+        data = minify(logical, source).encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        stem, ext = os.path.splitext(logical)
+        hashed = f"{stem}.{digest}{ext}"
+        target = os.path.join(dist_dir, hashed)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if not os.path.exists(target):
+            _write_atomic(target, data)
+            _write_atomic(target + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write_atomic(target + ".br", brotli.compress(data, quality=11))
+        manifest[logical] = hashed
+    _write_atomic(os.path.join(dist_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+    return manifest
+
+
+class AssetManifest:
+    def __init__(self, static_dir: str = STATIC_DIR, url_prefix: str = "/static"):
+        self.static_dir = static_dir
+        self.url_prefix = url_prefix
+        self._entries = None
+
+    def load(self) -> dict:
+        try:
+            with open(os.path.join(self.static_dir, DIST_DIR, MANIFEST), encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+        return self._entries
+
+    def is_stale(self) -> bool:
+        try:
+            built_at = os.path.getmtime(os.path.join(self.static_dir, DIST_DIR, MANIFEST))
+        except OSError:
+            return True
+        for folder, dirs, files in os.walk(self.static_dir):
+            dirs[:] = [d for d in dirs if os.path.join(folder, d) != os.path.join(self.static_dir, DIST_DIR)]
+            for name in files:
+                if name.endswith(ASSET_EXTENSIONS) and os.path.getmtime(os.path.join(folder, name)) > built_at:
+                    return True
+        return False
+
+    def ensure_built(self) -> dict:
+        if self.is_stale():
+            self._entries = build_assets(self.static_dir)
+            return self._entries
+        return self.load()
+
+    def url(self, path: str) -> str:
+        # Unbuilt trees (and assets outside the pipeline) fall back to the
+        # plain file so templates keep working in development.
+        path = path.lstrip("/")
+        entries = self._entries if self._entries is not None else self.load()
+        hashed = entries.get(path)
+        if hashed is None:
+            return f"{self.url_prefix}/{path}"
+        return f"{self.url_prefix}/{DIST_DIR}/{hashed}"
+
+    def urls(self, path: str) -> list:
+        # Like url(), but a bundle only exists once built: until then it is
+        # linked as its member files, in bundle order.
+        path = path.lstrip("/")
+        entries = self._entries if self._entries is not None else self.load()
+        if path in BUNDLES and path not in entries:
+            return [self.url(part) for part in BUNDLES[path]]
+        return [self.url(path)]
+
+
+class AssetStaticFiles(StaticFiles):
+    # Fingerprinted files under dist/ are served with far-future immutable
+    # caching and, when the client accepts it, from their precompressed
+    # sibling. Everything else behaves like plain StaticFiles.
+
+    async def get_response(self, path: str, scope):
+        if not path.startswith(DIST_DIR + "/"):
+            return await super().get_response(path, scope)
+
+        accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        encodings = [("br", ".br")] if brotli is not None else []
+        encodings.append(("gzip", ".gz"))
+        response = None
+        for encoding, suffix in encodings:
+            if encoding not in accepted:
+                continue
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+            if stat_result is not None and S_ISREG(stat_result.st_mode):
+                response = FileResponse(full_path, stat_result=stat_result, media_type=guess_type(path)[0])
+                response.headers["Content-Encoding"] = encoding
+                break
+        if response is None:
+            response = await super().get_response(path, scope)
+        if response.status_code == 200:
+            response.headers["Cache-Control"] = IMMUTABLE
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] != ["build"]:
+        print("usage: python assets.py build [static_dir]")
+        sys.exit(2)
+    built = build_assets(sys.argv[2] if len(sys.argv) > 2 else STATIC_DIR)
+    for logical, hashed in sorted(built.items()):
+        print(f"{logical} -> {DIST_DIR}/{hashed}")
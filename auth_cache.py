@@ -0,0 +1,94 @@
+import hashlib
+import time
+from typing import Optional
+from sqlalchemy.orm import joinedload
+from cache import LRUCache, MISSING
+import models
+
+# ===== Token verification cache =====
+# Decoding a JWT means an HMAC check on every page view. Verified claims are
+# cached under the token's SHA-256 digest (never the token itself) until the
+# token's own exp; tokens that failed verification are remembered briefly so
+# a replayed bad cookie doesn't cost a decode per request either.
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    def __init__(self, max_entries: int = 10000, invalid_ttl: float = 60.0):
+        self.cache = LRUCache(max_bytes=16 * 1024 * 1024, max_entries=max_entries, negative_ttl=invalid_ttl)
+
+    def get(self, token: str):
+        # Claims dict, MISSING for a known-bad token, or None if not cached.
+        return self.cache.get(token_digest(token))
+
+    def set(self, token: str, claims: dict):
+        expires_at = claims.get("exp")
+        if expires_at is None:
+            return
+        self.cache.set(token_digest(token), claims, ttl=float(expires_at) - time.time())
+
+    def set_invalid(self, token: str):
+        self.cache.set_missing(token_digest(token))
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+# ===== User record cache =====
+# Caches a plain snapshot of the user (never a session-bound ORM object) with
+# their addresses. Anything that changes a user must call invalidate().
+
+
+def user_snapshot(user) -> dict:
+    return {
+        "id": user.id,
+        "username": user.username,
+        "country": user.country,
+        "addresses": [
+            {
+                "id": address.id,
+                "title": address.title,
+                "street": address.street,
+                "city": address.city,
+                "postal_code": address.postal_code,
+                "country": address.country,
+            }
+            for address in user.addresses
+        ],
+    }
+
+
+class UserCache:
+    def __init__(self, max_entries: int = 10000, ttl: float = 300.0, eager_addresses: bool = True):
+        self.cache = LRUCache(max_bytes=16 * 1024 * 1024, max_entries=max_entries, ttl=ttl, negative_ttl=30.0)
+        self.eager_addresses = eager_addresses
+
+    def load(self, db, username: str):
+        query = db.query(models.User).filter(models.User.username == username)
+        if self.eager_addresses:
+            # One LEFT OUTER JOIN instead of a second query for user.addresses.
+            query = query.options(joinedload(models.User.addresses))
+        return query.first()
+
+    def get(self, db, username: str) -> Optional[dict]:
+        cached = self.cache.get(username)
+        if cached is MISSING:
+            return None
+        if cached is not None:
+            return cached
+        user = self.load(db, username)
+        if user is None:
+            self.cache.set_missing(username)
+            return None
+        snapshot = user_snapshot(user)
+        self.cache.set(username, snapshot)
+        return snapshot
+
+    def invalidate(self, username: Optional[str] = None):
+        self.cache.invalidate(None if username is None else [username])
+
+    def stats(self) -> dict:
+        return self.cache.stats()
@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+import search
+from db_config import DatabaseSettings, build_engine
+from synthetic_catalog import cached_catalog
+
+# ===== Autocomplete cache =====
+# Replays `--sessions` typing sessions against a synthetic catalog of
+# `--rows` products: each session types the first words of a product name
+# one character at a time (names drawn with a Zipf-like skew, so popular
+# products are typed more often), asking for suggestions from the second
+# character on. Reports keystrokes, database queries and the time per
+# keystroke for the uncached path (one FTS query each, as before) and for
+# the Autocomplete cache at each `--candidates` size.
+
+
+def sessions(names: list, count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(names))]
+    typed = []
+    for name in rng.choices(names, weights=weights, k=count):
+        words = search.fold_tokens(name)[:rng.randint(1, 3)]
+        phrase = " ".join(words)
+        typed.append([phrase[:end] for end in range(2, len(phrase) + 1)])
+    return typed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Autocomplete prefix cache vs one query per keystroke")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--catalog-dir", default=os.path.join(tempfile.gettempdir(), "lunor-bench"))
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[64, 256])
+    args = parser.parse_args()
+
+    source = cached_catalog(args.catalog_dir, args.rows, args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "catalog.db")
+        shutil.copy(source, path)
+        engine = build_engine(DatabaseSettings(url=f"sqlite:///{path}").writer())
+        with engine.begin() as connection:
+            search.create_search_index(connection)
+            names = [row[0] for row in connection.execute(text("SELECT product_name FROM products"))]
+        random.Random(args.seed).shuffle(names)
+        typed = sessions(names, args.sessions, args.seed)
+        keystrokes = sum(len(prefixes) for prefixes in typed)
+
+        started = time.perf_counter()
+        with engine.connect() as connection:
+            for prefixes in typed[:max(1, args.sessions // 10)]:
+                for prefix in prefixes:
+                    search.search_catalog(connection, prefix)
+        sampled = sum(len(prefixes) for prefixes in typed[:max(1, args.sessions // 10)])
+        print(json.dumps({"path": "uncached", "keystrokes": keystrokes, "queries": keystrokes,
+                          "per_keystroke_us": round((time.perf_counter() - started) / sampled * 1e6, 1)}))
+
+        for candidates in args.candidates:
+            autocomplete = search.Autocomplete(engine, candidates=candidates)
+            started = time.perf_counter()
+            for prefixes in typed:
+                for prefix in prefixes:
+                    key = search.normalize_query(prefix)
+                    if autocomplete.cached(key) is None:
+                        autocomplete.search(key)
+            elapsed = time.perf_counter() - started
+            stats = autocomplete.stats()
+            print(json.dumps({
+                "path": "autocomplete",
+                "candidates": candidates,
+                "keystrokes": keystrokes,
+                "queries": stats["queries"],
+                "query_ratio": round(stats["queries"] / keystrokes, 4),
+                "hits": stats["hits"],
+                "prefix_hits": stats["prefix_hits"],
+                "per_keystroke_us": round(elapsed / keystrokes * 1e6, 1),
+            }))
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
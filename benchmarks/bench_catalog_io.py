@@ -0,0 +1,79 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import catalog_io
+from db_config import CATALOG_DB, DatabaseSettings, build_engine
+
+# ===== Bulk load / export throughput =====
+# Writes a synthetic CSV of `--rows` products (the sample catalog repeated
+# under fresh product_ids), then times a replace load into an empty database,
+# an upsert of the same file (nothing changes), and a full export. A replace
+# reports the load (through the swap) and the search index rebuild separately.
+
+
+def synthetic_csv(path: str, rows: int):
+    sample = io.StringIO()
+    catalog_io.export_products(build_engine(CATALOG_DB), sample, "csv")
+    sample.seek(0)
+    templates = list(csv.DictReader(sample))
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=catalog_io.COLUMNS)
+        writer.writeheader()
+        for i in range(rows):
+            row = dict(templates[i % len(templates)])
+            row["product_id"] = f"S{i:08d}"
+            writer.writerow(row)
+
+
+def rate(rows: int, seconds):
+    return round(rows / seconds) if seconds else None
+
+
+def timed_import(engine, path: str, mode: str) -> dict:
+    with open(path, encoding="utf-8", newline="") as f:
+        return catalog_io.import_products(engine, catalog_io.read_rows(f, "csv"), mode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk catalog import/export throughput")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--json", action="store_true", help="print one JSON object per step")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "products.csv")
+        synthetic_csv(source, args.rows)
+        engine = build_engine(DatabaseSettings(url=f"sqlite:///{os.path.join(directory, 'catalog.db')}").writer())
+
+        results = [timed_import(engine, source, "replace"), timed_import(engine, source, "upsert")]
+        started = time.perf_counter()
+        with open(os.path.join(directory, "export.csv"), "w", encoding="utf-8", newline="") as f:
+            exported = catalog_io.export_products(engine, f, "csv")
+        results.append({"mode": "export", "loaded": exported, "seconds": round(time.perf_counter() - started, 3)})
+
+    for result in results:
+        result["rows_per_sec"] = rate(result["loaded"], result["seconds"])
+        result["load_rows_per_sec"] = rate(result["loaded"], result.get("load_seconds"))
+        result["index_rows_per_sec"] = rate(result["loaded"], result.get("index_seconds"))
+        if args.json:
+            print(json.dumps(result))
+            continue
+        line = (f"{result['mode']:<8} {result['loaded']:>9} rows in {result['seconds']:>7.2f}s "
+                f"({result['rows_per_sec']} rows/sec)")
+        if result.get("load_seconds") is not None:
+            line += f"  load {result['load_seconds']:.2f}s ({result['load_rows_per_sec']} rows/sec)"
+        if result.get("index_seconds") is not None:
+            line += f"  search index {result['index_seconds']:.2f}s ({result['index_rows_per_sec']} rows/sec)"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+import orders
+from db_config import CATALOG_DB, DatabaseSettings, build_engine
+from sqlalchemy import text
+
+# ===== Checkout throughput: group commit vs one commit per order =====
+# Prices a sample cart against the catalog once, then writes `--orders`
+# orders with `--concurrency` checkouts in flight into a fresh user database,
+# once per batch size. Every order checks out its own stored cart, which the
+# writer empties in the order's transaction as checkout does. --batch 1 is the old behaviour (every checkout its own
+# transaction); larger batches let concurrent checkouts share a commit.
+
+
+def sample_order(lines: int) -> dict:
+    engine = build_engine(CATALOG_DB)
+    with engine.connect() as connection:
+        product_ids = connection.execute(text("""
+            SELECT product_id FROM products WHERE out_of_stock = 0 ORDER BY product_id LIMIT :lines
+        """), {"lines": lines}).scalars().all()
+        order = orders.price_order(connection, [{"product_id": product_id, "quantity": 1} for product_id in product_ids])
+    engine.dispose()
+    return order
+
+
+def seed_carts(engine, order: dict, count: int):
+    now = time.time()
+    with engine.begin() as connection:
+        connection.execute(text("""
+            INSERT INTO carts (id, user_id, created_at, updated_at) VALUES (:cart_id, NULL, :now, :now)
+        """), [{"cart_id": f"bench-{i}", "now": now} for i in range(count)])
+        connection.execute(text("""
+            INSERT INTO cart_items (cart_id, product_id, quantity) VALUES (:cart_id, :product_id, :quantity)
+        """), [{"cart_id": f"bench-{i}", "product_id": line["product_id"], "quantity": line["quantity"]}
+               for i in range(count) for line in order["lines"]])
+
+
+async def run_checkouts(writer: orders.OrderWriter, order: dict, count: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_checkout(i: int):
+        async with semaphore:
+            await writer.place(order, cart_id=f"bench-{i}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_checkout(i) for i in range(count)))
+    return time.perf_counter() - started
+
+
+def measure(order: dict, batch: int, args) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        settings = DatabaseSettings(url=f"sqlite:///{os.path.join(directory, 'orders.db')}",
+                                    synchronous=args.synchronous)
+        engine = build_engine(settings)
+        models.Base.metadata.create_all(bind=engine, tables=[models.Order.__table__, models.OrderLine.__table__,
+                                                             models.Cart.__table__, models.CartLine.__table__])
+        seed_carts(engine, order, args.orders)
+        writer = orders.OrderWriter(engine, max_batch=batch, max_wait=args.wait_ms / 1000)
+        elapsed = asyncio.run(run_checkouts(writer, order, args.orders, args.concurrency))
+        writer.shutdown()
+        stats = writer.stats()
+        engine.dispose()
+    return {
+        "batch": batch,
+        "synchronous": args.synchronous,
+        "orders": args.orders,
+        "concurrency": args.concurrency,
+        "lines_per_order": len(order["lines"]),
+        "seconds": round(elapsed, 4),
+        "checkouts_per_sec": round(args.orders / elapsed, 2),
+        "commits": stats["batches"],
+        "avg_batch": round(stats["avg_batch"], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checkout throughput with and without group commit")
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 8, 64])
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--lines", type=int, default=3, help="lines per order")
+    parser.add_argument("--wait-ms", type=float, default=2.0, help="how long a batch waits to fill")
+    parser.add_argument("--synchronous", default="FULL", help="PRAGMA synchronous for the orders database")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per batch size")
+    args = parser.parse_args()
+
+    order = sample_order(args.lines)
+    for batch in args.batch:
+        result = measure(order, batch, args)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"batch={batch:<4} {result['checkouts_per_sec']:>10.2f} checkouts/sec "
+                  f"({result['commits']} commits, avg batch {result['avg_batch']}, "
+                  f"synchronous={args.synchronous})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+import catalog
+import facets
+import pagination
+from db_config import DatabaseSettings, build_engine
+from synthetic_catalog import cached_catalog
+
+# ===== Facet index vs SQL =====
+# On a synthetic catalog of `--rows` products, times the index build, a patch
+# after `--changes` products are edited, and per query: one /shop page plus
+# its total and facet counts from the facet index, against the SQL listing and
+# COUNT(*) /shop used before (single-valued filters only, which is all the SQL
+# path supported). Facet counts are timed uncached.
+
+SINGLE_FILTERS = {
+    "none": {},
+    "category": {"category": "Skincare"},
+    "category+in_stock": {"category": "Makeup", "in_stock": True},
+    "max_price": {"max_price": 30.0},
+    "min_rating": {"min_rating": 4.5},
+}
+MULTI_FILTERS = {
+    "two_categories": {"categories": ["Skincare", "Hair"]},
+    "categories+flags": {"categories": ["Skincare", "Makeup"], "flags": ["in_stock", "sephora_exclusive"]},
+    "flags+price": {"flags": ["new", "online_only"], "max_price": 40.0},
+}
+
+
+def timed(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+def index_query(index, filters: dict, sort: str, fresh_counts: bool):
+    def run():
+        if fresh_counts:
+            index._counts.clear()
+        return index.search(sort=sort, limit=12, **filters)
+    return run
+
+
+def sql_query(engine, filters: dict, sort: str):
+    conditions, params = catalog.shop_filters(**filters)
+    listing = text(pagination.listing_query(conditions, sort))
+    count = text(f"SELECT COUNT(*) FROM products {catalog.where_clause(conditions)}")
+
+    def run():
+        with engine.connect() as connection:
+            connection.execute(listing, {**params, "limit": 13, "offset": 0}).all()
+            connection.execute(count, params).scalar()
+    return run
+
+
+def as_index_filters(filters: dict) -> dict:
+    converted = {}
+    if "category" in filters:
+        converted["categories"] = [filters["category"]]
+    if filters.get("in_stock"):
+        converted["flags"] = ["in_stock"]
+    for key in ("max_price", "min_rating"):
+        if key in filters:
+            converted[key] = filters[key]
+    return converted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Facet index vs SQL /shop filtering")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--catalog-dir", default=os.path.join(tempfile.gettempdir(), "lunor-bench"))
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--changes", type=int, default=500, help="products edited before timing a patch")
+    args = parser.parse_args()
+
+    source = cached_catalog(args.catalog_dir, args.rows, args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "catalog.db")
+        shutil.copy(source, path)
+        engine = build_engine(DatabaseSettings(url=f"sqlite:///{path}").writer())
+        index = facets.FacetIndex(engine)
+
+        started = time.perf_counter()
+        index.refresh()
+        print(json.dumps({"step": "build", "rows": args.rows, "seconds": round(time.perf_counter() - started, 3)}))
+
+        for name, filters in SINGLE_FILTERS.items():
+            for sort in ("rating_desc", "price_asc"):
+                print(json.dumps({
+                    "filters": name,
+                    "sort": sort,
+                    "sql_ms": round(timed(sql_query(engine, filters, sort), args.repeat) * 1000, 3),
+                    "index_ms": round(timed(index_query(index, as_index_filters(filters), sort, False),
+                                            args.repeat) * 1000, 3),
+                    "index_uncached_counts_ms": round(timed(index_query(index, as_index_filters(filters), sort, True),
+                                                            args.repeat) * 1000, 3),
+                }))
+        for name, filters in MULTI_FILTERS.items():
+            print(json.dumps({
+                "filters": name,
+                "sort": "rating_desc",
+                "index_ms": round(timed(index_query(index, filters, "rating_desc", False), args.repeat) * 1000, 3),
+                "index_uncached_counts_ms": round(timed(index_query(index, filters, "rating_desc", True),
+                                                        args.repeat) * 1000, 3),
+            }))
+
+        rng = random.Random(args.seed)
+        with engine.begin() as connection:
+            product_ids = [row[0] for row in connection.execute(text("SELECT product_id FROM products"))]
+            for product_id in rng.sample(product_ids, min(args.changes, len(product_ids))):
+                connection.execute(text("""
+                    UPDATE products SET price_usd = :price, rating = :rating, out_of_stock = 1 - out_of_stock
+                    WHERE product_id = :product_id
+                """), {"price": round(rng.uniform(5, 120), 2), "rating": round(rng.uniform(1, 5), 4),
+                       "product_id": product_id})
+        index.invalidate()
+        started = time.perf_counter()
+        index.snapshot()
+        print(json.dumps({"step": "patch", "changes": args.changes,
+                          "seconds": round(time.perf_counter() - started, 3), **index.stats()}))
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passwords import PasswordHasher, hash_password
+
+# ===== Login throughput per bcrypt cost =====
+# Runs `--logins` password checks per work factor through PasswordHasher with
+# `--concurrency` of them in flight, and reports logins/sec for each.
+
+
+async def run_logins(hasher: PasswordHasher, hashed: str, logins: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_login():
+        async with semaphore:
+            assert await hasher.verify("correct horse battery", hashed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_login() for _ in range(logins)))
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Login throughput per bcrypt cost")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[4, 8, 10, 12])
+    parser.add_argument("--logins", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--json", action="store_true", help="print one JSON object per cost")
+    args = parser.parse_args()
+
+    for rounds in args.rounds:
+        hasher = PasswordHasher(rounds=rounds, max_workers=args.workers)
+        hashed = hash_password("correct horse battery", rounds)
+        # Warm the pool so process start-up isn't billed to the first cost.
+        asyncio.run(run_logins(hasher, hashed, args.workers, args.workers))
+        elapsed = asyncio.run(run_logins(hasher, hashed, args.logins, args.concurrency))
+        hasher.shutdown()
+        result = {
+            "rounds": rounds,
+            "logins": args.logins,
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "seconds": round(elapsed, 4),
+            "logins_per_sec": round(args.logins / elapsed, 2),
+        }
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"rounds={rounds:<3} {result['logins_per_sec']:>10.2f} logins/sec "
+                  f"({args.logins} logins, concurrency {args.concurrency}, {args.workers} workers)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import recommendations
+from db_config import DatabaseSettings, build_engine
+from synthetic_catalog import cached_catalog
+
+# ===== Related-products index =====
+# Builds the index for a synthetic catalog of `--rows` products, then times
+# `--lookups` random related() calls against the memory-mapped files, the way
+# /related_products serves them.
+
+
+def percentile(ordered: list, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Related-products build time and lookup latency")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--catalog-dir", default=os.path.join(tempfile.gettempdir(), "lunor-bench"))
+    parser.add_argument("--k", type=int, default=12)
+    parser.add_argument("--dimensions", type=int, default=128)
+    parser.add_argument("--limit", type=int, default=8, help="neighbours returned per lookup")
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+
+    catalog_path = cached_catalog(args.catalog_dir, args.rows, args.seed)
+    engine = build_engine(DatabaseSettings(url=f"sqlite:///{catalog_path}"))
+    with tempfile.TemporaryDirectory() as directory:
+        built = recommendations.build_index(engine, directory, args.k, args.dimensions)
+        print(json.dumps({"step": "build", **built}))
+
+        related = recommendations.RelatedProducts(directory)
+        started = time.perf_counter()
+        related.load()
+        load_seconds = time.perf_counter() - started
+
+        product_ids = list(related._index.slots)
+        rng = random.Random(args.seed)
+        latencies = []
+        for _ in range(args.lookups):
+            product_id = rng.choice(product_ids)
+            started = time.perf_counter()
+            related.related(product_id, args.limit)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        print(json.dumps({
+            "step": "lookup",
+            "load_seconds": round(load_seconds, 4),
+            "lookups": args.lookups,
+            "limit": args.limit,
+            "mean_us": round(sum(latencies) / len(latencies) * 1e6, 1),
+            "p50_us": round(percentile(latencies, 0.50) * 1e6, 1),
+            "p99_us": round(percentile(latencies, 0.99) * 1e6, 1),
+            "max_us": round(latencies[-1] * 1e6, 1),
+        }))
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db_config
+from synthetic_catalog import cached_catalog
+
+# ===== Route latency and throughput =====
+# Builds (or reuses) a synthetic catalog of `--rows` products, points the app
+# at it through CATALOG_DB_URL and a throwaway user database, and drives each
+# scenario with `--concurrency` requests in flight:
+#   asgi     the app in this process through httpx's ASGI transport
+#   uvicorn  `uvicorn app:app --workers N` over real sockets
+# Each (target, scenario) yields one JSON line with throughput and
+# p50/p95/p99 latency. --save writes the run as a baseline; --compare checks
+# a run against one and exits 1 if anything regressed past --tolerance.
+
+SHOP_SORTS = ["rating_desc", "price_asc", "price_desc", "name_asc", "new"]
+SHOP_FILTERS = [
+    {},
+    {"category": "Skincare"},
+    {"category": "Makeup", "in_stock": "true"},
+    {"max_price": "30"},
+    {"min_rating": "4.5"},
+    {"category": "Skincare", "max_price": "50", "in_stock": "true"},
+]
+SEARCH_QUERIES = ["cream", "hyd", "serum", "glow oil", "retinol", "matte lip", "nia", "velvet bu"]
+PASSWORD = "bench-password"
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(target: str, scenario: str, latencies: list, errors: int, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "target": target,
+        "scenario": scenario,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+def sample_product_ids(catalog_path: str, count: int, seed: int) -> list:
+    import sqlite3
+    with sqlite3.connect(f"file:{catalog_path}?mode=ro", uri=True) as connection:
+        total = connection.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        rng = random.Random(seed)
+        rowids = rng.sample(range(1, total + 1), min(count, total))
+        placeholders = ", ".join("?" for _ in rowids)
+        return [row[0] for row in connection.execute(
+            f"SELECT product_id FROM products WHERE rowid IN ({placeholders})", rowids)]
+
+
+def scenarios(product_ids: list, seed: int) -> dict:
+    # name -> (method, path factory, form data or None, uses the signed-in client)
+    rng = random.Random(seed)
+    result = {
+        "index": ("GET", lambda: "/", None, False),
+        "product": ("GET", lambda: f"/product/{rng.choice(product_ids)}", None, False),
+        "search": ("GET", lambda: "/search_products?" + str(httpx.QueryParams({"q": rng.choice(SEARCH_QUERIES)})),
+                   None, False),
+        "cart": ("GET", lambda: "/cart", None, True),
+        "login": ("POST", lambda: "/login", None, False),
+    }
+    for sort in SHOP_SORTS:
+        for number, filters in enumerate(SHOP_FILTERS):
+            params = {"sort": sort, **filters}
+            result[f"shop:{sort}:f{number}"] = ("GET", lambda params=params: "/shop?" + str(httpx.QueryParams(params)),
+                                                None, False)
+    result["shop:deep_page"] = ("GET", lambda: f"/shop?page={rng.randint(20, 60)}", None, False)
+    return result
+
+
+async def drive(client: httpx.AsyncClient, method: str, make_path, data, count: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            path = make_path()
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, data=data)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(count)))
+    return latencies, errors, time.perf_counter() - started
+
+
+async def run_scenarios(target: str, make_client, args, product_ids: list) -> list:
+    results = []
+    async with make_client() as client, make_client() as cart_client:
+        # One registered user for /login and one cart with a few lines for /cart.
+        username = f"bench-{int(time.time() * 1000)}@example.com"
+        await client.post("/register", data={"username": username, "password": PASSWORD, "country": "US"})
+        client.cookies.clear()
+        for product_id in product_ids[:5]:
+            await cart_client.get(f"/add_to_cart/{product_id}")
+
+        for name, (method, make_path, data, use_cart) in scenarios(product_ids, args.seed).items():
+            if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                continue
+            count = args.requests
+            if name == "login":
+                # bcrypt-bound: a tenth of the requests gives a stable number.
+                count = max(10, args.requests // 10)
+                data = {"username": username, "password": PASSWORD}
+            chosen = cart_client if use_cart else client
+            await drive(chosen, method, make_path, data, min(count, args.warmup), args.concurrency)
+            latencies, errors, elapsed = await drive(chosen, method, make_path, data, count, args.concurrency)
+            result = summarize(target, name, latencies, errors, elapsed)
+            results.append(result)
+            print(json.dumps(result), flush=True)
+    return results
+
+
+def app_environment(catalog_path: str, directory: str, args) -> dict:
+    return {
+        "CATALOG_DB_URL": f"sqlite:///{catalog_path}",
+        "USER_DB_URL": f"sqlite:///{os.path.join(directory, 'user.db')}",
+        "TEMPLATE_CACHE_DIR": os.path.join(directory, "jinja_cache"),
+        # Built from the synthetic catalog; keep them out of the repo's own
+        # .snapshots/ and .recommendations/.
+        "CATALOG_SNAPSHOT_PATH": os.path.join(directory, "snapshots", "catalog.snap"),
+        "RECOMMENDATIONS_DIR": os.path.join(directory, "recommendations"),
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        # Every benchmark request comes from one address; don't let the
+        # per-IP hashing limit turn concurrent logins into 429s.
+        "PASSWORD_HASH_MAX_PER_IP": str(max(2, args.concurrency)),
+        "CATALOG_POLL_INTERVAL": "3600",
+    }
+
+
+async def bench_asgi(environment: dict, args, product_ids: list) -> list:
+    os.environ.update(environment)
+    os.chdir(ROOT)
+    # db_config read the environment when the catalog builder imported it;
+    # re-read it so the app below opens the benchmark databases.
+    importlib.reload(db_config)
+    import app as app_module
+    application = app_module.app
+
+    def make_client():
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=application), base_url="http://bench")
+
+    async with application.router.lifespan_context(application):
+        return await run_scenarios("asgi", make_client, args, product_ids)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def bench_uvicorn(environment: dict, args, product_ids: list) -> list:
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--workers", str(args.workers),
+         "--log-level", "warning"],
+        cwd=ROOT, env={**os.environ, **environment}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + args.timeout
+        while True:
+            try:
+                async with httpx.AsyncClient(base_url=base_url) as probe:
+                    if (await probe.get("/faqs")).status_code == 200:
+                        break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline or process.poll() is not None:
+                raise RuntimeError("uvicorn did not come up")
+            await asyncio.sleep(0.1)
+
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+        def make_client():
+            return httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60)
+
+        return await run_scenarios(f"uvicorn-{args.workers}w", make_client, args, product_ids)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def compare(results: list, baseline: dict, tolerance: float) -> list:
+    # A scenario regresses when p95 grows or throughput drops by more than
+    # `tolerance` (0.15 = 15%) relative to the baseline run.
+    previous = {(entry["target"], entry["scenario"]): entry for entry in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get((result["target"], result["scenario"]))
+        if before is None:
+            continue
+        reasons = []
+        if before["p95_ms"] and result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            reasons.append(f"p95 {before['p95_ms']}ms -> {result['p95_ms']}ms")
+        if before["rps"] and result["rps"] < before["rps"] * (1 - tolerance):
+            reasons.append(f"rps {before['rps']} -> {result['rps']}")
+        if result["errors"] > before["errors"]:
+            reasons.append(f"errors {before['errors']} -> {result['errors']}")
+        if reasons:
+            regressions.append({"target": result["target"], "scenario": result["scenario"], "reasons": reasons})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Route latency/throughput benchmark")
+    parser.add_argument("--rows", type=int, default=10000, help="synthetic catalog size")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--catalog-dir", default=os.path.join(tempfile.gettempdir(), "lunor-bench"))
+    parser.add_argument("--targets", nargs="+", choices=["asgi", "uvicorn"], default=["asgi"])
+    parser.add_argument("--workers", type=int, default=2, help="uvicorn worker processes")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--only", nargs="+", help="scenario name prefixes to run, e.g. shop search")
+    parser.add_argument("--bcrypt-rounds", type=int, default=int(os.getenv("BCRYPT_ROUNDS", 12)))
+    parser.add_argument("--timeout", type=float, default=120.0, help="uvicorn start-up timeout")
+    parser.add_argument("--save", help="write this run to a baseline file")
+    parser.add_argument("--compare", help="baseline file to check this run against")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    catalog_path = cached_catalog(args.catalog_dir, args.rows, args.seed)
+    product_ids = sample_product_ids(catalog_path, 500, args.seed)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        environment = app_environment(catalog_path, directory, args)
+        # uvicorn first: importing the app in-process would hold the
+        # databases open in this process too.
+        if "uvicorn" in args.targets:
+            results += asyncio.run(bench_uvicorn(environment, args, product_ids))
+        if "asgi" in args.targets:
+            results += asyncio.run(bench_asgi(environment, args, product_ids))
+
+    run = {
+        "meta": {
+            "rows": args.rows,
+            "seed": args.seed,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "timestamp": time.time(),
+        },
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(json.dumps({"regression": regression}))
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
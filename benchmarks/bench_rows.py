@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import bindparam, text
+import pagination
+import product_rows
+import products
+import sampling
+from db_config import DatabaseSettings, build_engine
+from synthetic_catalog import cached_catalog
+
+# ===== Row types vs dict rows =====
+# For each projection the catalog routes use (card, listing, cart line,
+# detail, search hit), fetches `--batch` rows once and then times turning the
+# cursor rows into dict(row._mapping) (the old path) and into the slotted row
+# type, plus how many bytes and blocks each batch allocates (tracemalloc, with
+# the batch kept alive). The last line times the JSON a 5-hit search response
+# costs: FastAPI's jsonable_encoder + json.dumps for dicts against orjson for
+# row types.
+
+PROJECTIONS = {
+    "card": sampling.CARD_COLUMNS,
+    "listing": pagination.LISTING_COLUMNS,
+    "cart": products.CART_COLUMNS,
+    "detail": "*",
+    "search": "product_id, product_name, brand_name, image_url",
+}
+
+
+def timed(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+def allocated(fn) -> tuple:
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = fn()
+    stats = tracemalloc.take_snapshot().compare_to(before, "filename")
+    tracemalloc.stop()
+    del kept
+    return sum(stat.size_diff for stat in stats), sum(stat.count_diff for stat in stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slotted product rows vs dict rows")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--catalog-dir", default=os.path.join(tempfile.gettempdir(), "lunor-bench"))
+    parser.add_argument("--batch", type=int, default=20, help="rows per conversion, about one page")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    catalog_path = cached_catalog(args.catalog_dir, args.rows, args.seed)
+    engine = build_engine(DatabaseSettings(url=f"sqlite:///{catalog_path}"))
+    with engine.connect() as connection:
+        product_ids = [row[0] for row in connection.execute(text("SELECT product_id FROM products"))]
+        ids = random.Random(args.seed).sample(product_ids, min(args.batch, len(product_ids)))
+        for name, columns in PROJECTIONS.items():
+            result = connection.execute(text(f"""
+                SELECT {columns} FROM products WHERE product_id IN :ids
+            """).bindparams(bindparam("ids", expanding=True)), {"ids": ids})
+            keys = tuple(result.keys())
+            rows = result.all()
+            cls = product_rows.row_type(keys)
+
+            def as_dicts():
+                return [dict(row._mapping) for row in rows]
+
+            def as_rows():
+                return [cls(*row) for row in rows]
+
+            dict_bytes, dict_blocks = allocated(as_dicts)
+            row_bytes, row_blocks = allocated(as_rows)
+            print(json.dumps({
+                "projection": name,
+                "columns": len(keys),
+                "batch": len(rows),
+                "dict_us": round(timed(as_dicts, args.repeat) * 1e6, 2),
+                "row_us": round(timed(as_rows, args.repeat) * 1e6, 2),
+                "dict_bytes": dict_bytes,
+                "row_bytes": row_bytes,
+                "dict_blocks": dict_blocks,
+                "row_blocks": row_blocks,
+            }))
+
+            if name == "search":
+                dicts, typed = as_dicts()[:5], as_rows()[:5]
+                print(json.dumps({
+                    "step": "search_json",
+                    "hits": len(typed),
+                    "jsonable_encoder_us": round(timed(
+                        lambda: json.dumps(jsonable_encoder(dicts)).encode("utf-8"), args.repeat) * 1e6, 2),
+                    "orjson_us": round(timed(lambda: product_rows.dumps(typed), args.repeat) * 1e6, 2),
+                }))
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
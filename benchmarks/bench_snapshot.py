@@ -0,0 +1,101 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pagination
+import products
+import snapshot
+from db_config import DatabaseSettings, build_engine
+from synthetic_catalog import cached_catalog
+
+# ===== Catalog snapshot vs SQL =====
+# Builds a snapshot of a synthetic catalog of `--rows` products, then times
+# single-product reads (the detail page) and 12-row listing fetches (a /shop
+# page) from SQLite and from the memory-mapped snapshot. Last, it reports this
+# process's memory (/proc/self/smaps_rollup, Linux only) before mapping the
+# snapshot and after reading every row: the growth is clean, file-backed
+# pages that every worker shares, not private_dirty heap.
+
+
+def percentile(ordered: list, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def latencies(fn, arguments: list) -> dict:
+    timings = []
+    for argument in arguments:
+        started = time.perf_counter()
+        fn(argument)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        "mean_us": round(sum(timings) / len(timings) * 1e6, 1),
+        "p50_us": round(percentile(timings, 0.50) * 1e6, 1),
+        "p99_us": round(percentile(timings, 0.99) * 1e6, 1),
+    }
+
+
+def memory_kb() -> dict:
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line and not line.startswith("0"))
+    except OSError:
+        return {}
+    return {key.lower() + "_kb": int(fields[key].split()[0]) for key in
+            ("Rss", "Shared_Clean", "Private_Clean", "Private_Dirty") if key in fields}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Catalog snapshot vs SQL product reads")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--catalog-dir", default=os.path.join(tempfile.gettempdir(), "lunor-bench"))
+    parser.add_argument("--lookups", type=int, default=5000)
+    args = parser.parse_args()
+
+    catalog_path = cached_catalog(args.catalog_dir, args.rows, args.seed)
+    engine = build_engine(DatabaseSettings(url=f"sqlite:///{catalog_path}"))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "catalog.snap")
+        print(json.dumps({"step": "build", **snapshot.build_snapshot(engine, path)}))
+
+        before = memory_kb()
+        started = time.perf_counter()
+        catalog = snapshot.CatalogSnapshot(path)
+        load_seconds = time.perf_counter() - started
+
+        rng = random.Random(args.seed)
+        product_ids = catalog.column_values("product_id")
+        singles = [rng.choice(product_ids) for _ in range(args.lookups)]
+        pages = [rng.sample(product_ids, 12) for _ in range(args.lookups // 10)]
+
+        def sql_get(product_id):
+            with engine.connect() as connection:
+                products.fetch_many(connection, [product_id], "*")
+
+        def sql_page(ids):
+            with engine.connect() as connection:
+                products.fetch_many(connection, ids, pagination.LISTING_COLUMNS)
+
+        print(json.dumps({"step": "get", "sql": latencies(sql_get, singles),
+                          "snapshot": latencies(catalog.get, singles)}))
+        print(json.dumps({"step": "page", "sql": latencies(sql_page, pages),
+                          "snapshot": latencies(lambda ids: catalog.fetch_many(ids, pagination.LISTING_COLUMNS),
+                                                pages)}))
+
+        for product_id in product_ids:
+            catalog.get(product_id)
+        print(json.dumps({"step": "memory", "load_seconds": round(load_seconds, 4),
+                          "file_kb": os.path.getsize(path) // 1024,
+                          "before": before, "after_full_scan": memory_kb()}))
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ===== Fresh-worker start-up time =====
+# Starts `uvicorn app:app` in a new process and reports how long it takes
+# until the first byte of each probed route arrives. "cold" turns off
+# template precompilation and cache warming and clears the bytecode cache;
+# "warm" is the default start-up path.
+
+MODES = {
+    "cold": {"PRECOMPILE_TEMPLATES": "0", "WARM_CACHES": "0"},
+    "warm": {"PRECOMPILE_TEMPLATES": "1", "WARM_CACHES": "1"},
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def first_byte(url: str) -> float:
+    started = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=30) as response:
+        response.read(1)
+    return time.perf_counter() - started
+
+
+def measure(mode: str, paths: list, timeout: float) -> dict:
+    port = free_port()
+    env = {**os.environ, **MODES[mode], "TEMPLATE_CACHE_DIR": os.path.join(ROOT, ".jinja_cache")}
+    if mode == "cold":
+        shutil.rmtree(env["TEMPLATE_CACHE_DIR"], ignore_errors=True)
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        base = f"http://127.0.0.1:{port}"
+        while True:
+            if time.perf_counter() - started > timeout:
+                raise TimeoutError(f"worker did not start within {timeout}s")
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                    break
+            except OSError:
+                time.sleep(0.01)
+        result = {"mode": mode, "listening_seconds": round(time.perf_counter() - started, 4)}
+        for path in paths:
+            result[f"ttfb_first{path}"] = round(first_byte(base + path), 4)
+            result[f"ttfb_second{path}"] = round(first_byte(base + path), 4)
+        result["total_seconds"] = round(time.perf_counter() - started, 4)
+        return result
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time-to-first-byte for a fresh worker")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--paths", nargs="+", default=["/", "/shop", "/faqs", "/product/P501404"])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        for _ in range(args.runs):
+            print(json.dumps(measure(mode, args.paths, args.timeout)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import catalog_io
+import migrations
+from db_config import DatabaseSettings, build_engine
+
+# ===== Synthetic catalogs =====
+# Deterministic (per seed) products with the full models.Product column set,
+# loaded through catalog_io so the result has the same schema, indexes and
+# search index as the real catalog. Category, brand and price distributions
+# are skewed like the sample data so filters and facets stay selective.
+
+CATEGORIES = {
+    "Skincare": {"Moisturizers": ["Face Creams", "Face Oils", "Night Creams"],
+                 "Treatments": ["Face Serums", "Facial Peels", "Blemish Treatments"],
+                 "Cleansers": ["Face Wash", "Exfoliators", "Toners"],
+                 "Eye Care": ["Eye Creams", "Eye Masks"]},
+    "Makeup": {"Face": ["Foundation", "Concealer", "Setting Powder"],
+               "Eye": ["Mascara", "Eyeliner", "Eyeshadow Palettes"],
+               "Lip": ["Lipstick", "Lip Gloss", "Lip Liner"]},
+    "Hair": {"Shampoo & Conditioner": ["Shampoo", "Conditioner"],
+             "Treatments": ["Hair Masks", "Hair Oil", "Scalp Treatments"],
+             "Styling": ["Hair Spray", "Dry Shampoo"]},
+    "Fragrance": {"Women": ["Perfume", "Rollerballs"], "Men": ["Cologne"], "Candles & Home Scents": ["Candles"]},
+    "Bath & Body": {"Body Moisturizers": ["Body Lotions", "Body Oils"], "Bath & Shower": ["Body Wash", "Scrub"]},
+    "Tools & Brushes": {"Brushes & Applicators": ["Face Brushes", "Sponges"], "Hair Tools": ["Hair Dryers"]},
+}
+CATEGORY_WEIGHTS = [40, 25, 12, 10, 9, 4]
+
+SYLLABLES = ["lu", "na", "ver", "so", "ka", "mi", "ra", "el", "to", "vi", "an", "de", "or", "sa", "bel", "ce"]
+ADJECTIVES = ["Hydrating", "Brightening", "Gentle", "Renewing", "Soothing", "Matte", "Radiant", "Daily",
+              "Intense", "Clarifying", "Barrier", "Overnight", "Weightless", "Velvet", "Pure", "Glow"]
+NOUNS = ["Cream", "Serum", "Balm", "Gel", "Oil", "Mask", "Mist", "Cleanser", "Tonic", "Essence",
+         "Lotion", "Powder", "Stick", "Drops", "Foam", "Butter"]
+INGREDIENTS = ["Water", "Glycerin", "Niacinamide", "Ceramide NP", "Hyaluronic Acid", "Squalane", "Retinol",
+               "Panthenol", "Tocopherol", "Shea Butter", "Salicylic Acid", "Vitamin C", "Peptides",
+               "Centella Asiatica Extract", "Zinc Oxide", "Allantoin", "Caffeine", "Jojoba Oil",
+               "Green Tea Extract", "Lactic Acid", "Bakuchiol", "Aloe Vera", "Cholesterol", "Urea"]
+HIGHLIGHTS = ["Vegan", "Clean at Sephora", "Fragrance Free", "Good for: Dryness", "Hydrating",
+              "Without Parabens", "Cruelty-Free", "Good for: Dullness/Uneven Texture", "Best for Oily Skin"]
+
+
+def brand_names(rng: random.Random, count: int) -> list:
+    names = set()
+    while len(names) < count:
+        names.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).upper())
+    return sorted(names)
+
+
+def synthetic_products(rows: int, seed: int = 1):
+    rng = random.Random(seed)
+    brands = brand_names(rng, max(10, min(2000, rows // 50)))
+    # Zipf-ish brand popularity: a few brands carry most of the catalog.
+    brand_weights = [1.0 / (rank + 1) for rank in range(len(brands))]
+    categories = list(CATEGORIES)
+    for i in range(rows):
+        primary = rng.choices(categories, CATEGORY_WEIGHTS)[0]
+        secondary = rng.choice(list(CATEGORIES[primary]))
+        tertiary = rng.choice(CATEGORIES[primary][secondary])
+        brand_index = rng.choices(range(len(brands)), brand_weights)[0]
+        price = round(min(400.0, rng.lognormvariate(3.4, 0.6)), 2)
+        on_sale = rng.random() < 0.15
+        rating = round(min(5.0, max(1.0, rng.gauss(4.2, 0.5))), 4)
+        product_id = f"P{i:07d}"
+        yield {
+            "product_id": product_id,
+            "product_name": f"{rng.choice(ADJECTIVES)} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {tertiary}",
+            "brand_id": 1000 + brand_index,
+            "brand_name": brands[brand_index],
+            "loves_count": int(rng.paretovariate(1.2) * 500),
+            "rating": rating,
+            "reviews": float(int(rng.paretovariate(1.1) * 20)),
+            "size": f"{rng.choice([0.5, 1, 1.7, 3.4, 6.7])} oz",
+            "variation_type": "Size",
+            "variation_value": None,
+            "variation_desc": None,
+            "ingredients": ", ".join(rng.sample(INGREDIENTS, rng.randint(6, 14))),
+            "price_usd": price,
+            "value_price_usd": price,
+            "sale_price_usd": round(price * rng.uniform(0.6, 0.9), 2) if on_sale else None,
+            "limited_edition": int(rng.random() < 0.05),
+            "new": int(rng.random() < 0.1),
+            "online_only": int(rng.random() < 0.2),
+            "out_of_stock": int(rng.random() < 0.07),
+            "sephora_exclusive": int(rng.random() < 0.25),
+            "highlights": json.dumps(rng.sample(HIGHLIGHTS, 3)),
+            "primary_category": primary,
+            "secondary_category": secondary,
+            "tertiary_category": tertiary,
+            "child_count": 0,
+            "child_max_price": None,
+            "child_min_price": None,
+            "image_filename": None,
+            "image_path": None,
+            "image_url": None if rng.random() < 0.1 else f"https://images.example.com/{product_id}.jpg",
+        }
+
+
+def build_catalog(path: str, rows: int, seed: int = 1) -> dict:
+    engine = build_engine(DatabaseSettings(url=f"sqlite:///{path}").writer())
+    try:
+        return catalog_io.import_products(engine, synthetic_products(rows, seed), mode="replace")
+    finally:
+        engine.dispose()
+
+
+def cached_catalog(directory: str, rows: int, seed: int = 1) -> str:
+    # Building a large catalog (mostly the search index) takes a while, so
+    # each size/seed is built once and reused.
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"catalog-{rows}-{seed}.db")
+    if not os.path.exists(path):
+        partial = path + ".partial"
+        if os.path.exists(partial):
+            os.remove(partial)
+        build_catalog(partial, rows, seed)
+        os.replace(partial, path)
+    else:
+        # A catalog cached by an older tree may predate later migrations.
+        engine = build_engine(DatabaseSettings(url=f"sqlite:///{path}").writer())
+        try:
+            migrations.migrate_catalog(engine)
+        finally:
+            engine.dispose()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a synthetic products catalog")
+    parser.add_argument("path", help="SQLite file to create or replace")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    print(json.dumps(build_catalog(args.path, args.rows, args.seed)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# ===== Bounded LRU + TTL cache =====
+# Entries are evicted least-recently-used first once either the entry count or
+# the estimated byte size goes over its cap. A key can also be cached as
+# "known missing" (negative caching) with its own, usually shorter, TTL.
+
+MISSING = object()
+
+
+def estimate_size(value) -> int:
+    # Good enough for dict rows of str/float/int; containers and __slots__
+    # objects are walked one level.
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += sys.getsizeof(key) + sys.getsizeof(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += sys.getsizeof(item)
+    elif hasattr(value, "__slots__"):
+        for name in value.__slots__:
+            size += sys.getsizeof(getattr(value, name, None))
+    return size
+
+
+class LRUCache:
+    def __init__(self,
+                 max_bytes: int = 8 * 1024 * 1024,
+                 max_entries: Optional[int] = None,
+                 ttl: float = 300.0,
+                 negative_ttl: float = 60.0):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        # Returns MISSING for keys cached as absent, `default` for unknown keys.
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, size, expires_at = entry
+            if expires_at <= now:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            if value is MISSING:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        # get() without counting a hit or miss, for opportunistic lookups
+        # (a listing checking for full records) that would skew the stats.
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] <= now:
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        if ttl is None:
+            ttl = self.negative_ttl if value is MISSING else self.ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + ttl)
+            self.bytes += size
+            while self._entries and (self.bytes > self.max_bytes or
+                                     (self.max_entries is not None and len(self._entries) > self.max_entries)):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def set_missing(self, key):
+        self.set(key, MISSING)
+
+    def _remove(self, key):
+        value, size, expires_at = self._entries.pop(key)
+        self.bytes -= size
+
+    def purge_expired(self) -> int:
+        # Expired entries are otherwise only dropped when looked up or evicted.
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (_, _, expires_at) in self._entries.items() if expires_at <= now]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+        return len(expired)
+
+    def invalidate(self, keys=None):
+        with self._lock:
+            if keys is None:
+                self._entries.clear()
+                self.bytes = 0
+                return
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
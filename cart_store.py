@@ -0,0 +1,224 @@
+import re
+import secrets
+import threading
+import time
+from typing import Optional
+from sqlalchemy import bindparam, text
+
+# ===== Server-side carts =====
+# The browser only holds an opaque cart id; lines live in the carts /
+# cart_items tables of user.db. add() records a quantity delta in memory and
+# flush() applies every pending delta in one transaction with
+# `quantity = quantity + delta` upserts, so flushes from several workers never
+# overwrite each other. A click is flushed before its redirect (the /cart that
+# follows may land on another worker); clicks that arrive together in a worker
+# wait on the same flush and share its transaction. Reads overlay this
+# worker's pending deltas on the stored lines.
+
+CART_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{32}$")
+
+
+def new_cart_id() -> str:
+    return secrets.token_urlsafe(24)
+
+
+def valid_cart_id(cart_id: Optional[str]) -> bool:
+    return bool(cart_id) and CART_ID_PATTERN.match(cart_id) is not None
+
+
+class CartStore:
+    def __init__(self, engine, max_pending: int = 512):
+        self.engine = engine
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Deltas swapped out by the flush in progress: neither pending nor
+        # committed yet, so readers of those carts wait for it to finish.
+        self._inflight = {}
+        self._flushed = threading.Condition(self._lock)
+        # Held while deltas are written or a cart is rewritten, so a clear or
+        # merge can't be undone by a flush that swapped its deltas out earlier.
+        self._flush_lock = threading.Lock()
+        self.flushes = 0
+        self.flushed_deltas = 0
+
+    # ----- writes -----
+
+    def add(self, cart_id: str, product_id: str, quantity: int = 1) -> bool:
+        # Returns True once enough deltas are pending that the caller should
+        # flush now instead of waiting for the periodic flush.
+        with self._lock:
+            lines = self._pending.setdefault(cart_id, {})
+            lines[product_id] = lines.get(product_id, 0) + quantity
+            pending = sum(len(lines) for lines in self._pending.values())
+        return pending >= self.max_pending
+
+    def _apply(self, connection, pending: dict, now: float):
+        connection.execute(text("""
+            INSERT INTO carts (id, user_id, created_at, updated_at)
+            VALUES (:cart_id, NULL, :now, :now)
+            ON CONFLICT(id) DO UPDATE SET updated_at = excluded.updated_at
+        """), [{"cart_id": cart_id, "now": now} for cart_id in pending])
+        rows = [
+            {"cart_id": cart_id, "product_id": product_id, "delta": delta}
+            for cart_id, lines in pending.items()
+            for product_id, delta in lines.items()
+            if delta
+        ]
+        if rows:
+            connection.execute(text("""
+                INSERT INTO cart_items (cart_id, product_id, quantity)
+                VALUES (:cart_id, :product_id, :delta)
+                ON CONFLICT(cart_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+            """), rows)
+            connection.execute(text("DELETE FROM cart_items WHERE quantity <= 0"))
+        return len(rows)
+
+    def flush(self, cart_id: Optional[str] = None) -> int:
+        # With a cart_id, only flushes if that cart still has deltas pending
+        # once the flush lock is ours, i.e. a flush that already wrote them
+        # counts; the flush then takes every cart's deltas, not just its own.
+        with self._flush_lock:
+            with self._lock:
+                if cart_id is not None and cart_id not in self._pending:
+                    return 0
+                pending, self._pending = self._pending, {}
+                self._inflight = pending
+            if not pending:
+                return 0
+            try:
+                with self.engine.begin() as connection:
+                    written = self._apply(connection, pending, time.time())
+            except Exception:
+                # Put the deltas back (on top of anything added meanwhile) so
+                # the next flush retries them.
+                with self._lock:
+                    for pending_cart, lines in pending.items():
+                        merged = self._pending.setdefault(pending_cart, {})
+                        for product_id, delta in lines.items():
+                            merged[product_id] = merged.get(product_id, 0) + delta
+                    self._inflight = {}
+                    self._flushed.notify_all()
+                raise
+            with self._lock:
+                self._inflight = {}
+                self._flushed.notify_all()
+            self.flushes += 1
+            self.flushed_deltas += written
+            return written
+
+    def _take_pending(self, cart_id: str) -> dict:
+        with self._lock:
+            return self._pending.pop(cart_id, {})
+
+    # ----- reads -----
+
+    def items(self, cart_id: str) -> list:
+        # The stored lines are read without any lock held. Deltas still
+        # pending afterwards were never written, so adding them can't count
+        # anything twice; but if a flush swapped this cart's deltas out during
+        # the read, they may be in neither place, so the read is repeated.
+        while True:
+            with self._lock:
+                while cart_id in self._inflight:
+                    self._flushed.wait()
+                lines = self._pending.get(cart_id)
+            with self.engine.connect() as connection:
+                rows = connection.execute(text("""
+                    SELECT product_id, quantity FROM cart_items
+                    WHERE cart_id = :cart_id
+                    ORDER BY rowid
+                """), {"cart_id": cart_id}).fetchall()
+            with self._lock:
+                current = self._pending.get(cart_id)
+                if lines is None or current is lines:
+                    pending = dict(current or {})
+                    break
+        quantities = {row.product_id: row.quantity for row in rows}
+        for product_id, delta in pending.items():
+            quantities[product_id] = quantities.get(product_id, 0) + delta
+        return [
+            {"product_id": product_id, "quantity": quantity}
+            for product_id, quantity in quantities.items()
+            if quantity > 0
+        ]
+
+    def user_cart_id(self, user_id: int) -> Optional[str]:
+        with self.engine.connect() as connection:
+            return connection.execute(text("SELECT id FROM carts WHERE user_id = :user_id"),
+                                      {"user_id": user_id}).scalar()
+
+    # ----- login -----
+
+    def merge(self, cart_id: Optional[str], user_id: int) -> str:
+        # Folds an anonymous cart into the user's cart and returns the id the
+        # cookie should carry from now on. The first anonymous cart a user
+        # logs in with simply becomes theirs.
+        with self._flush_lock:
+            now = time.time()
+            with self.engine.begin() as connection:
+                if cart_id is not None:
+                    pending = self._take_pending(cart_id)
+                    if pending:
+                        self._apply(connection, {cart_id: pending}, now)
+                user_cart = connection.execute(text("SELECT id FROM carts WHERE user_id = :user_id"),
+                                               {"user_id": user_id}).scalar()
+                anonymous = cart_id is not None and connection.execute(
+                    text("SELECT 1 FROM carts WHERE id = :cart_id AND user_id IS NULL"), {"cart_id": cart_id}
+                ).scalar() is not None
+
+                if user_cart is None:
+                    if anonymous:
+                        connection.execute(text("UPDATE carts SET user_id = :user_id, updated_at = :now WHERE id = :cart_id"),
+                                           {"cart_id": cart_id, "user_id": user_id, "now": now})
+                        return cart_id
+                    user_cart = new_cart_id()
+                    connection.execute(text("""
+                        INSERT INTO carts (id, user_id, created_at, updated_at)
+                        VALUES (:cart_id, :user_id, :now, :now)
+                    """), {"cart_id": user_cart, "user_id": user_id, "now": now})
+                    return user_cart
+
+                if anonymous and cart_id != user_cart:
+                    connection.execute(text("""
+                        INSERT INTO cart_items (cart_id, product_id, quantity)
+                        SELECT :user_cart, product_id, quantity FROM cart_items WHERE cart_id = :cart_id
+                        ON CONFLICT(cart_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+                    """), {"cart_id": cart_id, "user_cart": user_cart})
+                    connection.execute(text("DELETE FROM cart_items WHERE cart_id = :cart_id"), {"cart_id": cart_id})
+                    connection.execute(text("DELETE FROM carts WHERE id = :cart_id"), {"cart_id": cart_id})
+                connection.execute(text("UPDATE carts SET updated_at = :now WHERE id = :cart_id"),
+                                   {"cart_id": user_cart, "now": now})
+                return user_cart
+
+    # ----- expiry -----
+
+    def sweep(self, anonymous_ttl: float, user_ttl: float) -> int:
+        # Anonymous carts are dropped after anonymous_ttl idle seconds; a
+        # signed-in user's cart is kept for user_ttl.
+        now = time.time()
+        self.flush()
+        with self._flush_lock, self.engine.begin() as connection:
+            expired = [row.id for row in connection.execute(text("""
+                SELECT id FROM carts
+                WHERE (user_id IS NULL AND updated_at < :anonymous_cutoff)
+                   OR (user_id IS NOT NULL AND updated_at < :user_cutoff)
+            """), {"anonymous_cutoff": now - anonymous_ttl, "user_cutoff": now - user_ttl})]
+            delete_items = text("DELETE FROM cart_items WHERE cart_id IN :ids").bindparams(bindparam("ids", expanding=True))
+            delete_carts = text("DELETE FROM carts WHERE id IN :ids").bindparams(bindparam("ids", expanding=True))
+            for start in range(0, len(expired), 500):
+                chunk = {"ids": expired[start:start + 500]}
+                connection.execute(delete_items, chunk)
+                connection.execute(delete_carts, chunk)
+        return len(expired)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending_carts = len(self._pending)
+            pending_lines = sum(len(lines) for lines in self._pending.values())
+        return {
+            "pending_carts": pending_carts,
+            "pending_lines": pending_lines,
+            "flushes": self.flushes,
+            "flushed_deltas": self.flushed_deltas,
+        }
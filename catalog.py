@@ -0,0 +1,147 @@
+import os
+import threading
+from typing import Optional
+from sqlalchemy import text
+
+# ===== Shop filters =====
+# The SQL form of the /shop filters. /shop uses facets.FacetIndex; this is
+# only used by migrations.explain_shop_queries and benchmarks/bench_facets.py.
+def shop_filters(category: Optional[str] = None,
+                 brand: Optional[str] = None,
+                 max_price: Optional[float] = None,
+                 min_rating: Optional[float] = None,
+                 in_stock: bool = False,
+                 exclude: tuple = ()):
+    conditions = []
+    params = {}
+
+    if category and "category" not in exclude:
+        conditions.append("primary_category = :category")
+        params["category"] = category
+
+    if brand and "brand" not in exclude:
+        conditions.append("brand_name = :brand")
+        params["brand"] = brand
+
+    if max_price:
+        conditions.append("effective_price <= :max_price")
+        params["max_price"] = max_price
+
+    if min_rating:
+        conditions.append("rating >= :min_rating")
+        params["min_rating"] = min_rating
+
+    if in_stock:
+        conditions.append("out_of_stock = 0")
+
+    return conditions, params
+
+
+def where_clause(conditions: list) -> str:
+    return "WHERE " + " AND ".join(conditions) if conditions else ""
+
+
+# ===== Catalog metadata cache =====
+# Category/brand lists and the price ceiling only change when the catalog does,
+# so they are read once per generation. Anything that writes to the products
+# table calls invalidate(), which bumps the generation and drops every entry.
+# Writes from another process (catalog_io.py) bump the catalog_revision row
+# instead; refresh_if_changed() polls it and invalidates when it moves.
+def read_revision(connection) -> int:
+    return connection.execute(text("SELECT revision FROM catalog_revision WHERE id = 1")).scalar() or 0
+
+
+def read_identity(connection) -> str:
+    # Which catalog database this is: its catalog_id plus the file it lives
+    # in, so a copy of the file doesn't pass for the original either.
+    catalog_id = connection.execute(text("SELECT catalog_id FROM catalog_revision WHERE id = 1")).scalar()
+    path = next((row[2] for row in connection.exec_driver_sql("PRAGMA database_list") if row[1] == "main"), "")
+    return f"{catalog_id or ''}@{os.path.realpath(path) if path else ''}"
+
+
+class CatalogMetadata:
+    def __init__(self, engine):
+        self.engine = engine
+        self.generation = 0
+        self.revision = None
+        self._lock = threading.Lock()
+        self._lists = None
+        self._listeners = []
+        self.hits = 0
+        self.misses = 0
+
+    def on_invalidate(self, callback):
+        self._listeners.append(callback)
+        return callback
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._lists = None
+            generation = self.generation
+        for callback in self._listeners:
+            try:
+                callback(generation)
+            except Exception as e:
+                print(f"Error in catalog invalidation hook {callback!r}: {e}")
+
+    def refresh_if_changed(self) -> bool:
+        try:
+            with self.engine.connect() as connection:
+                revision = read_revision(connection)
+        except Exception as e:
+            print(f"Error reading catalog revision: {e}")
+            return False
+        previous, self.revision = self.revision, revision
+        if previous is None or previous == revision:
+            return False
+        self.invalidate()
+        return True
+
+    def _load_lists(self) -> dict:
+        with self.engine.connect() as connection:
+            categories = [row[0] for row in connection.execute(text("""
+                SELECT DISTINCT primary_category FROM products
+                WHERE primary_category IS NOT NULL
+                ORDER BY primary_category
+            """)) if row[0]]
+            brands = [row[0] for row in connection.execute(text("""
+                SELECT DISTINCT brand_name FROM products
+                WHERE brand_name IS NOT NULL
+                ORDER BY brand_name
+            """)) if row[0]]
+            max_price = connection.execute(text("""
+                SELECT MAX(effective_price) FROM products
+            """)).scalar() or 100
+        return {"categories": categories, "brands": brands, "max_price": max_price}
+
+    def _lists_for_generation(self) -> dict:
+        with self._lock:
+            lists, generation = self._lists, self.generation
+        if lists is not None:
+            self.hits += 1
+            return lists
+        self.misses += 1
+        lists = self._load_lists()
+        with self._lock:
+            # Don't publish a result that raced with an invalidate().
+            if self.generation == generation:
+                self._lists = lists
+        return lists
+
+    def categories(self) -> list:
+        return self._lists_for_generation()["categories"]
+
+    def brands(self) -> list:
+        return self._lists_for_generation()["brands"]
+
+    def max_price(self) -> float:
+        return self._lists_for_generation()["max_price"]
+
+    def stats(self) -> dict:
+        return {
+            "generation": self.generation,
+            "revision": self.revision,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,319 @@
+import argparse
+import csv
+import json
+import sys
+import time
+from itertools import islice
+from operator import itemgetter
+from sqlalchemy import text
+import migrations
+import search
+from db_config import CATALOG_DB, DatabaseSettings, build_engine
+
+# ===== Bulk catalog import/export =====
+#   python catalog_io.py import products.csv [--mode replace|upsert|sync]
+#   python catalog_io.py index
+#   python catalog_io.py export products.jsonl
+#
+# Rows are streamed from the file and written in chunked executemany
+# transactions on one connection, so memory stays flat however big the file.
+#   replace  loads into an unindexed staging table, then swaps it in and builds
+#            its indexes in one transaction: readers see the old catalog until
+#            the new one is complete. The search index is rebuilt afterwards
+#            in its own transaction (search comes back empty until it
+#            commits), or left to `catalog_io.py index` with
+#            --defer-search-index.
+#   upsert   inserts new product_ids and updates changed rows in place.
+#   sync     upsert, then deletes products that were not in the file.
+# Every load bumps catalog_revision, which running workers poll to drop their
+# catalog caches.
+
+COLUMNS = migrations.COPIED_COLUMNS
+STAGING_TABLE = "products_load"
+NULL_VALUES = frozenset(("", "None", "null", "NULL", "nan", "NaN"))
+
+
+def _column_types() -> dict:
+    types = {}
+    for line in migrations.PRODUCT_COLUMNS.strip().splitlines():
+        name, column_type = line.strip().rstrip(",").split()[:2]
+        types[name] = column_type
+    return types
+
+
+COLUMN_TYPES = _column_types()
+
+# Only for the duration of a load, on the loader's own connection.
+BULK_PRAGMAS = [
+    "PRAGMA synchronous = OFF",
+    "PRAGMA cache_size = -262144",
+    "PRAGMA temp_store = MEMORY",
+]
+
+
+def _integer(value):
+    return int(value) if isinstance(value, int) else int(float(value))
+
+
+def _real(value):
+    return float(value.replace("$", "")) if isinstance(value, str) else float(value)
+
+
+CONVERTERS = {"INTEGER": _integer, "REAL": _real}
+COLUMN_CONVERTERS = [CONVERTERS.get(COLUMN_TYPES[column]) for column in COLUMNS]
+
+
+def _coerce_column(values: tuple, convert, bad: set) -> list:
+    values = [None if value is None or (value.__class__ is str and value.strip() in NULL_VALUES) else value
+              for value in values]
+    if convert is None:
+        return [value if value is None or value.__class__ is str else str(value) for value in values]
+    try:
+        return [None if value is None else convert(value) for value in values]
+    except (TypeError, ValueError):
+        pass
+    coerced = []
+    for index, value in enumerate(values):
+        try:
+            coerced.append(None if value is None else convert(value))
+        except (TypeError, ValueError):
+            bad.add(index)
+            coerced.append(None)
+    return coerced
+
+
+def coerce_rows(rows: list) -> list:
+    # Rows are tuples in COLUMNS order (or dicts keyed by column), converted a
+    # column at a time. Rows without a usable product_id or with an
+    # unparseable number are dropped; the caller counts them as skipped.
+    rows = [tuple(map(row.get, COLUMNS)) if isinstance(row, dict) else row for row in rows]
+    bad = set()
+    columns = [_coerce_column(values, convert, bad)
+               for values, convert in zip(zip(*rows), COLUMN_CONVERTERS)]
+    return [row for index, row in enumerate(zip(*columns)) if row[0] and index not in bad]
+
+
+def detect_format(path: str, fmt: str = None) -> str:
+    if fmt:
+        return fmt
+    return "jsonl" if path.endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+def read_rows(stream, fmt: str):
+    # Tuples in COLUMNS order; columns missing from the file read as None.
+    if fmt == "csv":
+        reader = csv.reader(stream)
+        header = next(reader, None)
+        if header is None:
+            return
+        positions = {name: index for index, name in enumerate(header)}
+        width = len(header)
+        # Missing columns point one past the last field, at a padding None.
+        pick = itemgetter(*[positions.get(column, width) for column in COLUMNS])
+        for row in reader:
+            if not row:
+                continue
+            if len(row) != width:
+                row = (row + [None] * width)[:width]
+            row.append(None)
+            yield pick(row)
+        return
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield tuple(map(json.loads(line).get, COLUMNS))
+
+
+def chunks(rows, size: int):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _insert_statement(table: str, upsert: bool) -> str:
+    # Positional parameters: executed straight on the DB-API cursor, which is
+    # much cheaper per row than binding named parameters through text().
+    names = ", ".join(COLUMNS)
+    values = ", ".join("?" for column in COLUMNS)
+    if not upsert:
+        # Staging load: a repeated product_id keeps the last row, as upsert does.
+        return f"INSERT OR REPLACE INTO {table} ({names}) VALUES ({values})"
+    updated = [column for column in COLUMNS if column != "product_id"]
+    assignments = ", ".join(f"{column} = excluded.{column}" for column in updated)
+    # Unchanged rows are skipped so they don't churn the FTS triggers.
+    changed = " OR ".join(f"{column} IS NOT excluded.{column}" for column in updated)
+    return (f"INSERT INTO {table} ({names}) VALUES ({values}) "
+            f"ON CONFLICT(product_id) DO UPDATE SET {assignments} WHERE {changed}")
+
+
+def bump_revision(connection) -> int:
+    connection.execute(text("""
+        UPDATE catalog_revision SET revision = revision + 1, updated_at = :now WHERE id = 1
+    """), {"now": time.time()})
+    return connection.execute(text("SELECT revision FROM catalog_revision WHERE id = 1")).scalar()
+
+
+def _table_exists(connection, table: str) -> bool:
+    return connection.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                              {"name": table}).scalar() is not None
+
+
+def _rebuild_search_index(connection) -> int:
+    # Its own transaction, with a second revision bump so workers drop any
+    # autocomplete results cached while the index was empty.
+    with connection.begin():
+        search.create_search_index(connection, rebuild=True)
+        return bump_revision(connection)
+
+
+def build_search_index(engine) -> dict:
+    # The step left over by import_products(..., defer_search_index=True).
+    started = time.perf_counter()
+    with engine.connect() as connection:
+        revision = _rebuild_search_index(connection)
+        indexed = connection.execute(text("SELECT COUNT(*) FROM products")).scalar()
+    return {"indexed": indexed, "revision": revision, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def import_products(engine, rows, mode: str = "upsert", chunk_size: int = 5000, on_loaded=None,
+                    defer_search_index: bool = False) -> dict:
+    if mode not in ("replace", "upsert", "sync"):
+        raise ValueError(f"Unknown import mode: {mode}")
+    started = time.perf_counter()
+    loaded = skipped = 0
+    deleted = None
+    index_seconds = None
+
+    # Bring the schema up to date first so the load targets the current table.
+    with engine.begin() as connection:
+        if not _table_exists(connection, "products"):
+            migrations.create_products_table(connection)
+    migrations.migrate_catalog(engine)
+
+    with engine.connect() as connection:
+        for pragma in BULK_PRAGMAS:
+            connection.exec_driver_sql(pragma)
+        connection.commit()
+
+        if mode == "replace":
+            with connection.begin():
+                connection.execute(text(f"DROP TABLE IF EXISTS {STAGING_TABLE}"))
+                migrations.create_products_table(connection, STAGING_TABLE)
+            statement = _insert_statement(STAGING_TABLE, upsert=False)
+        else:
+            statement = _insert_statement("products", upsert=True)
+            if mode == "sync":
+                connection.execute(text("CREATE TEMP TABLE IF NOT EXISTS import_seen (product_id TEXT PRIMARY KEY)"))
+                connection.execute(text("DELETE FROM import_seen"))
+                connection.commit()
+
+        for chunk in chunks(rows, chunk_size):
+            values = coerce_rows(chunk)
+            skipped += len(chunk) - len(values)
+            if not values:
+                continue
+            with connection.begin():
+                connection.exec_driver_sql(statement, values)
+                if mode == "sync":
+                    connection.exec_driver_sql("INSERT OR IGNORE INTO import_seen (product_id) VALUES (?)",
+                                               [value[:1] for value in values])
+            loaded += len(values)
+
+        with connection.begin():
+            if mode == "replace":
+                connection.execute(text("DROP TABLE products"))
+                connection.execute(text(f"ALTER TABLE {STAGING_TABLE} RENAME TO products"))
+                migrations.create_indexes(connection)
+                search.reset_search_index(connection)
+            elif mode == "sync":
+                deleted = connection.execute(text("""
+                    DELETE FROM products WHERE product_id NOT IN (SELECT product_id FROM import_seen)
+                """)).rowcount
+            revision = bump_revision(connection)
+        load_seconds = time.perf_counter() - started
+
+        if mode == "replace" and not defer_search_index:
+            revision = _rebuild_search_index(connection)
+            index_seconds = round(time.perf_counter() - started - load_seconds, 3)
+        connection.exec_driver_sql("PRAGMA optimize")
+
+    result = {
+        "mode": mode,
+        "loaded": loaded,
+        "skipped": skipped,
+        "deleted": deleted,
+        "revision": revision,
+        "load_seconds": round(load_seconds, 3),
+        "index_seconds": index_seconds,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    if on_loaded is not None:
+        on_loaded()
+    return result
+
+
+def export_products(engine, stream, fmt: str = "csv", batch_size: int = 5000) -> int:
+    # Rows are fetched and written batch_size at a time, as plain tuples.
+    exported = 0
+    writer = None
+    if fmt == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(COLUMNS)
+    with engine.connect() as connection:
+        result = connection.exec_driver_sql(f"SELECT {', '.join(COLUMNS)} FROM products ORDER BY product_id")
+        for partition in result.partitions(batch_size):
+            if writer is not None:
+                writer.writerows(partition)
+            else:
+                stream.writelines(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + "\n" for row in partition)
+            exported += len(partition)
+    return exported
+
+
+def _open(path: str, mode: str):
+    if path == "-":
+        return sys.stdin if mode == "r" else sys.stdout
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import/export of the products table")
+    parser.add_argument("--db", help="SQLAlchemy URL of the catalog (defaults to CATALOG_DB)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="load CSV/JSONL into products")
+    importer.add_argument("path", help="input file, or - for stdin")
+    importer.add_argument("--mode", choices=["replace", "upsert", "sync"], default="upsert")
+    importer.add_argument("--format", choices=["csv", "jsonl"])
+    importer.add_argument("--chunk-size", type=int, default=5000)
+    importer.add_argument("--defer-search-index", action="store_true",
+                          help="after a replace, leave the search index for the index command")
+    commands.add_parser("index", help="rebuild the search index")
+    exporter = commands.add_parser("export", help="write products as CSV/JSONL")
+    exporter.add_argument("path", help="output file, or - for stdout")
+    exporter.add_argument("--format", choices=["csv", "jsonl"])
+    args = parser.parse_args()
+
+    settings = DatabaseSettings(url=args.db) if args.db else CATALOG_DB
+    engine = build_engine(settings.writer())
+    if args.command == "index":
+        print(json.dumps(build_search_index(engine)))
+        return
+    fmt = detect_format(args.path, args.format)
+    if args.command == "import":
+        with _open(args.path, "r") as stream:
+            result = import_products(engine, read_rows(stream, fmt), args.mode, args.chunk_size,
+                                     defer_search_index=args.defer_search_index)
+        print(json.dumps(result))
+    else:
+        started = time.perf_counter()
+        with _open(args.path, "w") as stream:
+            exported = export_products(engine, stream, fmt)
+        print(json.dumps({"exported": exported, "seconds": round(time.perf_counter() - started, 3)}),
+              file=sys.stderr if args.path == "-" else sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
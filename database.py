@@ -1,11 +1,9 @@
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from db_config import USER_DB, build_engine
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///user.db"
+SQLALCHEMY_DATABASE_URL = USER_DB.url
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+engine = build_engine(USER_DB)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
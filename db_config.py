@@ -0,0 +1,120 @@
+import os
+from dataclasses import dataclass, replace
+from typing import Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import NullPool, QueuePool, SingletonThreadPool, StaticPool
+
+# ===== Database configuration =====
+# Every engine in the app is built here from a DatabaseSettings, which can be
+# overridden per database with environment variables named <PREFIX>_<FIELD>,
+# e.g. CATALOG_DB_MMAP_SIZE=0 or USER_DB_POOL_SIZE=10.
+#
+# The catalog databases are opened read-only (SQLite URI mode=ro) for request
+# traffic; migrations and imports go through a separate writer engine. user.db
+# runs in WAL mode so account reads don't wait behind writes.
+
+POOL_CLASSES = {
+    "queue": QueuePool,
+    "null": NullPool,
+    "static": StaticPool,
+    "singleton": SingletonThreadPool,
+}
+
+
+@dataclass(frozen=True)
+class DatabaseSettings:
+    url: str
+    read_only: bool = False
+    pool: str = "queue"
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+    journal_mode: Optional[str] = "WAL"
+    synchronous: Optional[str] = "NORMAL"
+    mmap_size: int = 256 * 1024 * 1024
+    cache_size_kib: int = 64 * 1024
+    busy_timeout_ms: int = 5000
+    temp_store: Optional[str] = "MEMORY"
+
+    @classmethod
+    def from_env(cls, prefix: str, **defaults) -> "DatabaseSettings":
+        settings = cls(**defaults)
+        overrides = {}
+        for name, field in cls.__dataclass_fields__.items():
+            raw = os.getenv(f"{prefix}_{name.upper()}")
+            if raw is None:
+                continue
+            current = getattr(settings, name)
+            if isinstance(current, bool):
+                overrides[name] = raw.lower() in ("1", "true", "yes", "on")
+            elif isinstance(current, int):
+                overrides[name] = int(raw)
+            elif isinstance(current, float):
+                overrides[name] = float(raw)
+            else:
+                overrides[name] = raw or None
+        return replace(settings, **overrides)
+
+    def writer(self) -> "DatabaseSettings":
+        # Settings for maintenance writes against a read-only database.
+        return replace(self, read_only=False, pool="null")
+
+    def connect_url(self) -> str:
+        if not self.read_only or not self.url.startswith("sqlite:///") or "mode=ro" in self.url:
+            return self.url
+        path = self.url[len("sqlite:///"):]
+        return f"sqlite:///file:{path}?mode=ro&uri=true"
+
+
+def _pragmas(settings: DatabaseSettings) -> list:
+    pragmas = [f"PRAGMA busy_timeout = {settings.busy_timeout_ms}"]
+    if settings.journal_mode and not settings.read_only:
+        pragmas.append(f"PRAGMA journal_mode = {settings.journal_mode}")
+    if settings.synchronous and not settings.read_only:
+        pragmas.append(f"PRAGMA synchronous = {settings.synchronous}")
+    pragmas.append(f"PRAGMA mmap_size = {settings.mmap_size}")
+    # Negative cache_size is in KiB rather than pages.
+    pragmas.append(f"PRAGMA cache_size = -{settings.cache_size_kib}")
+    if settings.temp_store:
+        pragmas.append(f"PRAGMA temp_store = {settings.temp_store}")
+    if settings.read_only:
+        pragmas.append("PRAGMA query_only = 1")
+    return pragmas
+
+
+def build_engine(settings: DatabaseSettings):
+    pool_class = POOL_CLASSES[settings.pool]
+    kwargs = {"poolclass": pool_class, "connect_args": {"check_same_thread": False}}
+    if pool_class is QueuePool:
+        kwargs.update(pool_size=settings.pool_size,
+                      max_overflow=settings.max_overflow,
+                      pool_timeout=settings.pool_timeout)
+    engine = create_engine(settings.connect_url(), **kwargs)
+    pragmas = _pragmas(settings)
+
+    @event.listens_for(engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    return engine
+
+
+def optimize(engine, analyze: bool = False, analysis_limit: int = 1000):
+    # PRAGMA optimize re-analyzes only the tables whose statistics look stale;
+    # analyze=True runs ANALYZE on everything first, e.g. after a bulk import.
+    # analysis_limit bounds the rows sampled per index so either stays cheap.
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"PRAGMA analysis_limit = {int(analysis_limit)}")
+        if analyze:
+            connection.exec_driver_sql("ANALYZE")
+        connection.exec_driver_sql("PRAGMA optimize")
+
+
+# ===== Databases =====
+USER_DB = DatabaseSettings.from_env("USER_DB", url="sqlite:///user.db")
+CATALOG_DB = DatabaseSettings.from_env("CATALOG_DB", url="sqlite:///skincare_sample.db", read_only=True)
@@ -0,0 +1,75 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# ===== Blocking DB work off the event loop =====
+# SQLite calls are synchronous. Async handlers hand them to this bounded pool
+# and await the result, so the event loop keeps serving other requests while a
+# query runs. The pool size caps concurrent queries per worker; anything past
+# that waits in the executor's queue, and that wait is what the metrics track.
+# Functions run in a copy of the caller's context, so per-request state kept in
+# context variables (instrumentation.current_request) follows them.
+
+
+class DBExecutor:
+    def __init__(self, max_workers: int = 4, name: str = "db"):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.queued = 0
+        self.running = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.run_seconds_total = 0.0
+
+    def _call(self, enqueued_at: float, fn, args, kwargs):
+        started_at = time.perf_counter()
+        waited = started_at - enqueued_at
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                self.run_seconds_total += time.perf_counter() - started_at
+
+    async def run(self, fn, *args, **kwargs):
+        with self._lock:
+            self.submitted += 1
+            self.queued += 1
+        context = contextvars.copy_context()
+        future = self._pool.submit(context.run, self._call, time.perf_counter(), fn, args, kwargs)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict:
+        with self._lock:
+            completed = self.completed
+            return {
+                "max_workers": self.max_workers,
+                "submitted": self.submitted,
+                "completed": completed,
+                "failed": self.failed,
+                "queued": self.queued,
+                "running": self.running,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+                "wait_seconds_avg": self.wait_seconds_total / completed if completed else 0.0,
+                "run_seconds_total": self.run_seconds_total,
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,546 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, OrderedDict
+from itertools import compress, islice
+from typing import Optional
+from sqlalchemy import text
+from pagination import DEFAULT_SORT, SORT_KEYS, resolve_sort
+
+# ===== Faceted shop filters =====
+# /shop filtering runs against in-memory indexes instead of SQL. Every product
+# gets a dense position; each category, brand and flag is a bitmap over those
+# positions, kept as a Python int so AND/OR/popcount run in C across the
+# whole catalog at once. Multi-select ORs bitmaps within a facet and ANDs
+# across facets; price and rating thresholds come from RangeIndex. For each
+# sort there is a list of positions in listing order, so a page is the first
+# `limit` matching positions of that list and the rows themselves are one
+# primary-key lookup.
+#
+# A catalog change re-reads the indexed columns and patches only the
+# positions whose values moved; a large change (or too many deleted
+# positions) rebuilds from scratch. Queries always see a complete snapshot:
+# refreshes build a new one and swap it in.
+
+COLUMNS = ("product_id", "primary_category", "brand_name", "out_of_stock", "new", "limited_edition",
+           "sephora_exclusive", "online_only", "effective_price", "rating", "reviews", "product_name")
+FACETS = {"categories": "primary_category", "brands": "brand_name"}
+# flag -> (column, value that sets it)
+FLAGS = {
+    "in_stock": ("out_of_stock", 0),
+    "new": ("new", 1),
+    "limited_edition": ("limited_edition", 1),
+    "sephora_exclusive": ("sephora_exclusive", 1),
+    "online_only": ("online_only", 1),
+}
+RANGES = {"price": "effective_price", "rating": "rating"}
+
+# Per-position record: the facet values, the flags as a bit set, then every
+# column a range or sort order reads.
+RECORD = ["primary_category", "brand_name", "flags"] + sorted(
+    {column for direction, keys in SORT_KEYS.values() for column in keys} | set(RANGES.values())
+)
+FIELD = {name: index for index, name in enumerate(RECORD)}
+_COLUMN = {name: index for index, name in enumerate(COLUMNS)}
+_FLAG_BITS = {flag: 1 << index for index, flag in enumerate(FLAGS)}
+_SELECTOR = bytes.maketrans(b"01", b"\x00\x01")
+
+
+def record(row) -> tuple:
+    flags = 0
+    for flag, (column, value) in FLAGS.items():
+        if row[_COLUMN[column]] == value:
+            flags |= _FLAG_BITS[flag]
+    return tuple(flags if name == "flags" else row[_COLUMN[name]] for name in RECORD)
+
+
+def bitmap(positions, size: int) -> int:
+    buffer = bytearray((size + 7) // 8)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def positions(mask: int) -> list:
+    # Set bits of `mask`, lowest first. str.find walks the binary string in C.
+    bits = bin(mask)[:1:-1]
+    found = []
+    index = bits.find("1")
+    while index != -1:
+        found.append(index)
+        index = bits.find("1", index + 1)
+    return found
+
+
+def selector(mask: int) -> bytes:
+    # One 0/1 byte per position, for itertools.compress.
+    return bin(mask)[:1:-1].encode("ascii").translate(_SELECTOR)
+
+
+class RangeIndex:
+    # Non-null values in ascending order with a prefix bitmap every `step`
+    # entries, so "value <= x" is the nearest prefix plus at most `step`
+    # positions set by hand. Rebuilt, not patched, when the column changes.
+
+    def __init__(self, records: list, field: int, size: int, buckets: int = 256):
+        pairs = sorted((item[field], position) for position, item in enumerate(records)
+                       if item is not None and item[field] is not None)
+        self.size = size
+        self.values = [value for value, position in pairs]
+        self.positions = [position for value, position in pairs]
+        self.step = max(64, len(pairs) // buckets + 1)
+        self.prefixes = []
+        buffer = bytearray((size + 7) // 8)
+        for index, position in enumerate(self.positions):
+            if index % self.step == 0:
+                self.prefixes.append(int.from_bytes(buffer, "little"))
+            buffer[position >> 3] |= 1 << (position & 7)
+        self.all = int.from_bytes(buffer, "little")
+
+    def below(self, count: int) -> int:
+        # Bitmap of the `count` smallest values.
+        if count >= len(self.positions):
+            return self.all
+        bucket = count // self.step
+        start = bucket * self.step
+        return self.prefixes[bucket] | bitmap(self.positions[start:count], self.size)
+
+    def at_most(self, value) -> int:
+        return self.below(bisect_right(self.values, value))
+
+    def at_least(self, value) -> int:
+        return self.all ^ self.below(bisect_left(self.values, value))
+
+
+def _null_first(value):
+    # SQLite orders NULL before every value.
+    return (0, 0) if value is None else (1, value)
+
+
+class FacetSnapshot:
+    def __init__(self):
+        self.product_ids = []
+        self.slots = {}
+        self.records = []
+        self.live = 0
+        self.count = 0
+        self.values = {}
+        self.flags = {}
+        self.ranges = {}
+        self.orders = {}
+        self._ranks = {}
+        self._codes = {}
+        self._totals = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.product_ids)
+
+    @property
+    def tombstones(self) -> int:
+        return self.size - self.count
+
+    def sort_key(self, keys: tuple):
+        fields = [FIELD[key] for key in keys]
+        records = self.records
+        product_ids = self.product_ids
+
+        def key(position):
+            item = records[position]
+            return tuple(_null_first(item[field]) for field in fields) + (product_ids[position],)
+        return key
+
+    @classmethod
+    def build(cls, rows: list) -> "FacetSnapshot":
+        snapshot = cls()
+        snapshot.product_ids = [row[0] for row in rows]
+        snapshot.slots = {product_id: position for position, product_id in enumerate(snapshot.product_ids)}
+        snapshot.records = [record(row) for row in rows]
+        size = len(rows)
+        snapshot.count = size
+        snapshot.live = (1 << size) - 1
+        for facet, column in FACETS.items():
+            field = FIELD[column]
+            members = {}
+            for position, item in enumerate(snapshot.records):
+                if item[field]:
+                    members.setdefault(item[field], []).append(position)
+            snapshot.values[facet] = {value: bitmap(found, size) for value, found in members.items()}
+        flags_field = FIELD["flags"]
+        for flag, bit in _FLAG_BITS.items():
+            snapshot.flags[flag] = bitmap(
+                (position for position, item in enumerate(snapshot.records) if item[flags_field] & bit), size
+            )
+        snapshot._build_ranges()
+        for keys in {keys for direction, keys in SORT_KEYS.values()}:
+            snapshot.orders[keys] = sorted(range(size), key=snapshot.sort_key(keys))
+        return snapshot
+
+    def _build_ranges(self):
+        self.ranges = {name: RangeIndex(self.records, FIELD[column], self.size) for name, column in RANGES.items()}
+
+    def diff(self, rows: list):
+        # (added rows, [(position, new record)], removed positions)
+        added, changed, seen = [], [], set()
+        for row in rows:
+            position = self.slots.get(row[0])
+            if position is None:
+                added.append(row)
+                continue
+            seen.add(position)
+            item = record(row)
+            if item != self.records[position]:
+                changed.append((position, item))
+        removed = [position for position in self.slots.values() if position not in seen]
+        return added, changed, removed
+
+    def patched(self, added: list, changed: list, removed: list) -> "FacetSnapshot":
+        snapshot = FacetSnapshot()
+        snapshot.product_ids = list(self.product_ids)
+        snapshot.slots = dict(self.slots)
+        snapshot.records = list(self.records)
+        snapshot.values = {facet: dict(bitmaps) for facet, bitmaps in self.values.items()}
+        snapshot.flags = dict(self.flags)
+        snapshot.live = self.live
+        snapshot.count = self.count
+
+        changed = list(changed)
+        for row in added:
+            position = len(snapshot.product_ids)
+            snapshot.product_ids.append(row[0])
+            snapshot.slots[row[0]] = position
+            snapshot.records.append(None)
+            changed.append((position, record(row)))
+        updates = changed + [(position, None) for position in removed]
+
+        moved_fields = set()
+        for position, item in updates:
+            old = snapshot.records[position]
+            bit = 1 << position
+            if old is not None:
+                snapshot._unset(position, old, bit)
+            if item is not None:
+                snapshot._set(position, item, bit)
+            else:
+                snapshot.slots.pop(snapshot.product_ids[position], None)
+                snapshot.product_ids[position] = None
+            snapshot.records[position] = item
+            for name, field in FIELD.items():
+                if (old[field] if old else None) != (item[field] if item else None):
+                    moved_fields.add(name)
+
+        if moved_fields & set(RANGES.values()):
+            snapshot._build_ranges()
+        else:
+            snapshot.ranges = self.ranges
+        for keys, order in self.orders.items():
+            if not moved_fields & set(keys) and not added and not removed:
+                snapshot.orders[keys] = order
+                continue
+            # Take the moved positions out under their old keys, put them back
+            # under the new ones.
+            order = list(order)
+            old_key = self.sort_key(keys)
+            new_key = snapshot.sort_key(keys)
+            for position, item in updates:
+                if position < self.size and self.records[position] is not None:
+                    del order[bisect_left(order, old_key(position), key=old_key)]
+            for position, item in updates:
+                if item is not None:
+                    insort(order, position, key=new_key)
+            snapshot.orders[keys] = order
+        return snapshot
+
+    def _unset(self, position: int, item: tuple, bit: int):
+        for facet, column in FACETS.items():
+            value = item[FIELD[column]]
+            if value:
+                remaining = self.values[facet][value] & ~bit
+                if remaining:
+                    self.values[facet][value] = remaining
+                else:
+                    del self.values[facet][value]
+        for flag, flag_bit in _FLAG_BITS.items():
+            if item[FIELD["flags"]] & flag_bit:
+                self.flags[flag] &= ~bit
+        self.live &= ~bit
+        self.count -= 1
+
+    def _set(self, position: int, item: tuple, bit: int):
+        for facet, column in FACETS.items():
+            value = item[FIELD[column]]
+            if value:
+                self.values[facet][value] = self.values[facet].get(value, 0) | bit
+        for flag, flag_bit in _FLAG_BITS.items():
+            if item[FIELD["flags"]] & flag_bit:
+                self.flags[flag] |= bit
+        self.live |= bit
+        self.count += 1
+
+    def ranks(self, keys: tuple) -> array:
+        # position -> index in the listing order; built on first use.
+        ranks = self._ranks.get(keys)
+        if ranks is None:
+            ranks = array("l", [-1]) * self.size
+            for index, position in enumerate(self.orders[keys]):
+                ranks[position] = index
+            self._ranks[keys] = ranks
+        return ranks
+
+    # ----- queries -----
+
+    def terms(self, categories, brands, flags, max_price, min_rating) -> dict:
+        terms = {}
+        for facet, selected in (("categories", categories), ("brands", brands)):
+            if selected:
+                mask = 0
+                for value in selected:
+                    mask |= self.values[facet].get(value, 0)
+                terms[facet] = mask
+        for flag in flags:
+            terms[flag] = self.flags[flag]
+        if max_price:
+            terms["max_price"] = self.ranges["price"].at_most(max_price)
+        if min_rating:
+            terms["min_rating"] = self.ranges["rating"].at_least(min_rating)
+        return terms
+
+    def match(self, terms: dict, skip: Optional[str] = None) -> int:
+        mask = self.live
+        for name, term in terms.items():
+            if name != skip:
+                mask &= term
+        return mask
+
+    def codes(self, facet: str) -> list:
+        # position -> facet value, for counting with compress(); built on first use.
+        codes = self._codes.get(facet)
+        if codes is None:
+            field = FIELD[FACETS[facet]]
+            codes = self._codes[facet] = [item[field] if item is not None else None for item in self.records]
+        return codes
+
+    def totals(self, facet: str) -> dict:
+        totals = self._totals.get(facet)
+        if totals is None:
+            totals = self._totals[facet] = {value: mask.bit_count() for value, mask in self.values[facet].items()}
+        return totals
+
+    def value_counts(self, facet: str, base: int) -> dict:
+        # Cheapest of: AND every value's bitmap with `base` (few values), tally
+        # the values of the matching positions (few matches), or tally the
+        # positions *not* matching and subtract from the totals (most match).
+        bitmaps = self.values[facet]
+        matched = base.bit_count()
+        unmatched = self.count - matched
+        if len(bitmaps) * (self.size // 64 + 1) <= min(matched, unmatched) * 16:
+            counts = {}
+            for value, values_bitmap in bitmaps.items():
+                n = (values_bitmap & base).bit_count()
+                if n:
+                    counts[value] = n
+            return counts
+        if matched <= unmatched:
+            counts = Counter(compress(self.codes(facet), selector(base)))
+            counts.pop(None, None)
+            counts.pop("", None)
+            return dict(counts)
+        missing = Counter(compress(self.codes(facet), selector(self.live ^ base)))
+        counts = {}
+        for value, total in self.totals(facet).items():
+            n = total - missing.get(value, 0)
+            if n:
+                counts[value] = n
+        return counts
+
+    def facet_counts(self, terms: dict) -> dict:
+        # Each facet is counted under every filter except its own, so the
+        # options next to a selection stay visible with their counts.
+        counts = {facet: self.value_counts(facet, self.match(terms, skip=facet)) for facet in FACETS}
+        counts["flags"] = {flag: (self.match(terms, skip=flag) & self.flags[flag]).bit_count() for flag in FLAGS}
+        return counts
+
+    def _cursor_rank(self, keys: tuple, descending: bool, after: list) -> int:
+        # Rank to continue from for a cursor's [sort values..., product_id].
+        # A product that is gone is placed by its sort values instead: the
+        # rank just before the first row that sorts after it.
+        position = self.slots.get(after[-1])
+        if position is not None:
+            return self.ranks(keys)[position]
+        cursor_key = tuple(_null_first(value) for value in after[:-1]) + (after[-1],)
+        index = bisect_left(self.orders[keys], cursor_key, key=self.sort_key(keys))
+        return index if descending else index - 1
+
+    def page(self, mask: int, sort: str, offset: int, limit: int, after: Optional[list] = None):
+        # `after` is a decoded cursor (pagination.decode_cursor).
+        direction, keys = SORT_KEYS[resolve_sort(sort)]
+        descending = direction == "DESC"
+        order = self.orders[keys]
+        total = mask.bit_count()
+        if total == 0:
+            return [], False
+        wanted = offset + limit + 1
+        start = None
+        if after is not None:
+            try:
+                start = self._cursor_rank(keys, descending, after)
+            except TypeError:
+                # Sort values of the wrong type: a forged or stale-format
+                # cursor. An empty page rather than page 1 again.
+                return [], False
+
+        if total * total <= wanted * self.count:
+            # Sparse match: sorting the matches beats walking the order until
+            # enough of them turn up.
+            ranks = self.ranks(keys)
+            found = positions(mask)
+            if start is not None:
+                found = [p for p in found if (ranks[p] < start if descending else ranks[p] > start)]
+            found.sort(key=ranks.__getitem__, reverse=descending)
+            selected = found[offset:offset + limit + 1]
+        else:
+            data = mask.to_bytes((self.size + 7) // 8, "little")
+            if descending:
+                first = len(order) - 1 if start is None else start - 1
+                walk = (order[index] for index in range(first, -1, -1))
+            else:
+                walk = islice(order, 0 if start is None else start + 1, None)
+            selected = []
+            skipped = 0
+            for position in walk:
+                if data[position >> 3] >> (position & 7) & 1:
+                    if skipped < offset:
+                        skipped += 1
+                        continue
+                    selected.append(position)
+                    if len(selected) == limit + 1:
+                        break
+        return [self.product_ids[p] for p in selected[:limit]], len(selected) > limit
+
+
+class FacetIndex:
+    def __init__(self, engine, max_count_entries: int = 256, rebuild_fraction: float = 0.05, snapshots=None):
+        self.engine = engine
+        self.snapshots = snapshots
+        self.max_count_entries = max_count_entries
+        self.rebuild_fraction = rebuild_fraction
+        self._snapshot = None
+        self._stale = True
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._counts = OrderedDict()
+        self.builds = 0
+        self.patches = 0
+        self.patched_rows = 0
+        self.refresh_seconds = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, generation: Optional[int] = None):
+        # Used as a CatalogMetadata.on_invalidate hook; the next query (or
+        # catalog_watch) refreshes.
+        self._stale = True
+
+    def _load_rows(self) -> list:
+        # Column scans of the catalog snapshot when one is mapped.
+        snapshot = self.snapshots.current() if self.snapshots is not None else None
+        if snapshot is not None:
+            return snapshot.scan(COLUMNS)
+        with self.engine.connect() as connection:
+            return connection.execute(text(f"SELECT {', '.join(COLUMNS)} FROM products")).all()
+
+    def refresh(self) -> bool:
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh(self) -> bool:
+        self._stale = False
+        started = time.perf_counter()
+        rows = self._load_rows()
+        current = self._snapshot
+        if current is None:
+            snapshot = FacetSnapshot.build(rows)
+            self.builds += 1
+        else:
+            added, changed, removed = current.diff(rows)
+            moved = len(added) + len(changed) + len(removed)
+            if not moved:
+                return False
+            if moved > max(64, current.count * self.rebuild_fraction) or \
+                    current.tombstones + len(removed) > current.size // 4:
+                snapshot = FacetSnapshot.build(rows)
+                self.builds += 1
+            else:
+                snapshot = current.patched(added, changed, removed)
+                self.patches += 1
+                self.patched_rows += moved
+        with self._lock:
+            self._snapshot = snapshot
+            self._counts.clear()
+        self.refresh_seconds = time.perf_counter() - started
+        return True
+
+    def snapshot(self) -> FacetSnapshot:
+        # While a refresh is running, queries keep using the previous snapshot;
+        # only the very first build makes them wait.
+        if self._stale or self._snapshot is None:
+            if self._refresh_lock.acquire(blocking=self._snapshot is None):
+                try:
+                    if self._stale or self._snapshot is None:
+                        self._refresh()
+                finally:
+                    self._refresh_lock.release()
+        return self._snapshot
+
+    def search(self,
+               categories=(),
+               brands=(),
+               flags=(),
+               max_price: Optional[float] = None,
+               min_rating: Optional[float] = None,
+               sort: str = DEFAULT_SORT,
+               offset: int = 0,
+               limit: int = 12,
+               after: Optional[list] = None) -> dict:
+        # `after` is the decoded cursor of the row the previous page ended
+        # on; the listing continues after it even if it left the catalog.
+        unknown = set(flags) - set(FLAGS)
+        if unknown:
+            raise ValueError(f"Unknown shop flags: {sorted(unknown)}")
+        snapshot = self.snapshot()
+        terms = snapshot.terms(categories, brands, flags, max_price, min_rating)
+        mask = snapshot.match(terms)
+        ids, has_more = snapshot.page(mask, sort, offset, limit, after)
+
+        key = (tuple(sorted(set(categories))), tuple(sorted(set(brands))), tuple(sorted(set(flags))),
+               max_price or None, min_rating or None)
+        with self._lock:
+            counts = self._counts.get(key) if self._snapshot is snapshot else None
+            if counts is not None:
+                self._counts.move_to_end(key)
+        if counts is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            counts = snapshot.facet_counts(terms)
+            with self._lock:
+                if self._snapshot is snapshot:
+                    self._counts[key] = counts
+                    while len(self._counts) > self.max_count_entries:
+                        self._counts.popitem(last=False)
+
+        return {"ids": ids, "total": mask.bit_count(), "has_more": has_more, "counts": counts}
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "products": snapshot.count if snapshot else 0,
+            "tombstones": snapshot.tombstones if snapshot else 0,
+            "builds": self.builds,
+            "patches": self.patches,
+            "patched_rows": self.patched_rows,
+            "refresh_seconds": self.refresh_seconds,
+            "count_hits": self.hits,
+            "count_misses": self.misses,
+        }
@@ -0,0 +1,346 @@
+import bisect
+import contextvars
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+from jinja2 import Template
+from sqlalchemy import event
+
+# ===== Metrics =====
+# A small Prometheus-style registry: counters, histograms with fixed buckets,
+# and "collectors" that turn the stats() dicts the caches and pools already
+# keep into gauges at scrape time. render() produces the text exposition
+# format served on /metrics.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+def _label_text(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for name, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self, prefix: str = "lunor"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._help[f"{self.prefix}_{name}"] = (kind, help_text)
+
+    def inc(self, name: str, labels: tuple = (), amount: float = 1.0):
+        key = (f"{self.prefix}_{name}", labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + amount
+
+    def observe(self, name: str, value: float, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        key = (f"{self.prefix}_{name}", labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def register_collector(self, name: str, stats):
+        # `stats` returns a (possibly nested) dict; every number in it becomes
+        # a gauge <prefix>_<name>_<key> when /metrics is scraped.
+        self._collectors.append((name, stats))
+
+    def _collected(self) -> list:
+        lines = []
+        for name, stats in self._collectors:
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"Error collecting {name} stats: {e}")
+                continue
+            stack = [(f"{self.prefix}_{name}", values)]
+            while stack:
+                prefix, value = stack.pop()
+                if isinstance(value, dict):
+                    stack.extend((f"{prefix}_{key}", item) for key, item in value.items())
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append((prefix, value))
+                elif isinstance(value, bool):
+                    lines.append((prefix, int(value)))
+        return sorted(lines)
+
+    def render(self) -> str:
+        out = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                ((key, list(h.buckets), list(h.counts), h.sum, h.count) for key, h in self._histograms.items()),
+                key=lambda item: item[0]
+            )
+        described = set()
+
+        def header(name: str, default_kind: str):
+            if name in described:
+                return
+            described.add(name)
+            kind, help_text = self._help.get(name, (default_kind, ""))
+            if help_text:
+                out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            out.append(f"{name}{_label_text(labels)} {value:g}")
+        for (name, labels), buckets, counts, total, count in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                out.append(f"{name}_bucket{_label_text(labels + (('le', f'{bound:g}'),))} {cumulative}")
+            out.append(f"{name}_bucket{_label_text(labels + (('le', '+Inf'),))} {count}")
+            out.append(f"{name}_sum{_label_text(labels)} {total:g}")
+            out.append(f"{name}_count{_label_text(labels)} {count}")
+        for name, value in self._collected():
+            header(name, "gauge")
+            out.append(f"{name} {value:g}")
+        return "\n".join(out) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("http_request_duration_seconds", "histogram", "Request latency by route")
+metrics.describe("http_requests_total", "counter", "Requests by route and status")
+metrics.describe("http_exceptions_total", "counter", "Unhandled exceptions by route")
+metrics.describe("request_db_queries", "histogram", "SQL statements per request")
+metrics.describe("request_db_seconds", "histogram", "Time in SQL per request")
+metrics.describe("request_template_seconds", "histogram", "Time rendering templates per request")
+metrics.describe("db_query_seconds", "histogram", "SQL statement latency by database")
+metrics.describe("template_render_seconds", "histogram", "Render time by template")
+
+
+# ===== Per-request accounting =====
+# The middleware puts a RequestStats in a context variable. DBExecutor runs
+# its functions inside a copy of the caller's context, so queries issued on
+# pool threads still land on the request that asked for them.
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "template_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def instrument_engine(engine, name: str):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        metrics.observe("db_query_seconds", elapsed, (("database", name),))
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started"):
+            connection.info["query_started"].pop()
+        metrics.inc("db_errors_total", (("database", name),))
+
+    return engine
+
+
+_render_depth = threading.local()
+
+
+class TimedTemplate(Template):
+    # Install with env.template_class = TimedTemplate before templates are
+    # loaded. Nested renders (fragments) are timed per template but only the
+    # outermost one is added to the request total.
+
+    def render(self, *args, **kwargs):
+        depth = getattr(_render_depth, "value", 0)
+        _render_depth.value = depth + 1
+        started = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            _render_depth.value = depth
+            metrics.observe("template_render_seconds", elapsed, (("template", self.name or "?"),))
+            if depth == 0:
+                stats = current_request.get()
+                if stats is not None:
+                    stats.template_seconds += elapsed
+
+
+# ===== Sampling profiler =====
+# Samples the stacks of every thread (event loop and DB pool alike) while one
+# request runs and returns them in collapsed "a;b;c count" form, which
+# flamegraph.pl and speedscope read directly. Other requests running at the
+# same time show up too; profile on a quiet worker.
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+# ===== ASGI middleware =====
+
+
+class InstrumentationMiddleware:
+    def __init__(self, app, profile_token: Optional[str] = None, profile_interval: float = 0.001):
+        self.app = app
+        self.profile_token = profile_token
+        self.profile_interval = profile_interval
+        self._route_paths = None
+
+    def _route_label(self, scope) -> str:
+        if self._route_paths is None:
+            router = scope["app"].router if "app" in scope and hasattr(scope["app"], "router") else None
+            if router is None:
+                return "unmatched"
+            self._route_paths = {getattr(route, "endpoint", None): route.path for route in router.routes
+                                 if getattr(route, "endpoint", None) is not None}
+        endpoint = scope.get("endpoint")
+        if endpoint is not None and endpoint in self._route_paths:
+            return self._route_paths[endpoint]
+        path = scope.get("path", "")
+        if path.startswith("/static/"):
+            return "/static"
+        return "unmatched"
+
+    def _wants_profile(self, scope) -> bool:
+        if not self.profile_token or b"__profile=1" not in scope.get("query_string", b""):
+            return False
+        for name, value in scope.get("headers", []):
+            if name == b"x-profile-token":
+                return secrets.compare_digest(value, self.profile_token.encode("utf-8"))
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if self._wants_profile(scope):
+            return await self._profile(scope, receive, send)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timing = (f"db;dur={stats.db_seconds * 1000:.2f};desc=\"{stats.queries} queries\", "
+                          f"tpl;dur={stats.template_seconds * 1000:.2f}, "
+                          f"app;dur={(time.perf_counter() - started) * 1000:.2f}")
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", timing.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            metrics.inc("http_exceptions_total", (("route", self._route_label(scope)), ("exception", type(e).__name__)))
+            raise
+        finally:
+            current_request.reset(token)
+            route = self._route_label(scope)
+            method = scope.get("method", "GET")
+            labels = (("method", method), ("route", route))
+            metrics.observe("http_request_duration_seconds", time.perf_counter() - started, labels)
+            metrics.inc("http_requests_total", labels + (("status", f"{status // 100}xx"),))
+            if route != "/static":
+                metrics.observe("request_db_queries", stats.queries, labels, COUNT_BUCKETS)
+                metrics.observe("request_db_seconds", stats.db_seconds, labels)
+                metrics.observe("request_template_seconds", stats.template_seconds, labels)
+
+    async def _profile(self, scope, receive, send):
+        # Run the request as usual, throw its body away and answer with the
+        # collapsed stacks instead.
+        status = 500
+
+        async def discard(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        with SamplingProfiler(self.profile_interval) as profiler:
+            started = time.perf_counter()
+            await self.app(scope, receive, discard)
+            elapsed = time.perf_counter() - started
+        body = profiler.collapsed().encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"content-length", str(len(body)).encode()),
+                (b"x-profile-status", str(status).encode()),
+                (b"x-profile-seconds", f"{elapsed:.4f}".encode()),
+                (b"cache-control", b"no-store"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,141 @@
+import asyncio
+import random
+import time
+from contextlib import suppress
+from typing import Optional
+from instrumentation import metrics
+
+# ===== Background jobs =====
+# Maintenance used to live in hand-written `while True: sleep` loops in
+# app.py. A JobScheduler runs it instead, inside the app's lifespan:
+#   - periodic jobs run every `interval` seconds, jittered by +-`jitter` so
+#     workers started together don't all hit SQLite at the same moment
+#   - any job can be triggered on demand; triggers that arrive while it is
+#     pending or running fold into one more run
+#   - at most `max_concurrent` limited jobs run at once; cheap, frequent jobs
+#     (limited=False) never wait behind a slow rebuild
+# A job is an async callable; whatever it returns (a count, a dict) is kept as
+# its last result. Each job's runs, failures and last duration are reported
+# by status() and on /metrics.
+
+
+class Job:
+    def __init__(self, name: str, run, interval: Optional[float] = None, jitter: float = 0.1,
+                 limited: bool = True):
+        self.name = name
+        self.run = run
+        self.interval = interval
+        self.jitter = jitter
+        self.limited = limited
+        self.wake = None
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.last_started = None
+        self.last_duration = None
+        self.last_status = None
+        self.last_error = None
+        self.last_result = None
+        self.next_run = None
+
+    def delay(self) -> Optional[float]:
+        if self.interval is None:
+            return None
+        return max(0.0, self.interval * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def status(self) -> dict:
+        return {
+            "interval": self.interval,
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_started": self.last_started,
+            "last_duration": self.last_duration,
+            "last_status": self.last_status,
+            "last_error": self.last_error,
+            "last_result": self.last_result,
+            "next_run": self.next_run,
+        }
+
+
+class JobScheduler:
+    def __init__(self, max_concurrent: int = 2):
+        self.max_concurrent = max_concurrent
+        self.jobs = {}
+        self._slots = None
+        self._tasks = []
+
+    def add(self, name: str, run, interval: Optional[float] = None, jitter: float = 0.1,
+            limited: bool = True) -> Job:
+        job = Job(name, run, interval, jitter, limited)
+        self.jobs[name] = job
+        return job
+
+    def trigger(self, name: str) -> bool:
+        # From the event loop thread; a no-op until start().
+        job = self.jobs.get(name)
+        if job is None:
+            return False
+        if job.wake is not None:
+            job.wake.set()
+        return True
+
+    def start(self):
+        # From inside the running event loop (the lifespan), which the events
+        # and semaphore belong to.
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        for job in self.jobs.values():
+            job.wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._loop(job), name=f"job:{job.name}") for job in self.jobs.values()]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+        self._tasks = []
+
+    async def _loop(self, job: Job):
+        while True:
+            delay = job.delay()
+            job.next_run = time.time() + delay if delay is not None else None
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(job.wake.wait(), delay)
+            job.wake.clear()
+            job.next_run = None
+            if job.limited:
+                async with self._slots:
+                    await self._execute(job)
+            else:
+                await self._execute(job)
+
+    async def _execute(self, job: Job):
+        job.running = True
+        job.last_started = time.time()
+        started = time.perf_counter()
+        try:
+            result = await job.run()
+            job.last_status = "ok"
+            job.last_error = None
+            job.last_result = result if isinstance(result, (int, float, str, dict, type(None))) else repr(result)
+        except Exception as e:
+            job.failures += 1
+            job.last_status = "error"
+            job.last_error = f"{type(e).__name__}: {e}"
+            metrics.inc("job_failures_total", (("job", job.name),))
+            print(f"Error in background job {job.name}: {e}")
+        finally:
+            job.running = False
+            job.runs += 1
+            job.last_duration = time.perf_counter() - started
+            metrics.observe("job_seconds", job.last_duration, (("job", job.name),))
+
+    def status(self) -> dict:
+        return {name: job.status() for name, job in self.jobs.items()}
+
+    def stats(self) -> dict:
+        # Numeric fields only, for the /metrics collector.
+        return {name: {"runs": job.runs, "failures": job.failures, "running": job.running,
+                       "last_duration": job.last_duration or 0.0}
+                for name, job in self.jobs.items()}
@@ -0,0 +1,206 @@
+import sys
+from sqlalchemy import text
+import catalog
+import pagination
+import search
+from db_config import CATALOG_DB, DatabaseSettings, build_engine
+
+# ===== Catalog schema migrations =====
+# The catalog databases are loaded from CSV dumps, so their schema is whatever
+# pandas guessed. Each step upgrades PRAGMA user_version by one and runs in a
+# single transaction; index creation is idempotent and runs on every start.
+
+PRODUCT_COLUMNS = """
+    product_id TEXT PRIMARY KEY,
+    product_name TEXT,
+    brand_id INTEGER,
+    brand_name TEXT,
+    loves_count INTEGER,
+    rating REAL,
+    reviews REAL,
+    size TEXT,
+    variation_type TEXT,
+    variation_value TEXT,
+    variation_desc TEXT,
+    ingredients TEXT,
+    price_usd REAL,
+    value_price_usd REAL,
+    sale_price_usd REAL,
+    limited_edition INTEGER,
+    new INTEGER,
+    online_only INTEGER,
+    out_of_stock INTEGER,
+    sephora_exclusive INTEGER,
+    highlights TEXT,
+    primary_category TEXT,
+    secondary_category TEXT,
+    tertiary_category TEXT,
+    child_count INTEGER,
+    child_max_price REAL,
+    child_min_price REAL,
+    image_filename TEXT,
+    image_path TEXT,
+    image_url TEXT,
+    effective_price REAL GENERATED ALWAYS AS (COALESCE(NULLIF(sale_price_usd, 0), price_usd)) STORED
+"""
+
+COPIED_COLUMNS = [
+    "product_id", "product_name", "brand_id", "brand_name", "loves_count", "rating", "reviews",
+    "size", "variation_type", "variation_value", "variation_desc", "ingredients", "price_usd",
+    "value_price_usd", "sale_price_usd", "limited_edition", "new", "online_only", "out_of_stock",
+    "sephora_exclusive", "highlights", "primary_category", "secondary_category", "tertiary_category",
+    "child_count", "child_max_price", "child_min_price", "image_filename", "image_path", "image_url",
+]
+
+
+def _migrate_effective_price(connection):
+    # sale_price_usd was TEXT ('', 'None', '$12.00', '12.0'); rebuild the table
+    # with a REAL column and a stored effective_price that can be indexed.
+    # rowids are carried over so the FTS index still lines up.
+    copied = ", ".join(COPIED_COLUMNS)
+    selected = ", ".join(
+        "CAST(NULLIF(NULLIF(REPLACE(TRIM(sale_price_usd), '$', ''), ''), 'None') AS REAL)"
+        if column == "sale_price_usd" else column
+        for column in COPIED_COLUMNS
+    )
+    connection.execute(text(f"CREATE TABLE products_migrated ({PRODUCT_COLUMNS})"))
+    connection.execute(text(f"""
+        INSERT INTO products_migrated (rowid, {copied})
+        SELECT rowid, {selected} FROM products
+    """))
+    connection.execute(text("DROP TABLE products"))
+    connection.execute(text("ALTER TABLE products_migrated RENAME TO products"))
+
+
+def _add_catalog_revision(connection):
+    # A counter bumped by every bulk load so running workers notice that the
+    # catalog changed under them (see catalog.CatalogMetadata.refresh_if_changed).
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS catalog_revision (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            revision INTEGER NOT NULL,
+            updated_at REAL
+        )
+    """))
+    connection.execute(text("INSERT OR IGNORE INTO catalog_revision (id, revision, updated_at) VALUES (1, 0, NULL)"))
+
+
+def _add_catalog_id(connection):
+    # A random id per catalog database. Revisions start at 0 in every
+    # database, so files built from a catalog (snapshot.py, recommendations.py)
+    # record this id too, to tell two catalogs at the same revision apart.
+    connection.execute(text("ALTER TABLE catalog_revision ADD COLUMN catalog_id TEXT"))
+    connection.execute(text("UPDATE catalog_revision SET catalog_id = lower(hex(randomblob(16))) WHERE id = 1"))
+
+
+MIGRATIONS = [
+    _migrate_effective_price,
+    _add_catalog_revision,
+    _add_catalog_id,
+]
+
+# Composite indexes for the /shop filters, each ending in the sort keys of a
+# pagination.SORT_KEYS order so the planner can walk the index instead of
+# sorting. SQLite scans an index backwards for the DESC orders.
+# /shop itself is served by the facet index (facets.py) and never runs these
+# queries; the 16 sort indexes only serve the SQL listing_query kept for the
+# EXPLAIN check below and benchmarks/bench_facets.py.
+_SORT_INDEX_KEYS = {
+    "rating": "rating, reviews, product_id",
+    "price": "effective_price, product_id",
+    "name": "product_name, product_id",
+    "new": "new, rating, product_id",
+}
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_products_category_brand ON products (primary_category, brand_name)",
+    "CREATE INDEX IF NOT EXISTS ix_products_image_url ON products (image_url)",
+]
+for _name, _keys in _SORT_INDEX_KEYS.items():
+    INDEXES.append(f"CREATE INDEX IF NOT EXISTS ix_products_{_name} ON products ({_keys})")
+    INDEXES.append(f"CREATE INDEX IF NOT EXISTS ix_products_category_{_name} ON products (primary_category, {_keys})")
+    INDEXES.append(f"CREATE INDEX IF NOT EXISTS ix_products_brand_{_name} ON products (brand_name, {_keys})")
+    INDEXES.append(f"CREATE INDEX IF NOT EXISTS ix_products_stock_{_name} ON products (out_of_stock, {_keys})")
+
+
+def schema_version(connection) -> int:
+    return connection.execute(text("PRAGMA user_version")).scalar() or 0
+
+
+def create_products_table(connection, table: str = "products"):
+    # Fresh databases get the current products schema directly; the
+    # effective_price rebuild only exists for dumps made before it.
+    connection.execute(text(f"CREATE TABLE IF NOT EXISTS {table} ({PRODUCT_COLUMNS})"))
+    if table == "products" and schema_version(connection) == 0:
+        version = MIGRATIONS.index(_migrate_effective_price) + 1
+        connection.execute(text(f"PRAGMA user_version = {version}"))
+
+
+def create_indexes(connection):
+    for statement in INDEXES:
+        connection.execute(text(statement))
+
+
+def migrate_catalog(engine) -> int:
+    with engine.begin() as connection:
+        version = schema_version(connection)
+        for step in MIGRATIONS[version:]:
+            step(connection)
+            version += 1
+            connection.execute(text(f"PRAGMA user_version = {version}"))
+        create_indexes(connection)
+    # Rebuilding the table drops its triggers; put the search ones back.
+    search.ensure_search_index(engine)
+    return version
+
+
+# ===== EXPLAIN check =====
+# Single-facet filters must never need a temp B-tree for ORDER BY. Filtering
+# on both category and brand at once is allowed to sort (the result set is
+# small and one more index per sort isn't worth the write cost).
+CHECKED_FILTERS = {
+    "none": {},
+    "category": {"category": "Skincare"},
+    "brand": {"brand": "CLINIQUE"},
+    "in_stock": {"in_stock": True},
+    "max_price": {"max_price": 50.0},
+    "min_rating": {"min_rating": 4.0},
+    "category+in_stock": {"category": "Skincare", "in_stock": True},
+}
+
+
+def explain_shop_queries(connection) -> list:
+    plans = []
+    for filter_name, filters in CHECKED_FILTERS.items():
+        conditions, params = catalog.shop_filters(**filters)
+        for sort in pagination.SORT_KEYS:
+            query = pagination.listing_query(conditions, sort)
+            rows = connection.execute(text("EXPLAIN QUERY PLAN " + query),
+                                      {**params, "limit": 13, "offset": 0}).all()
+            details = [row[-1] for row in rows]
+            plans.append({
+                "filters": filter_name,
+                "sort": sort,
+                "plan": details,
+                "uses_index": any("USING" in detail and "INDEX" in detail for detail in details),
+                "temp_sort": any("TEMP B-TREE" in detail for detail in details),
+            })
+    return plans
+
+
+def check_shop_indexes(engine) -> bool:
+    ok = True
+    with engine.connect() as connection:
+        for plan in explain_shop_queries(connection):
+            passed = plan["uses_index"] and not plan["temp_sort"]
+            ok = ok and passed
+            status = "ok  " if passed else "FAIL"
+            print(f"{status} {plan['filters']:<18} {plan['sort']:<12} {' | '.join(plan['plan'])}")
+    return ok
+
+
+if __name__ == "__main__":
+    settings = DatabaseSettings(url=sys.argv[1]) if len(sys.argv) > 1 else CATALOG_DB
+    check_engine = build_engine(settings.writer())
+    print(f"schema version {migrate_catalog(check_engine)}")
+    sys.exit(0 if check_shop_indexes(check_engine) else 1)
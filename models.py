@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Text, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Text, Boolean, ForeignKey, Computed
 from sqlalchemy.orm import relationship
 from database import Base
 from pydantic import BaseModel, constr
@@ -31,6 +31,56 @@ class User(Base):
     addresses = relationship("Address", back_populates="user")
 
 
+class Order(Base):
+    __tablename__ = "orders"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    cart_id = Column(String, nullable=True)
+    status = Column(String, nullable=False, default="placed")
+    item_count = Column(Integer, nullable=False)
+    total = Column(Float, nullable=False)
+    created_at = Column(Float, nullable=False)
+
+    lines = relationship("OrderLine", back_populates="order")
+
+
+class OrderLine(Base):
+    __tablename__ = "order_lines"
+
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
+    product_id = Column(String, nullable=False)
+    product_name = Column(String)
+    brand_name = Column(String)
+    unit_price = Column(Float, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    line_total = Column(Float, nullable=False)
+
+    order = relationship("Order", back_populates="lines")
+
+
+class Cart(Base):
+    __tablename__ = "carts"
+
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), unique=True, nullable=True)
+    created_at = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False, index=True)
+
+    lines = relationship("CartLine", back_populates="cart", cascade="all, delete-orphan")
+
+
+class CartLine(Base):
+    __tablename__ = "cart_items"
+
+    cart_id = Column(String, ForeignKey("carts.id", ondelete="CASCADE"), primary_key=True)
+    product_id = Column(String, primary_key=True)
+    quantity = Column(Integer, nullable=False)
+
+    cart = relationship("Cart", back_populates="lines")
+
+
 class UserRegister(BaseModel):
     username: constr(min_length=3, max_length=50)
     password: constr(min_length=6)
@@ -54,7 +104,7 @@ class Product(Base):
     ingredients = Column(Text)
     price_usd = Column(Float)
     value_price_usd = Column(Float)
-    sale_price_usd = Column(String)
+    sale_price_usd = Column(Float)
     limited_edition = Column(Integer)
     new = Column(Integer)
     online_only = Column(Integer)
@@ -70,6 +120,7 @@ class Product(Base):
     image_filename = Column(String)
     image_path = Column(String)
     image_url = Column(String)
+    effective_price = Column(Float, Computed("COALESCE(NULLIF(sale_price_usd, 0), price_usd)", persisted=True))
 
 
 class Product(db.Model):
@@ -0,0 +1,222 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional
+from sqlalchemy import text
+import products
+
+# ===== Orders =====
+# Checkout prices the cart with one batched catalog query, refuses lines that
+# are out of stock or gone, and hands the priced order to OrderWriter.
+#
+# OrderWriter is a group commit: a single writer thread takes whatever orders
+# are queued (up to max_batch, waiting at most max_wait for more once the
+# first arrives) and inserts them all in one transaction. Concurrent
+# checkouts then share one commit/fsync instead of queueing one by one on
+# SQLite's write lock. If a batch fails, its orders are retried one per
+# transaction so one bad order can't fail the others.
+#
+# An order placed for a cart empties that cart in the order's own
+# transaction, and only if the cart still holds exactly the lines that were
+# priced. A double submit or a retried request then finds the cart already
+# taken and fails with CartChanged instead of placing a second order.
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCart(CheckoutError):
+    pass
+
+
+class CartChanged(CheckoutError):
+    pass
+
+
+class OutOfStock(CheckoutError):
+    def __init__(self, product_ids: list):
+        super().__init__(f"Unavailable: {', '.join(product_ids)}")
+        self.product_ids = product_ids
+
+
+def price_order(connection, cart_items: list) -> dict:
+    quantities = {}
+    for item in cart_items:
+        try:
+            product_id = str(item["product_id"])
+            quantity = int(item["quantity"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if quantity > 0:
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+    if not quantities:
+        raise EmptyCart("Cart is empty")
+
+    # Read straight from the catalog rather than the product cache: stock
+    # and price must be current at the moment of ordering.
+    found = products.fetch_many(connection, list(quantities), products.CART_COLUMNS)
+    unavailable = [product_id for product_id in quantities
+                   if product_id not in found or found[product_id].out_of_stock]
+    if unavailable:
+        raise OutOfStock(unavailable)
+
+    lines = []
+    total = 0.0
+    for product_id, quantity in quantities.items():
+        product = found[product_id]
+        unit_price = product.effective_price or 0.0
+        line_total = round(unit_price * quantity, 2)
+        total += line_total
+        lines.append({
+            "product_id": product_id,
+            "product_name": product.product_name,
+            "brand_name": product.brand_name,
+            "unit_price": unit_price,
+            "quantity": quantity,
+            "line_total": line_total,
+        })
+    return {
+        "lines": lines,
+        "item_count": sum(quantities.values()),
+        "total": round(total, 2),
+    }
+
+
+def claim_cart(connection, cart_id: str, order: dict, now: float):
+    stored = {row.product_id: row.quantity for row in connection.execute(text("""
+        SELECT product_id, quantity FROM cart_items WHERE cart_id = :cart_id
+    """), {"cart_id": cart_id})}
+    priced = {line["product_id"]: line["quantity"] for line in order["lines"]}
+    if stored != priced:
+        raise CartChanged(f"Cart {cart_id} changed since it was priced")
+    connection.execute(text("DELETE FROM cart_items WHERE cart_id = :cart_id"), {"cart_id": cart_id})
+    connection.execute(text("UPDATE carts SET updated_at = :now WHERE id = :cart_id"),
+                       {"cart_id": cart_id, "now": now})
+
+
+def insert_order(connection, order: dict, user_id: Optional[int] = None,
+                 cart_id: Optional[str] = None, created_at: Optional[float] = None) -> int:
+    created_at = created_at if created_at is not None else time.time()
+    if cart_id is not None:
+        claim_cart(connection, cart_id, order, created_at)
+    result = connection.execute(text("""
+        INSERT INTO orders (user_id, cart_id, status, item_count, total, created_at)
+        VALUES (:user_id, :cart_id, 'placed', :item_count, :total, :created_at)
+    """), {
+        "user_id": user_id,
+        "cart_id": cart_id,
+        "item_count": order["item_count"],
+        "total": order["total"],
+        "created_at": created_at,
+    })
+    order_id = result.lastrowid
+    connection.execute(text("""
+        INSERT INTO order_lines (order_id, product_id, product_name, brand_name, unit_price, quantity, line_total)
+        VALUES (:order_id, :product_id, :product_name, :brand_name, :unit_price, :quantity, :line_total)
+    """), [{"order_id": order_id, **line} for line in order["lines"]])
+    return order_id
+
+
+class OrderWriter:
+    def __init__(self, engine, max_batch: int = 64, max_wait: float = 0.002):
+        self.engine = engine
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.orders = 0
+        self.retried = 0
+        self.failed = 0
+        self.largest_batch = 0
+        self.commit_seconds_total = 0.0
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="order-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, order: dict, user_id: Optional[int] = None, cart_id: Optional[str] = None) -> Future:
+        self._ensure_started()
+        future = Future()
+        self._queue.put((order, user_id, cart_id, time.time(), future))
+        return future
+
+    async def place(self, order: dict, user_id: Optional[int] = None, cart_id: Optional[str] = None) -> int:
+        return await asyncio.wrap_future(self.submit(order, user_id, cart_id))
+
+    def _next_batch(self, first) -> tuple:
+        batch = [first]
+        stop = False
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.monotonic()
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch, stop = self._next_batch(first)
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch: list):
+        started = time.perf_counter()
+        try:
+            with self.engine.begin() as connection:
+                order_ids = [insert_order(connection, order, user_id, cart_id, created_at)
+                             for order, user_id, cart_id, created_at, future in batch]
+        except Exception as e:
+            if len(batch) == 1:
+                self.failed += 1
+                batch[0][-1].set_exception(e)
+                return
+            print(f"Error committing order batch of {len(batch)}, retrying one by one: {e}")
+            self.retried += len(batch)
+            for item in batch:
+                self._commit([item])
+            return
+        self.batches += 1
+        self.orders += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        self.commit_seconds_total += time.perf_counter() - started
+        for item, order_id in zip(batch, order_ids):
+            item[-1].set_result(order_id)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "orders": self.orders,
+            "avg_batch": self.orders / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "retried": self.retried,
+            "failed": self.failed,
+            "queued": self._queue.qsize(),
+            "commit_seconds_total": self.commit_seconds_total,
+        }
+
+    def shutdown(self, wait: bool = True):
+        # Orders already queued are still written before the thread exits.
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        if wait:
+            self._thread.join()
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from jinja2 import pass_context
+from markupsafe import Markup
+from starlette.requests import Request
+from starlette.responses import Response
+from cache import LRUCache
+
+# ===== Rendered page cache =====
+# Static-content pages only vary by the signed-in user's header. Anonymous
+# requests are served whole from a cache of rendered bytes; signed-in requests
+# still render the page but reuse cached header/footer fragments. Either way
+# the response carries an ETag and Last-Modified, and a matching conditional
+# request gets an empty 304.
+
+
+class RenderedPage:
+    __slots__ = ("body", "etag", "last_modified")
+
+    def __init__(self, body: bytes, last_modified: float):
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.last_modified = int(last_modified)
+
+
+def not_modified(request: Request, page: RenderedPage) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return page.etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return page.last_modified <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def page_response(request: Request, page: RenderedPage, status_code: int = 200) -> Response:
+    headers = {
+        "ETag": page.etag,
+        "Last-Modified": formatdate(page.last_modified, usegmt=True),
+        # Shared caches must keep signed-in and anonymous variants apart.
+        "Vary": "Cookie",
+        "Cache-Control": "no-cache",
+    }
+    if not_modified(request, page):
+        return Response(status_code=304, headers=headers)
+    return Response(page.body, status_code=status_code, media_type="text/html", headers=headers)
+
+
+class PageCache:
+    def __init__(self, templates, max_bytes: int = 8 * 1024 * 1024, ttl: float = 3600.0):
+        self.templates = templates
+        self.pages = LRUCache(max_bytes=max_bytes, ttl=ttl)
+        self.fragments = LRUCache(max_bytes=max_bytes, ttl=ttl)
+        templates.env.globals["fragment"] = self._fragment
+
+    def _template_mtime(self, template_name: str) -> float:
+        template = self.templates.get_template(template_name)
+        try:
+            return os.path.getmtime(template.filename)
+        except (OSError, TypeError):
+            return time.time()
+
+    def render(self, template_name: str, context: dict) -> RenderedPage:
+        body = self.templates.get_template(template_name).render(context).encode("utf-8")
+        return RenderedPage(body, self._template_mtime(template_name))
+
+    def page(self, request: Request, template_name: str, context: dict) -> Response:
+        # Anonymous requests only: the cached bytes are shared by everyone.
+        key = (template_name, str(request.base_url))
+        page = self.pages.get(key)
+        if page is None:
+            page = self.render(template_name, {"request": request, **context})
+            self.pages.set(key, page)
+        return page_response(request, page)
+
+    def render_page(self, request: Request, template_name: str, context: dict) -> Response:
+        # Signed-in requests: rendered per user, but still conditional.
+        page = self.render(template_name, {"request": request, **context})
+        return page_response(request, page)
+
+    @pass_context
+    def _fragment(self, context, template_name: str) -> Markup:
+        # {{ fragment('header.html') }} in place of {% include %}; partials
+        # depend only on the user and the host that url_for() builds from.
+        request = context.get("request")
+        key = (template_name, context.get("username"), str(request.base_url) if request else None)
+        html = self.fragments.get(key)
+        if html is None:
+            html = Markup(self.templates.get_template(template_name).render(context.get_all()))
+            self.fragments.set(key, html)
+        return html
+
+    def invalidate(self):
+        self.pages.invalidate()
+        self.fragments.invalidate()
+
+    def stats(self) -> dict:
+        return {"pages": self.pages.stats(), "fragments": self.fragments.stats()}
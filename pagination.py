@@ -0,0 +1,74 @@
+import base64
+import json
+from typing import Optional
+from catalog import where_clause
+
+# ===== Shop sort orders =====
+# Every order ends with product_id so it is total, which is what lets a cursor
+# resume exactly after the last row it saw. Keys share one direction per sort
+# so a cursor is a single position in the order (FacetSnapshot._cursor_rank).
+DEFAULT_SORT = "rating_desc"
+
+SORT_KEYS = {
+    "rating_desc": ("DESC", ("rating", "reviews")),
+    "price_asc": ("ASC", ("effective_price",)),
+    "price_desc": ("DESC", ("effective_price",)),
+    "name_asc": ("ASC", ("product_name",)),
+    "name_desc": ("DESC", ("product_name",)),
+    "new": ("DESC", ("new", "rating")),
+}
+
+LISTING_COLUMNS = """
+    product_id, product_name, brand_name, rating, reviews,
+    price_usd, sale_price_usd, effective_price, image_url, primary_category,
+    out_of_stock, new
+"""
+
+
+def resolve_sort(sort: str) -> str:
+    return sort if sort in SORT_KEYS else DEFAULT_SORT
+
+
+def _key_expressions(sort: str) -> list:
+    direction, keys = SORT_KEYS[resolve_sort(sort)]
+    return list(keys) + ["product_id"]
+
+
+def order_by(sort: str) -> str:
+    direction, keys = SORT_KEYS[resolve_sort(sort)]
+    return ", ".join(f"{expression} {direction}" for expression in _key_expressions(sort))
+
+
+def listing_query(conditions: list, sort: str) -> str:
+    return f"""
+        SELECT {LISTING_COLUMNS}
+        FROM products
+        {where_clause(conditions)}
+        ORDER BY {order_by(sort)}
+        LIMIT :limit OFFSET :offset
+    """
+
+
+# ===== Cursors =====
+def encode_cursor(sort: str, row: dict) -> str:
+    direction, keys = SORT_KEYS[resolve_sort(sort)]
+    payload = [resolve_sort(sort)] + [row[key] for key in keys] + [row["product_id"]]
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Optional[list]:
+    # Cursors are only valid for the sort that produced them; anything that
+    # doesn't decode cleanly restarts from the first page.
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(payload, list) or not payload or payload[0] != resolve_sort(sort):
+        return None
+    values = payload[1:]
+    if len(values) != len(_key_expressions(sort)):
+        return None
+    return values
+
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional
+import bcrypt
+
+# ===== Password hashing =====
+# bcrypt is deliberately slow and only partly releases the GIL, so running it
+# in the request thread lets a burst of logins starve every other page. Hashes
+# and checks run in a bounded process pool instead, and each client IP may
+# only have a few in flight at once.
+
+DEFAULT_ROUNDS = 12
+
+
+def hash_password(password: str, rounds: int = DEFAULT_ROUNDS) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    try:
+        return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+    except (ValueError, TypeError):
+        return False
+
+
+def hash_rounds(hashed: str) -> Optional[int]:
+    # "$2b$12$<salt+hash>" -> 12
+    try:
+        return int(hashed.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int = DEFAULT_ROUNDS, max_workers: int = 2, max_per_ip: int = 2):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.max_per_ip = max_per_ip
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._in_flight = {}
+        self.rejected = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # Created on first use so importing the app doesn't fork.
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+
+    async def hash(self, password: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(), hash_password, password, self.rounds)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(), verify_password, password, hashed)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return hash_rounds(hashed) != self.rounds
+
+    @asynccontextmanager
+    async def limit(self, client_ip: str):
+        # Only touched from the event loop thread, so a plain dict is enough.
+        if self._in_flight.get(client_ip, 0) >= self.max_per_ip:
+            self.rejected += 1
+            raise HashingBusy(client_ip)
+        self._in_flight[client_ip] = self._in_flight.get(client_ip, 0) + 1
+        try:
+            yield
+        finally:
+            remaining = self._in_flight[client_ip] - 1
+            if remaining:
+                self._in_flight[client_ip] = remaining
+            else:
+                del self._in_flight[client_ip]
+
+    def stats(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "max_workers": self.max_workers,
+            "max_per_ip": self.max_per_ip,
+            "in_flight": sum(self._in_flight.values()),
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
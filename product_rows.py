@@ -0,0 +1,99 @@
+import keyword
+import threading
+import orjson
+from fastapi.responses import JSONResponse
+
+# ===== Product row types =====
+# Catalog reads used to turn every row into a dict (dict(row._mapping)): a hash
+# table plus key slots per product, a few hundred bytes each, dozens of times
+# per listing page. A row type is instead a class with __slots__ for one column
+# projection and a generated positional __init__ (the way namedtuple builds
+# its __new__), so a row is one small object built from the cursor tuple.
+# Templates read attributes as before (product.product_name); row["rating"],
+# row.get() and dict(row) keep working for code that treats rows as mappings.
+
+_types = {}
+_lock = threading.Lock()
+
+
+def parse_columns(columns: str) -> tuple:
+    # "product_id, product_name" (the SQL projections the catalog modules use).
+    return tuple(name.strip() for name in columns.replace("\n", " ").split(",") if name.strip())
+
+
+class ProductRow:
+    __slots__ = ()
+    columns = ()
+
+    def __getitem__(self, name: str):
+        if name not in self.columns:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name: str, default=None):
+        return getattr(self, name) if name in self.columns else default
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+    def keys(self) -> tuple:
+        return self.columns
+
+    def values(self) -> list:
+        return [getattr(self, name) for name in self.columns]
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.columns}
+
+    def __eq__(self, other):
+        if not isinstance(other, ProductRow):
+            return NotImplemented
+        return self.columns == other.columns and self.values() == other.values()
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.columns)
+        return f"{type(self).__name__}({fields})"
+
+
+def row_type(columns: tuple, name: str = "ProductRow") -> type:
+    # One class per column tuple, shared by every caller with that projection;
+    # the first caller's name is the one it keeps.
+    existing = _types.get(columns)
+    if existing is not None:
+        return existing
+    for column in columns:
+        if not column.isidentifier() or keyword.iskeyword(column) or column.startswith("_"):
+            raise ValueError(f"Column {column!r} can't be a row attribute")
+    arguments = ", ".join(columns)
+    body = "".join(f"\n    _row.{column} = {column}" for column in columns) or "\n    pass"
+    namespace = {}
+    exec(f"def __init__(_row, {arguments}):{body}" if columns else f"def __init__(_row):{body}", namespace)
+    cls = type(name, (ProductRow,), {"__slots__": columns, "columns": columns, "__init__": namespace["__init__"]})
+    with _lock:
+        return _types.setdefault(columns, cls)
+
+
+def from_result(result, name: str = "ProductRow") -> list:
+    # Every row of a SQLAlchemy result, typed by its column names.
+    cls = row_type(tuple(result.keys()), name)
+    return [cls(*row) for row in result]
+
+
+# ===== JSON =====
+def _default(value):
+    if isinstance(value, ProductRow):
+        return value.as_dict()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(value) -> bytes:
+    return orjson.dumps(value, default=_default)
+
+
+class RowJSONResponse(JSONResponse):
+    # Serializes row types (and plain JSON values) with orjson, skipping
+    # FastAPI's jsonable_encoder pass.
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,129 @@
+from typing import Optional
+from sqlalchemy import bindparam, text
+from cache import LRUCache, MISSING
+from product_rows import ProductRow, from_result, parse_columns, row_type
+
+# ===== Product lookups =====
+CART_COLUMNS = """
+    product_id, product_name, brand_name, price_usd, sale_price_usd,
+    effective_price, image_url, out_of_stock
+"""
+CartProduct = row_type(parse_columns(CART_COLUMNS), "CartProduct")
+CartLine = row_type(CartProduct.columns + ("quantity", "unit_price", "line_total"), "CartLine")
+
+
+def fetch_many(connection, product_ids: list, columns: str) -> dict:
+    # One primary-key IN (...) query for any number of ids.
+    if not product_ids:
+        return {}
+    query = text(f"""
+        SELECT {columns} FROM products
+        WHERE product_id IN :ids
+    """).bindparams(bindparam("ids", expanding=True))
+    result = connection.execute(query, {"ids": list(dict.fromkeys(product_ids))})
+    return {row.product_id: row for row in from_result(result)}
+
+
+class ProductLookup:
+    # With a SnapshotStore, rows come from the shared memory-mapped catalog
+    # snapshot and the per-worker detail cache is skipped; SQL (and the
+    # cache) is only used until the first snapshot is mapped.
+    #
+    # Unknown ids are remembered in missing_cache, a small cache of their
+    # own, so a flood of bad ids can't evict real records from detail_cache.
+    def __init__(self, engine, detail_cache: Optional[LRUCache] = None, snapshots=None,
+                 missing_cache: Optional[LRUCache] = None):
+        self.engine = engine
+        self.detail_cache = detail_cache if detail_cache is not None else LRUCache()
+        self.missing_cache = missing_cache if missing_cache is not None else LRUCache(
+            max_bytes=1024 * 1024, max_entries=10000, negative_ttl=self.detail_cache.negative_ttl
+        )
+        self.snapshots = snapshots
+
+    def _snapshot(self):
+        return self.snapshots.current() if self.snapshots is not None else None
+
+    def get(self, product_id: str) -> Optional[ProductRow]:
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            return snapshot.get(product_id)
+        # Full product record for the detail page. Unknown ids are cached too,
+        # so a flood of bad ids stops at the cache instead of SQLite.
+        if self.missing_cache.get(product_id) is MISSING:
+            return None
+        cached = self.detail_cache.get(product_id)
+        if cached is not None:
+            return cached
+        with self.engine.connect() as connection:
+            found = from_result(connection.execute(text("""
+                SELECT * FROM products
+                WHERE product_id = :product_id
+            """), {"product_id": product_id}), "ProductDetail")
+        if not found:
+            self.missing_cache.set_missing(product_id)
+            return None
+        product = found[0]
+        self.detail_cache.set(product_id, product)
+        return product
+
+    def get_many(self, product_ids: list, columns: str = CART_COLUMNS) -> list:
+        # Rows come back in the order asked for; unknown ids are skipped. Full
+        # records already in the detail cache cover any column projection;
+        # they are peeked at, so listings don't count as detail cache misses.
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            rows = snapshot.fetch_many(product_ids, columns)
+            return [rows[pid] for pid in product_ids if pid in rows]
+        rows = {}
+        wanted = []
+        for pid in product_ids:
+            cached = self.detail_cache.peek(pid)
+            if cached is not None:
+                rows[pid] = cached
+            elif self.missing_cache.peek(pid) is not MISSING:
+                wanted.append(pid)
+        if wanted:
+            with self.engine.connect() as connection:
+                rows.update(fetch_many(connection, wanted, columns))
+        return [rows[pid] for pid in product_ids if pid in rows]
+
+    def warm(self, limit: int = 100) -> int:
+        # Load the most-loved products ahead of their first visit: into the
+        # detail cache, or with a snapshot, into the page cache of its file.
+        with self.engine.connect() as connection:
+            product_ids = [row[0] for row in connection.execute(text("""
+                SELECT product_id FROM products
+                ORDER BY loves_count DESC
+                LIMIT :limit
+            """), {"limit": limit})]
+        for product_id in product_ids:
+            self.get(product_id)
+        return len(product_ids)
+
+    def invalidate(self, generation: Optional[int] = None, product_ids: Optional[list] = None):
+        # Used as a CatalogMetadata.on_invalidate hook; drops everything unless
+        # specific ids are given.
+        self.detail_cache.invalidate(product_ids)
+        self.missing_cache.invalidate(product_ids)
+
+    def cart_lines(self, cart_items: list):
+        quantities = {}
+        for item in cart_items:
+            try:
+                product_id = str(item["product_id"])
+                quantity = int(item["quantity"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if quantity > 0:
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+        lines = []
+        total = 0.0
+        for product in self.get_many(list(quantities)):
+            quantity = quantities[product.product_id]
+            unit_price = product.effective_price or 0.0
+            line = CartLine(*[getattr(product, name) for name in CartProduct.columns],
+                            quantity, unit_price, round(unit_price * quantity, 2))
+            total += line.line_total
+            lines.append(line)
+        return lines, round(total, 2)
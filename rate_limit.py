@@ -0,0 +1,47 @@
+import threading
+import time
+from collections import OrderedDict
+
+# ===== Per-client token bucket =====
+# Each client gets `burst` tokens that refill at `rate` per second; a request
+# spends `cost` tokens or is refused with the seconds until it could pass.
+# Buckets are kept for the `max_clients` most recently seen clients; one that
+# falls off simply starts again with a full bucket.
+
+
+class TokenBucketLimiter:
+    def __init__(self, rate: float = 10.0, burst: float = 20.0, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def acquire(self, client: str, cost: float = 1.0) -> float:
+        # 0.0 when allowed, otherwise the wait before `cost` tokens are back.
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+                self.allowed += 1
+            else:
+                wait = (cost - tokens) / self.rate if self.rate > 0 else float("inf")
+                self.rejected += 1
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self._buckets),
+            "rate": self.rate,
+            "burst": self.burst,
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,426 @@
+import argparse
+import fcntl
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+import numpy as np
+from sqlalchemy import text
+from catalog import read_identity, read_revision
+from db_config import CATALOG_DB, DatabaseSettings, build_engine
+
+# ===== Related products =====
+#   python recommendations.py build [--db URL] [--dir .recommendations]
+#   python recommendations.py similar <product_id>
+#
+# Every product becomes one sparse feature vector:
+#   ingredients  TF-IDF over the comma-separated ingredient list
+#   highlights   TF-IDF over the highlight tags
+#   category     secondary/tertiary category one-hots
+#   brand        brand one-hot
+#   price, rating  soft one-hots over log-price bands and rating bins
+# Each group is L2-normalised and weighted, so a dot product is a weighted sum
+# of per-group cosines. A fixed random projection squeezes that down to
+# `dimensions` floats, which keeps the build a handful of dense float32
+# matrix products: each primary category is scored block by block against
+# itself and only the top `k` neighbours of every product are kept.
+#
+# A build is a directory of flat files: neighbours and scores as .npy, plus
+# the card fields of every product as JSON in one blob with an offsets array.
+# Workers memory-map them, so they share one copy through the page cache and
+# a lookup is an array slice plus a few json.loads, with no SQLite access.
+# CURRENT names the live build and is replaced atomically. A build is tagged
+# with the catalog it was made from (catalog.read_identity()) and its revision,
+# and ensure_current() rebuilds when either changes. A file lock makes sure
+# only one worker builds.
+
+BUILD_COLUMNS = """
+    product_id, product_name, brand_name, rating, price_usd, sale_price_usd, effective_price, image_url,
+    ingredients, highlights, primary_category, secondary_category, tertiary_category
+"""
+CARD_FIELDS = ("product_id", "product_name", "brand_name", "rating", "price_usd", "sale_price_usd", "image_url")
+GROUP_WEIGHTS = {
+    "ingredients": 1.0,
+    "highlights": 0.6,
+    "category": 0.8,
+    "brand": 0.5,
+    "price": 0.5,
+    "rating": 0.3,
+}
+PRICE_BANDS = 12
+RATING_BINS = 8
+CURRENT = "CURRENT"
+LOCK = ".lock"
+FORMAT_VERSION = 1
+
+_SPLIT = re.compile(r"[,;\n]")
+_SPACE = re.compile(r"\s+")
+
+
+def terms(value: Optional[str]) -> list:
+    # Ingredient lists and highlights are stored as list-ish text
+    # ("['Vegan', 'Cruelty-Free']" or "Water, Glycerin, ..."); split on the
+    # separators and strip the quoting.
+    if not value:
+        return []
+    found = set()
+    for part in _SPLIT.split(value):
+        term = _SPACE.sub(" ", part.strip(" \t'\"[]().:-*").lower())
+        if 2 <= len(term) <= 60:
+            found.add(term)
+    return sorted(found)
+
+
+def _soft_bins(position: float, bins: int) -> list:
+    # Triangular weights over the two nearest bins, so nearby prices or
+    # ratings still overlap.
+    position = min(max(position, 0.0), bins - 1.0)
+    low = int(position)
+    high = min(low + 1, bins - 1)
+    if high == low:
+        return [(low, 1.0)]
+    fraction = position - low
+    return [(low, 1.0 - fraction), (high, fraction)]
+
+
+class FeatureSpace:
+    def __init__(self, max_terms: int = 2048, min_df: int = 2):
+        self.max_terms = max_terms
+        self.min_df = min_df
+        self.columns = {}
+        self.idf = {}
+
+    def _column(self, key) -> int:
+        column = self.columns.get(key)
+        if column is None:
+            column = self.columns[key] = len(self.columns)
+        return column
+
+    def fit(self, rows: list):
+        total = len(rows)
+        for group in ("ingredients", "highlights"):
+            df = Counter(term for row in rows for term in terms(row[group]))
+            kept = [term for term, n in df.most_common(self.max_terms) if n >= self.min_df]
+            for term in kept:
+                self._column((group, term))
+                self.idf[(group, term)] = math.log((1 + total) / (1 + df[term])) + 1.0
+        for row in rows:
+            for level in ("secondary_category", "tertiary_category"):
+                if row[level]:
+                    self._column(("category", level, row[level]))
+            if row["brand_name"]:
+                self._column(("brand", row["brand_name"]))
+        for band in range(PRICE_BANDS):
+            self._column(("price", band))
+        for band in range(RATING_BINS):
+            self._column(("rating", band))
+        return self
+
+    def encode(self, row) -> list:
+        # [(column, weight)] for one product.
+        groups = {group: [] for group in GROUP_WEIGHTS}
+        for group in ("ingredients", "highlights"):
+            for term in terms(row[group]):
+                key = (group, term)
+                if key in self.columns:
+                    groups[group].append((self.columns[key], self.idf[key]))
+        for level, weight in (("secondary_category", 0.5), ("tertiary_category", 1.0)):
+            key = ("category", level, row[level])
+            if key in self.columns:
+                groups["category"].append((self.columns[key], weight))
+        if ("brand", row["brand_name"]) in self.columns:
+            groups["brand"].append((self.columns[("brand", row["brand_name"])], 1.0))
+        price = row["effective_price"] or row["price_usd"]
+        if price and price > 0:
+            # Bands are log-spaced from $4 to ~$500.
+            for band, weight in _soft_bins(math.log2(price / 4.0) * PRICE_BANDS / 7.0, PRICE_BANDS):
+                groups["price"].append((self.columns[("price", band)], weight))
+        if row["rating"]:
+            for band, weight in _soft_bins((row["rating"] - 1.0) * (RATING_BINS - 1) / 4.0, RATING_BINS):
+                groups["rating"].append((self.columns[("rating", band)], weight))
+
+        encoded = []
+        for group, entries in groups.items():
+            norm = math.sqrt(sum(weight * weight for column, weight in entries))
+            if norm:
+                scale = GROUP_WEIGHTS[group] / norm
+                encoded.extend((column, weight * scale) for column, weight in entries)
+        return encoded
+
+
+def embed(rows: list, dimensions: int = 128, seed: int = 7, chunk: int = 4096) -> np.ndarray:
+    # Unit-length float32 vectors, one row per product (zeros for a product
+    # with no features at all).
+    space = FeatureSpace().fit(rows)
+    rng = np.random.default_rng(seed)
+    projection = (rng.standard_normal((max(1, len(space.columns)), dimensions)) / math.sqrt(dimensions)).astype(np.float32)
+    vectors = np.zeros((len(rows), dimensions), dtype=np.float32)
+    for start in range(0, len(rows), chunk):
+        block = rows[start:start + chunk]
+        counts, columns, weights = [], [], []
+        for row in block:
+            encoded = space.encode(row)
+            counts.append(len(encoded))
+            columns.extend(column for column, weight in encoded)
+            weights.extend(weight for column, weight in encoded)
+        if not columns:
+            continue
+        contributions = projection[np.asarray(columns, dtype=np.int64)] * np.asarray(weights, dtype=np.float32)[:, None]
+        counts = np.asarray(counts)
+        nonempty = np.flatnonzero(counts)
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        vectors[start + nonempty] = np.add.reduceat(contributions, offsets, axis=0)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def nearest_neighbours(vectors: np.ndarray, groups: list, k: int, block: int = 1024):
+    # Top-k by cosine within each group of row indexes; -1 pads groups
+    # smaller than k + 1.
+    total = len(vectors)
+    neighbours = np.full((total, k), -1, dtype=np.int32)
+    scores = np.zeros((total, k), dtype=np.float32)
+    for members in groups:
+        members = np.asarray(members, dtype=np.int64)
+        size = len(members)
+        keep = min(k, size - 1)
+        if keep <= 0:
+            continue
+        group_vectors = vectors[members]
+        for start in range(0, size, block):
+            stop = min(start + block, size)
+            similarity = group_vectors[start:stop] @ group_vectors.T
+            similarity[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+            top = np.argpartition(-similarity, keep - 1, axis=1)[:, :keep]
+            top_scores = np.take_along_axis(similarity, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            rows = members[start:stop]
+            neighbours[rows, :keep] = members[top]
+            scores[rows, :keep] = np.take_along_axis(top_scores, order, axis=1)
+    return neighbours, scores
+
+
+def card(row) -> dict:
+    return {field: row[field] for field in CARD_FIELDS}
+
+
+def _write_npy(path: str, array: np.ndarray):
+    with open(path, "wb") as f:
+        np.save(f, array)
+
+
+def build_index(engine, directory: str, k: int = 12, dimensions: int = 128) -> dict:
+    started = time.perf_counter()
+    with engine.connect() as connection:
+        revision = read_revision(connection)
+        identity = read_identity(connection)
+        rows = [row._mapping for row in connection.execute(text(f"SELECT {BUILD_COLUMNS} FROM products ORDER BY product_id"))]
+
+    vectors = embed(rows, dimensions)
+    by_category = {}
+    for index, row in enumerate(rows):
+        by_category.setdefault(row["primary_category"] or "", []).append(index)
+    neighbours, scores = nearest_neighbours(vectors, list(by_category.values()), k)
+
+    name = f"r{revision}-{int(time.time() * 1000)}"
+    builds = os.path.join(directory, "builds")
+    staging = os.path.join(builds, name + ".tmp")
+    os.makedirs(staging, exist_ok=True)
+    _write_npy(os.path.join(staging, "neighbours.npy"), neighbours)
+    _write_npy(os.path.join(staging, "scores.npy"), scores)
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    with open(os.path.join(staging, "cards.bin"), "wb") as f:
+        for index, row in enumerate(rows):
+            f.write(json.dumps(card(row), ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            offsets[index + 1] = f.tell()
+    _write_npy(os.path.join(staging, "card_offsets.npy"), offsets)
+    with open(os.path.join(staging, "product_ids.json"), "w", encoding="utf-8") as f:
+        json.dump([row["product_id"] for row in rows], f)
+    meta = {
+        "version": FORMAT_VERSION,
+        "catalog": identity,
+        "revision": revision,
+        "products": len(rows),
+        "k": k,
+        "dimensions": dimensions,
+        "built_at": time.time(),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(staging, os.path.join(builds, name))
+
+    pointer = os.path.join(directory, CURRENT + ".tmp")
+    with open(pointer, "w", encoding="utf-8") as f:
+        f.write(name)
+    os.replace(pointer, os.path.join(directory, CURRENT))
+
+    # Keep the previous build for workers that still have it mapped.
+    previous = sorted((entry for entry in os.listdir(builds) if entry != name),
+                      key=lambda entry: os.path.getmtime(os.path.join(builds, entry)))
+    for entry in previous[:-1]:
+        shutil.rmtree(os.path.join(builds, entry), ignore_errors=True)
+    return {"build": name, **meta}
+
+
+class LoadedIndex:
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, "product_ids.json"), encoding="utf-8") as f:
+            self.slots = {product_id: index for index, product_id in enumerate(json.load(f))}
+        self.neighbours = np.load(os.path.join(path, "neighbours.npy"), mmap_mode="r")
+        self.scores = np.load(os.path.join(path, "scores.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "card_offsets.npy"), mmap_mode="r")
+        self.cards = None
+        if self.offsets[-1] > 0:
+            with open(os.path.join(path, "cards.bin"), "rb") as f:
+                self.cards = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def card_bytes(self, index: int) -> bytes:
+        return self.cards[int(self.offsets[index]):int(self.offsets[index + 1])]
+
+    def card(self, index: int) -> dict:
+        return json.loads(self.card_bytes(index))
+
+
+class RelatedProducts:
+    def __init__(self, directory: str, k: int = 12, dimensions: int = 128):
+        self.directory = directory
+        self.k = k
+        self.dimensions = dimensions
+        self.build_name = None
+        self._index = None
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.unknown = 0
+        self.builds = 0
+        self.loads = 0
+
+    @property
+    def revision(self) -> Optional[int]:
+        index = self._index
+        return index.meta["revision"] if index is not None else None
+
+    def load(self) -> bool:
+        # Map whatever CURRENT points at; False if that is already loaded or
+        # nothing has been built yet.
+        try:
+            with open(os.path.join(self.directory, CURRENT), encoding="utf-8") as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return False
+        if name == self.build_name:
+            return False
+        index = LoadedIndex(os.path.join(self.directory, "builds", name))
+        with self._lock:
+            self._index, self.build_name = index, name
+        self.loads += 1
+        return True
+
+    def _matches(self, identity: str, revision: int) -> bool:
+        index = self._index
+        return (index is not None and index.meta.get("version") == FORMAT_VERSION
+                and index.meta.get("catalog") == identity and index.meta["revision"] == revision)
+
+    def ensure_current(self, engine) -> bool:
+        # Build if the loaded build was made from another catalog or an older
+        # revision of this one. Other workers wait on the lock and then load
+        # what the first one built.
+        with engine.connect() as connection:
+            revision = read_revision(connection)
+            identity = read_identity(connection)
+        self.load()
+        if self._matches(identity, revision):
+            return False
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, LOCK), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self.load()
+                if not self._matches(identity, revision):
+                    result = build_index(engine, self.directory, self.k, self.dimensions)
+                    self.builds += 1
+                    print(f"Built related products index: {result}")
+                    self.load()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return True
+
+    def _neighbours(self, index, product_id: str, limit: int) -> list:
+        self.lookups += 1
+        row = index.slots.get(product_id) if index is not None else None
+        if row is None:
+            self.unknown += 1
+            return []
+        return [neighbour for neighbour in index.neighbours[row, :limit].tolist() if neighbour >= 0]
+
+    def related(self, product_id: str, limit: int = 8) -> list:
+        index = self._index
+        return [index.card(neighbour) for neighbour in self._neighbours(index, product_id, limit)]
+
+    def related_json(self, product_id: str, limit: int = 8) -> bytes:
+        # The same list as related(), as a JSON array built from the stored
+        # card bytes.
+        index = self._index
+        cards = [index.card_bytes(neighbour) for neighbour in self._neighbours(index, product_id, limit)]
+        return b"[" + b",".join(cards) + b"]"
+
+    def similar(self, product_id: str, limit: int = 8) -> list:
+        # (product_id, score) pairs, for inspection from the command line.
+        index = self._index
+        row = index.slots.get(product_id) if index is not None else None
+        if row is None:
+            return []
+        return [(index.card(neighbour)["product_id"], round(float(score), 4))
+                for neighbour, score in zip(index.neighbours[row, :limit].tolist(), index.scores[row, :limit].tolist())
+                if neighbour >= 0]
+
+    def stats(self) -> dict:
+        index = self._index
+        return {
+            "products": len(index.slots) if index is not None else 0,
+            "revision": self.revision if index is not None else -1,
+            "lookups": self.lookups,
+            "unknown": self.unknown,
+            "builds": self.builds,
+            "loads": self.loads,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Related-products index")
+    parser.add_argument("--db", help="SQLAlchemy URL of the catalog (defaults to CATALOG_DB)")
+    parser.add_argument("--dir", default=os.getenv("RECOMMENDATIONS_DIR", ".recommendations"))
+    commands = parser.add_subparsers(dest="command", required=True)
+    builder = commands.add_parser("build", help="build and publish a new index")
+    builder.add_argument("--k", type=int, default=int(os.getenv("RECOMMENDATIONS_K", 12)))
+    builder.add_argument("--dimensions", type=int, default=128)
+    similar = commands.add_parser("similar", help="show the neighbours of one product")
+    similar.add_argument("product_id")
+    similar.add_argument("--limit", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        settings = DatabaseSettings(url=args.db) if args.db else CATALOG_DB
+        print(json.dumps(build_index(build_engine(settings), args.dir, args.k, args.dimensions)))
+        return
+    related = RelatedProducts(args.dir)
+    if not related.load():
+        print(f"No index in {args.dir}; run `python recommendations.py build` first", file=sys.stderr)
+        sys.exit(1)
+    for product_id, score in related.similar(args.product_id, args.limit):
+        print(f"{score:.4f}  {product_id}")
+
+
+if __name__ == "__main__":
+    main()
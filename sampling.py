@@ -0,0 +1,68 @@
+import random
+import threading
+from typing import Optional
+from sqlalchemy import text
+from products import fetch_many
+
+# ===== Random product sampling =====
+# ORDER BY RANDOM() sorts the whole table per request. Instead keep the ids of
+# eligible products in memory (reloaded lazily after a catalog change), draw
+# k of them with random.sample, which is O(k), and fetch those rows with one
+# primary-key IN (...) lookup.
+
+CARD_COLUMNS = "product_id, product_name, brand_name, rating, reviews, price_usd, sale_price_usd, image_url"
+
+
+class ProductSampler:
+    def __init__(self, engine, where: Optional[str] = None, columns: str = CARD_COLUMNS, snapshots=None):
+        self.engine = engine
+        self.snapshots = snapshots
+        self.where = where
+        self.columns = columns
+        self._ids = None
+        self._lock = threading.Lock()
+
+    def invalidate(self, generation: Optional[int] = None):
+        # Used as a CatalogMetadata.on_invalidate hook.
+        with self._lock:
+            self._ids = None
+
+    def _eligible_ids(self) -> list:
+        ids = self._ids
+        if ids is not None:
+            return ids
+        with self._lock:
+            if self._ids is None:
+                with self.engine.connect() as connection:
+                    self._ids = [row[0] for row in connection.execute(text(f"""
+                        SELECT product_id FROM products
+                        {f"WHERE {self.where}" if self.where else ""}
+                    """))]
+            return self._ids
+
+    def sample_ids(self, k: int) -> list:
+        ids = self._eligible_ids()
+        return random.sample(ids, min(k, len(ids)))
+
+    def fetch(self, connection, product_ids: list) -> list:
+        # The sampled rows come from the catalog snapshot when one is mapped.
+        snapshot = self.snapshots.current() if self.snapshots is not None else None
+        if snapshot is not None:
+            rows = snapshot.fetch_many(product_ids, self.columns)
+        else:
+            rows = fetch_many(connection, product_ids, self.columns)
+        return [rows[pid] for pid in product_ids if pid in rows]
+
+    def sample(self, connection, k: int) -> list:
+        return self.fetch(connection, self.sample_ids(k))
+
+    def sample_groups(self, connection, *sizes: int) -> list:
+        # One draw split into several groups, so e.g. the two home page
+        # carousels never show the same product twice.
+        products = self.sample(connection, sum(sizes))
+        groups = []
+        start = 0
+        for size in sizes:
+            groups.append(products[start:start + size])
+            start += size
+        return groups
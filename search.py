@@ -0,0 +1,245 @@
+import re
+import unicodedata
+from bisect import bisect_left
+from typing import Optional
+from sqlalchemy import text
+from cache import LRUCache
+from product_rows import from_result, row_type
+
+# ===== Full-text search over the catalog =====
+# products_fts is an FTS5 table whose rowid mirrors products.rowid, so a match
+# joins back to the product row by primary key instead of scanning the table.
+
+FTS_TABLE = "products_fts"
+
+# bm25 column weights: name, brand, categories, highlights, ingredients
+BM25_WEIGHTS = "10.0, 8.0, 3.0, 1.5, 0.5"
+
+# Letters and digits only: unicode61 treats "_" as a separator too.
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def _fts_document(row: str = "") -> str:
+    # Column list for an FTS row, read from `row` ("new." inside triggers).
+    return f"""
+        {row}product_name,
+        {row}brand_name,
+        TRIM(COALESCE({row}primary_category, '') || ' ' || COALESCE({row}secondary_category, '') || ' ' ||
+             COALESCE({row}tertiary_category, '')),
+        {row}highlights,
+        {row}ingredients
+    """
+
+
+def _create_statements() -> list:
+    return [
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+            product_name, brand_name, categories, highlights, ingredients,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3 4'
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+            INSERT INTO {FTS_TABLE} (rowid, product_name, brand_name, categories, highlights, ingredients)
+            SELECT new.rowid, {_fts_document("new.")};
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+            DELETE FROM {FTS_TABLE} WHERE rowid = old.rowid;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE ON products BEGIN
+            DELETE FROM {FTS_TABLE} WHERE rowid = old.rowid;
+            INSERT INTO {FTS_TABLE} (rowid, product_name, brand_name, categories, highlights, ingredients)
+            SELECT new.rowid, {_fts_document("new.")};
+        END
+        """,
+    ]
+
+
+def rebuild_search_index(connection):
+    connection.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    connection.execute(text(f"""
+        INSERT INTO {FTS_TABLE} (rowid, product_name, brand_name, categories, highlights, ingredients)
+        SELECT rowid, {_fts_document()} FROM products
+    """))
+
+
+def create_search_index(connection, rebuild: bool = False):
+    for statement in _create_statements():
+        connection.execute(text(statement))
+    if not rebuild:
+        indexed = connection.execute(text(f"SELECT COUNT(*) FROM {FTS_TABLE}")).scalar()
+        total = connection.execute(text("SELECT COUNT(*) FROM products")).scalar()
+        rebuild = indexed != total
+    if rebuild:
+        rebuild_search_index(connection)
+
+
+def reset_search_index(connection):
+    # An empty index with fresh triggers, for a products table that was just
+    # replaced wholesale; rebuild_search_index fills it.
+    connection.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+    for statement in _create_statements():
+        connection.execute(text(statement))
+
+
+def ensure_search_index(engine) -> bool:
+    # Built once at startup; the triggers keep it in sync with later writes.
+    try:
+        with engine.begin() as connection:
+            create_search_index(connection)
+        return True
+    except Exception as e:
+        print(f"Error building search index: {e}")
+        return False
+
+
+def build_match_query(q: str) -> Optional[str]:
+    # Every token must match; the last one is a prefix so "cera" finds "CeraVe".
+    tokens = _TOKEN_RE.findall(q.lower())
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens[:-1]]
+    terms.append(f'"{tokens[-1]}"*')
+    return " ".join(terms)
+
+
+def search_catalog(connection, q: str, limit: int = 5) -> list:
+    match = build_match_query(q)
+    if match is None:
+        return []
+    # bm25 is negative (lower is better); scaling it up by popularity lets a
+    # well-reviewed product outrank a marginally closer textual match.
+    query = text(f"""
+        SELECT p.product_id, p.product_name, p.brand_name, p.image_url
+        FROM {FTS_TABLE} f
+        JOIN products p ON p.rowid = f.rowid
+        WHERE {FTS_TABLE} MATCH :match
+        ORDER BY bm25({FTS_TABLE}, {BM25_WEIGHTS})
+                 * (1.0 + COALESCE(p.rating, 0) / 10.0 + MIN(COALESCE(p.reviews, 0), 10000) / 20000.0)
+        LIMIT :limit
+    """)
+    result = connection.execute(query, {"match": match, "limit": limit})
+    return from_result(result, "SearchHit")
+
+
+# ===== Autocomplete =====
+# The header search asks again on every keystroke: "ce", "cer", "cera"...
+# Results are cached per normalized query, and a query is first answered from
+# the longest cached query it extends: anything matching "cera" also matches
+# "cer", so if "cer" came back complete (fewer than `candidates` rows), its
+# rows filtered against "cera" are exactly the rows matching "cera". Filtered
+# answers keep the shorter query's ranking. Rows carry their FTS tokens for
+# that check, folded the way the unicode61 tokenizer folds them.
+
+SearchHit = row_type(("product_id", "product_name", "brand_name", "image_url"), "SearchHit")
+
+
+def fold_tokens(value: str) -> list:
+    # Lowercase, strip diacritics, split on anything but letters and digits.
+    if not value:
+        return []
+    decomposed = unicodedata.normalize("NFKD", value.lower())
+    return _TOKEN_RE.findall("".join(c for c in decomposed if not unicodedata.combining(c)))
+
+
+def normalize_query(q: str) -> str:
+    return " ".join(fold_tokens(q))
+
+
+def _matches(tokens: tuple, terms: list) -> bool:
+    # tokens is sorted: every term but the last must be present, the last
+    # one must prefix some token.
+    for term in terms[:-1]:
+        position = bisect_left(tokens, term)
+        if position == len(tokens) or tokens[position] != term:
+            return False
+    position = bisect_left(tokens, terms[-1])
+    return position < len(tokens) and tokens[position].startswith(terms[-1])
+
+
+class Autocomplete:
+    def __init__(self, engine, max_entries: int = 4096, ttl: float = 300.0, candidates: int = 64,
+                 max_bytes: int = 64 * 1024 * 1024):
+        self.engine = engine
+        self.candidates = candidates
+        # (complete, [(hit, sorted tokens)]) per normalized query.
+        self.cache = LRUCache(max_bytes=max_bytes, max_entries=max_entries, ttl=ttl)
+        self.hits = 0
+        self.prefix_hits = 0
+        self.queries = 0
+
+    def invalidate(self, generation: Optional[int] = None):
+        # Used as a CatalogMetadata.on_invalidate hook.
+        self.cache.invalidate()
+
+    def cached(self, key: str, limit: int = 5) -> Optional[list]:
+        # Answer from the cache alone, or None if the database is needed.
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.hits += 1
+            return [hit for hit, _ in entry[1][:limit]]
+        terms = key.split(" ")
+        for end in range(len(key) - 1, 0, -1):
+            if key[end - 1] == " ":
+                continue
+            parent = self.cache.get(key[:end])
+            if parent is None:
+                continue
+            complete, rows = parent
+            if not complete:
+                return None
+            rows = [row for row in rows if _matches(row[1], terms)]
+            self.cache.set(key, (True, rows))
+            self.prefix_hits += 1
+            return [hit for hit, _ in rows[:limit]]
+        return None
+
+    def search(self, key: str, limit: int = 5) -> list:
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = self._query(key)
+            self.cache.set(key, entry)
+        return [hit for hit, _ in entry[1][:limit]]
+
+    def _query(self, key: str) -> tuple:
+        match = build_match_query(key)
+        if match is None:
+            return True, []
+        self.queries += 1
+        query = text(f"""
+            SELECT p.product_id, p.product_name, p.brand_name, p.image_url,
+                   f.product_name, f.brand_name, f.categories, f.highlights, f.ingredients
+            FROM {FTS_TABLE} f
+            JOIN products p ON p.rowid = f.rowid
+            WHERE {FTS_TABLE} MATCH :match
+            ORDER BY bm25({FTS_TABLE}, {BM25_WEIGHTS})
+                     * (1.0 + COALESCE(p.rating, 0) / 10.0 + MIN(COALESCE(p.reviews, 0), 10000) / 20000.0)
+            LIMIT :limit
+        """)
+        with self.engine.connect() as connection:
+            result = connection.execute(query, {"match": match, "limit": self.candidates + 1}).all()
+        rows = []
+        for row in result[:self.candidates]:
+            tokens = set()
+            for document in row[4:]:
+                tokens.update(fold_tokens(document))
+            rows.append((SearchHit(*row[:4]), tuple(sorted(tokens))))
+        return len(result) <= self.candidates, rows
+
+    def stats(self) -> dict:
+        # The cache's own hit counters also count every prefix probed, so
+        # report lookups by how they were answered instead.
+        cache = self.cache.stats()
+        return {
+            "entries": cache["entries"],
+            "bytes": cache["bytes"],
+            "hits": self.hits,
+            "prefix_hits": self.prefix_hits,
+            "queries": self.queries,
+        }
@@ -0,0 +1,397 @@
+import argparse
+import fcntl
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from bisect import bisect_left
+from typing import Optional
+import numpy as np
+from catalog import read_identity, read_revision
+from db_config import CATALOG_DB, DatabaseSettings, build_engine
+from product_rows import ProductRow, parse_columns, row_type
+
+# ===== Catalog snapshot =====
+#   python snapshot.py build [--db URL] [--path .snapshots/catalog.snap]
+#   python snapshot.py get <product_id>
+#
+# A read-only, columnar copy of the products table in one file:
+#   magic, header length, JSON header, then 8-byte aligned sections:
+#   - one array per column: int64 or float64 plus a validity byte per row,
+#     or int32 codes (-1 for NULL) into the string dictionary
+#   - the string dictionary: every distinct string once, as one UTF-8 blob
+#     and an int64 offsets array
+#   - row numbers sorted by product_id, for binary-search lookups
+# Workers mmap the file and wrap the sections in numpy views, so every worker
+# shares the same page-cache pages, and reading a row never parses SQL. A new
+# version is written next to the old one and os.replace()d over it; readers
+# notice the new inode on reload() and keep the old mapping until they drop
+# it. Snapshots are tagged with the catalog they were built from (its
+# catalog.read_identity()) and its revision at the time.
+
+MAGIC = b"LUNORSNP"
+FORMAT_VERSION = 1
+ALIGN = 8
+LOCK_SUFFIX = ".lock"
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _column_kind(values: list) -> str:
+    kind = "int"
+    for value in values:
+        if value is None or isinstance(value, bool):
+            continue
+        if isinstance(value, int):
+            continue
+        if isinstance(value, float) and kind != "text":
+            kind = "real"
+            continue
+        return "text"
+    return kind
+
+
+class _ColumnBuilder:
+    # One column, filled a batch of rows at a time: int32 codes into the
+    # shared string dictionary for text, otherwise int64/float64 values plus
+    # a validity byte per row. A column whose kind only shows up in a later
+    # batch (a real among ints, a string among numbers) has its earlier
+    # batches widened or re-encoded as text.
+    RANKS = {"int": 0, "real": 1, "text": 2}
+
+    def __init__(self, name: str, strings: dict):
+        self.name = name
+        self.kind = "int"
+        self.strings = strings
+        self.chunks = []
+
+    def _codes(self, values: list) -> np.ndarray:
+        strings = self.strings
+        codes = np.empty(len(values), dtype=np.int32)
+        for position, value in enumerate(values):
+            if value is None:
+                codes[position] = -1
+            else:
+                value = value if isinstance(value, str) else str(value)
+                code = strings.get(value)
+                if code is None:
+                    code = strings[value] = len(strings)
+                codes[position] = code
+        return codes
+
+    def _numbers(self, values: list) -> tuple:
+        dtype = np.int64 if self.kind == "int" else np.float64
+        valid = np.fromiter((value is not None for value in values), dtype=np.uint8, count=len(values))
+        data = np.fromiter((0 if value is None else value for value in values), dtype=dtype, count=len(values))
+        return data, valid
+
+    def add(self, values: list):
+        kind = _column_kind(values)
+        if self.RANKS[kind] > self.RANKS[self.kind]:
+            # Earlier int batches keep their dtype until sections(), so they
+            # still read as "3" rather than "3.0" if the column becomes text.
+            if kind == "text":
+                self.chunks = [self._codes([value if ok else None for value, ok in zip(data.tolist(), valid.tolist())])
+                               for data, valid in self.chunks]
+            self.kind = kind
+        self.chunks.append(self._codes(values) if self.kind == "text" else self._numbers(values))
+
+    def sections(self) -> list:
+        if self.kind == "text":
+            return [np.concatenate(self.chunks) if self.chunks else np.empty(0, dtype=np.int32)]
+        dtype = np.int64 if self.kind == "int" else np.float64
+        if not self.chunks:
+            return [np.empty(0, dtype=dtype), np.empty(0, dtype=np.uint8)]
+        return [np.concatenate([data for data, _ in self.chunks]).astype(dtype, copy=False),
+                np.concatenate([valid for _, valid in self.chunks])]
+
+
+def build_snapshot(engine, path: str, batch_size: int = 5000) -> dict:
+    started = time.perf_counter()
+    strings = {}
+    with engine.connect() as connection:
+        # Revision first: a load that lands in between makes the snapshot
+        # newer than its tag, which only costs an extra rebuild.
+        revision = read_revision(connection)
+        identity = read_identity(connection)
+        # Rows are encoded batch_size at a time; only the encoded columns
+        # and the string dictionary grow with the catalog.
+        result = connection.exec_driver_sql("SELECT * FROM products")
+        names = list(result.keys())
+        builders = [_ColumnBuilder(name, strings) for name in names]
+        total = 0
+        for partition in result.partitions(batch_size):
+            for index, builder in enumerate(builders):
+                builder.add([row[index] for row in partition])
+            total += len(partition)
+
+    sections = []
+    columns = []
+    for builder in builders:
+        column = {"name": builder.name, "kind": builder.kind}
+        arrays = builder.sections()
+        builder.chunks = []
+        column["data"] = len(sections)
+        if len(arrays) > 1:
+            column["valid"] = len(sections) + 1
+        sections.extend(arrays)
+        columns.append(column)
+
+    encoded = [value.encode("utf-8") for value in strings]
+    string_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=string_offsets[1:])
+    string_blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    # UTF-8 bytes sort like the strings they encode (see find()).
+    product_codes = sections[columns[names.index("product_id")]["data"]].tolist()
+    product_order = np.array(sorted(range(total), key=lambda row_number: encoded[product_codes[row_number]]),
+                             dtype=np.int32)
+    header = {
+        "version": FORMAT_VERSION,
+        "catalog": identity,
+        "revision": revision,
+        "rows": total,
+        "built_at": time.time(),
+        "columns": columns,
+        "string_offsets": len(sections),
+        "string_blob": len(sections) + 1,
+        "product_order": len(sections) + 2,
+    }
+    sections.extend([string_offsets, string_blob, product_order])
+
+    # The section offsets depend on the header length and vice versa; lay
+    # them out again until the header stops growing (two or three passes).
+    header_length = 0
+    while True:
+        offset = _align(len(MAGIC) + 8 + header_length)
+        placements = []
+        for array in sections:
+            placements.append([offset, array.nbytes, array.dtype.str])
+            offset = _align(offset + array.nbytes)
+        header["sections"] = placements
+        header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        header_bytes += b" " * (_align(len(header_bytes)) - len(header_bytes))
+        if len(header_bytes) <= header_length:
+            header_bytes += b" " * (header_length - len(header_bytes))
+            break
+        header_length = len(header_bytes)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    staging = f"{path}.{os.getpid()}.tmp"
+    with open(staging, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for array, (offset, nbytes, dtype) in zip(sections, placements):
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(array.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(staging, path)
+    return {
+        "catalog": identity,
+        "revision": revision,
+        "rows": total,
+        "strings": len(strings),
+        "bytes": os.path.getsize(path),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+class CatalogSnapshot:
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.identity = os.fstat(f.fileno()).st_ino
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a catalog snapshot")
+        (length,) = struct.unpack_from("<Q", self._map, len(MAGIC))
+        header = json.loads(self._map[len(MAGIC) + 8:len(MAGIC) + 8 + length])
+        if header["version"] != FORMAT_VERSION:
+            raise ValueError(f"{path}: snapshot format {header['version']}, expected {FORMAT_VERSION}")
+        self.catalog = header.get("catalog")
+        self.revision = header["revision"]
+        self.rows = header["rows"]
+        self.built_at = header["built_at"]
+        # numpy views for whole-column scans, memoryviews for single values
+        # (indexing a memoryview is several times cheaper than a numpy scalar).
+        view = memoryview(self._map)
+        arrays, items = [], []
+        for offset, nbytes, dtype in header["sections"]:
+            dtype = np.dtype(dtype)
+            arrays.append(np.frombuffer(self._map, dtype=dtype, count=nbytes // dtype.itemsize, offset=offset))
+            items.append(view[offset:offset + nbytes].cast(dtype.char))
+        self.columns = {}
+        self._items = {}
+        for column in header["columns"]:
+            valid = column.get("valid")
+            self.columns[column["name"]] = (column["kind"], arrays[column["data"]],
+                                            arrays[valid] if valid is not None else None)
+            self._items[column["name"]] = (column["kind"] == "text", items[column["data"]],
+                                           items[valid] if valid is not None else None)
+        self.names = tuple(column["name"] for column in header["columns"])
+        self._view = view
+        self._string_offsets = items[header["string_offsets"]]
+        self._string_start = header["sections"][header["string_blob"]][0]
+        self._product_order = items[header["product_order"]]
+        self._product_codes = self._items["product_id"][1]
+
+    def _bytes(self, code: int) -> bytes:
+        offsets = self._string_offsets
+        return self._map[self._string_start + offsets[code]:self._string_start + offsets[code + 1]]
+
+    def string(self, code: int) -> str:
+        offsets = self._string_offsets
+        return str(self._view[self._string_start + offsets[code]:self._string_start + offsets[code + 1]],
+                   "utf-8")
+
+    def value(self, name: str, row: int):
+        is_text, data, valid = self._items[name]
+        if is_text:
+            code = data[row]
+            return None if code < 0 else self.string(code)
+        return data[row] if valid[row] else None
+
+    def find(self, product_id: str) -> Optional[int]:
+        # Binary search over the product_id order. UTF-8 bytes sort like the
+        # strings they encode, so nothing is decoded on the way.
+        key = product_id.encode("utf-8")
+        order, codes, string_bytes = self._product_order, self._product_codes, self._bytes
+        position = bisect_left(order, key, key=lambda row: string_bytes(codes[row]))
+        if position < len(order) and string_bytes(codes[order[position]]) == key:
+            return order[position]
+        return None
+
+    def row(self, row: int, names: Optional[tuple] = None) -> ProductRow:
+        names = names or self.names
+        value = self.value
+        return row_type(names)(*[value(name, row) for name in names])
+
+    def get(self, product_id: str) -> Optional[ProductRow]:
+        row = self.find(product_id)
+        return None if row is None else self.row(row)
+
+    def fetch_many(self, product_ids: list, columns: str) -> dict:
+        # Same shape as products.fetch_many: {product_id: row}.
+        names = self.names if columns.strip() == "*" else parse_columns(columns)
+        cls = row_type(names)
+        value = self.value
+        found = {}
+        for product_id in dict.fromkeys(product_ids):
+            row = self.find(product_id)
+            if row is not None:
+                found[product_id] = cls(*[value(name, row) for name in names])
+        return found
+
+    def column_values(self, name: str) -> list:
+        # A whole column as Python values; each distinct string is decoded once.
+        kind, data, valid = self.columns[name]
+        if kind == "text":
+            codes = data.tolist()
+            decoded = {code: self.string(code) for code in set(codes) if code >= 0}
+            decoded[-1] = None
+            return [decoded[code] for code in codes]
+        values = data.tolist()
+        if valid.all():
+            return values
+        return [value if ok else None for value, ok in zip(values, valid.tolist())]
+
+    def scan(self, names: list) -> list:
+        # Every row as a tuple of `names`, in file order.
+        return list(zip(*(self.column_values(name) for name in names)))
+
+
+class SnapshotStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.loads = 0
+
+    def current(self) -> Optional[CatalogSnapshot]:
+        return self._snapshot
+
+    def reload(self) -> bool:
+        # Map the published file if it is not the one already mapped.
+        try:
+            identity = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return False
+        current = self._snapshot
+        if current is not None and current.identity == identity:
+            return False
+        snapshot = CatalogSnapshot(self.path)
+        with self._lock:
+            self._snapshot = snapshot
+        self.loads += 1
+        return True
+
+    def _matches(self, identity: str, revision: int) -> bool:
+        snapshot = self._snapshot
+        return snapshot is not None and snapshot.catalog == identity and snapshot.revision == revision
+
+    def ensure_current(self, engine) -> bool:
+        # Rebuild if the mapped snapshot was made from another catalog or an
+        # older revision of this one; other workers wait on the lock and then
+        # map what the first one built. True when a different snapshot is now
+        # mapped.
+        with engine.connect() as connection:
+            revision = read_revision(connection)
+            identity = read_identity(connection)
+        changed = self.reload()
+        if self._matches(identity, revision):
+            return changed
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + LOCK_SUFFIX, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                changed = self.reload() or changed
+                if not self._matches(identity, revision):
+                    result = build_snapshot(engine, self.path)
+                    self.builds += 1
+                    print(f"Built catalog snapshot: {result}")
+                    changed = self.reload() or changed
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return changed
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "rows": snapshot.rows if snapshot else 0,
+            "revision": snapshot.revision if snapshot else -1,
+            "bytes": len(snapshot._map) if snapshot else 0,
+            "builds": self.builds,
+            "loads": self.loads,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar catalog snapshot")
+    parser.add_argument("--db", help="SQLAlchemy URL of the catalog (defaults to CATALOG_DB)")
+    parser.add_argument("--path", default=os.getenv("CATALOG_SNAPSHOT_PATH", ".snapshots/catalog.snap"))
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("build", help="build and publish a snapshot")
+    getter = commands.add_parser("get", help="print one product from the snapshot")
+    getter.add_argument("product_id")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        settings = DatabaseSettings(url=args.db) if args.db else CATALOG_DB
+        print(json.dumps(build_snapshot(build_engine(settings), args.path)))
+        return
+    product = CatalogSnapshot(args.path).get(args.product_id)
+    if product is None:
+        print(f"{args.product_id} is not in {args.path}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(product.as_dict(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import os
+import time
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy.exc import OperationalError
+import migrations
+import models
+
+# ===== Worker start-up =====
+# Everything a fresh worker would otherwise do lazily on its first requests:
+# schema setup, building static assets, compiling every template and filling
+# the catalog caches. The compiled templates also go to an on-disk bytecode
+# cache shared by all workers, so only the first worker after a deploy pays
+# for the Jinja parse.
+
+
+def template_bytecode_cache(directory: str) -> FileSystemBytecodeCache:
+    os.makedirs(directory, exist_ok=True)
+    return FileSystemBytecodeCache(directory)
+
+
+def prepare_databases(user_engine, catalog_write_engine, attempts: int = 5):
+    # With several workers starting at once, all of them race to create the
+    # same tables and run the same migrations; the losers get "already
+    # exists" or a busy snapshot. Retrying is enough: the next pass sees the
+    # winner's schema and has nothing left to do.
+    for attempt in range(attempts):
+        try:
+            models.Base.metadata.create_all(bind=user_engine)
+            migrations.migrate_catalog(catalog_write_engine)
+            return
+        except OperationalError as e:
+            if attempt == attempts - 1:
+                raise
+            print(f"Error preparing databases (attempt {attempt + 1}), retrying: {e}")
+            time.sleep(0.2 * (attempt + 1))
+
+
+def precompile_templates(env) -> int:
+    names = env.list_templates(filter_func=lambda name: name.endswith(".html"))
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def warm_catalog_caches(catalog_metadata, samplers: list, facet_index=None):
+    # Record the catalog revision the caches are filled from.
+    catalog_metadata.refresh_if_changed()
+    catalog_metadata.categories()
+    if facet_index is not None:
+        facet_index.refresh()
+    for sampler in samplers:
+        sampler.sample_ids(1)
+
+
+def run_startup(user_engine, catalog_write_engine, templates, catalog_metadata, samplers: list,
+                precompile: bool = True, warm: bool = True, asset_manifest=None, facet_index=None,
+                related_products=None, build_recommendations: bool = True, catalog_snapshots=None) -> dict:
+    timings = {}
+    started = time.perf_counter()
+    prepare_databases(user_engine, catalog_write_engine)
+    timings["databases"] = time.perf_counter() - started
+    if catalog_snapshots is not None:
+        # Before warming, so the facet index and samplers read from it. The
+        # first worker builds; the rest wait on the lock and map its file.
+        started = time.perf_counter()
+        try:
+            catalog_snapshots.ensure_current(catalog_write_engine)
+        except Exception as e:
+            print(f"Error preparing catalog snapshot: {e}")
+        timings["snapshot_seconds"] = time.perf_counter() - started
+    if asset_manifest is not None:
+        # Before any page renders, so asset_url() never sees an empty manifest.
+        started = time.perf_counter()
+        timings["assets"] = len(asset_manifest.ensure_built())
+        timings["assets_seconds"] = time.perf_counter() - started
+    if precompile:
+        started = time.perf_counter()
+        timings["templates"] = precompile_templates(templates.env)
+        timings["templates_seconds"] = time.perf_counter() - started
+    if warm:
+        started = time.perf_counter()
+        try:
+            warm_catalog_caches(catalog_metadata, samplers, facet_index)
+        except Exception as e:
+            print(f"Error warming catalog caches: {e}")
+        timings["warm_seconds"] = time.perf_counter() - started
+    if related_products is not None:
+        # Build only when missing or made from an older catalog revision;
+        # otherwise just map the existing files.
+        started = time.perf_counter()
+        try:
+            if build_recommendations:
+                related_products.ensure_current(catalog_write_engine)
+            else:
+                related_products.load()
+        except Exception as e:
+            print(f"Error preparing related products: {e}")
+        timings["recommendations_seconds"] = time.perf_counter() - started
+    return timings